@@ -30,6 +30,11 @@ PYTHON=python2
 %.s: %.py
 	$(PYYC) $<
 	
+# Create the .s files of all the tests with a single compiler process.
+.PHONY: compile-tests
+compile-tests:
+	$(PYYC) $(PYYCTESTS)
+
 # Create executable from your assembly .s file.
 %: %.s runtime
 	$(CC) $(CFLAGS) $< $(RUNTIME_LIB) -o $@
@@ -1,7 +1,7 @@
 from utils import flatten_list
 from utils import CONDITIONAL, UNCONDITIONAL
-from utils import EBP, EAX
 import liveness as lv
+from ir import Opcode
 # import graphviz
 
 
@@ -12,7 +12,19 @@ class BasicBlock:
         self.branch_type = None
         self.instructions = []
         self.successors = []
+        self.predecessors = []
+        # (read, write) bit vectors of the instructions
+        self.masks = None
+        # live variables on entry and on exit of the block (bit vectors)
+        self.live_in = 0
+        self.live_out = 0
+        # per instruction live sets, expanded from live_out on demand
         self.lvsets = []
+        # number of loops the block is in (see CFG.find_loops)
+        self.loop_depth = 0
+        # immediate dominator and dominator tree children (see CFG.find_dominators)
+        self.idom = None
+        self.dom_children = []
         self.eob = False
 
     def add_instruction(self, instruction):
@@ -22,6 +34,7 @@ class BasicBlock:
                 self.set_src_id(get_label(instruction))
 
         self.instructions.append(instruction)
+        self.masks = None
 
     def set_target_id(self, target_id):
         self.tgt_id = target_id
@@ -38,6 +51,20 @@ class BasicBlock:
     def get_instructions(self):
         return self.instructions
 
+    def set_instructions(self, instructions):
+        '''
+        Replace the instructions of the block. The new instructions must keep
+        the leading label and the jump at the end, the edges are not rebuilt.
+        '''
+        self.instructions = instructions
+        self.masks = None
+        self.lvsets = []
+
+    def set_instruction(self, i, instruction):
+        self.instructions[i] = instruction
+        self.masks = None
+        self.lvsets = []
+
     def set_eob(self, eob):
         self.eob = eob
 
@@ -56,10 +83,31 @@ class BasicBlock:
     def get_successors(self):
         return self.successors
 
+    def add_predecessor(self, predecessor):
+        self.predecessors.append(predecessor)
+
+    def get_predecessors(self):
+        return self.predecessors
+
+    def get_masks(self, variables):
+        '''
+        (read, write) bit vectors of the instructions, over the numbering of variables
+        '''
+        if self.masks is None:
+            self.masks = lv.instruction_masks(self.instructions, variables)
+        return self.masks
+
     def set_lvsets(self, lvsets):
         self.lvsets = lvsets
 
     def get_lvsets(self):
+        '''
+        Live sets before every instruction of the block and after the last one.
+        They are computed from live_out the first time they are asked for.
+        '''
+        if not self.lvsets:
+            lvsets = [0] * len(self.instructions) + [self.live_out]
+            self.lvsets = lv.analyze_liveness_with_cfg(self.masks, lvsets)
         return self.lvsets
 
     def __str__(self):
@@ -73,9 +121,19 @@ class BasicBlock:
 
 
 class CFG:
+    '''
+    Control flow graph of one function. It is built once and handed from
+    pass to pass (dead store elimination, gvn, interference, spilling);
+    the passes edit the instructions of the blocks in place.
+    '''
+
     def __init__(self, ir):
         self.basic_blocks = []
+        # label -> block starting with that label
+        self.blocks_by_label = {}
         self.ir = ir
+        # live sets are bit vectors over this numbering of the variables
+        self.variables = lv.Variables()
 
     def build_basic_blocks(self):
         # create a basic block for each instruction
@@ -98,6 +156,9 @@ class CFG:
             self.basic_blocks[-1].add_instruction(inst)
         # mark the end of last block
         self.basic_blocks[-1].set_eob(True)
+        for block in self.basic_blocks:
+            if block.get_src_id() is not None:
+                self.blocks_by_label[block.get_src_id()] = block
 
     def connect_basic_blocks(self):
         for idx, block in enumerate(self.basic_blocks):
@@ -111,6 +172,7 @@ class CFG:
                         "Unconditional jump to non-existent block: %s" % str(block.get_target_id()))
                 # put it back in the list of basic blocks
                 self.basic_blocks[idx].add_successor(target_block)
+                target_block.add_predecessor(block)
             elif block.branch_type == CONDITIONAL:
                 # if the last instruction is a conditional jump, there should be two successors
                 target_block = self.get_block_by_id(block.get_target_id())
@@ -119,13 +181,10 @@ class CFG:
                     raise RuntimeError(
                         "Conditional jump to non-existent block: %s" % str(block.get_target_id()))
                 self.basic_blocks[idx].add_successor(target_block)
+                target_block.add_predecessor(block)
                 # fall through block is the last block in the list
                 self.basic_blocks[idx].add_successor(self.basic_blocks[idx+1])
-
-    def initialize_lvsets(self):
-        for idx, block in enumerate(self.basic_blocks):
-            [self.basic_blocks[idx].lvsets.append(set()) for i in range(
-                len(block.get_instructions()) + 1)]
+                self.basic_blocks[idx+1].add_predecessor(block)
 
     # def export_cfg(self):
     #   '''
@@ -144,141 +203,231 @@ class CFG:
     def build_cfg(self):
         self.build_basic_blocks()
         self.connect_basic_blocks()
+        self.find_loops()
+        self.find_dominators()
         # self.export_cfg()
 
-    def lvn(self):
+    def find_loops(self):
         '''
-        Perform LVN on the CFG
-        1. Instructions that we need to handle include:
-          movl, addl, negl, pushl, popl, orl, andl, notl, shr, shl
-        2. Make sure to not mess with registers that are used in the IR
-        3. Make sure to not do anything to stack pointer or base pointer
-        4. Make sure to not handle calls and labels
+        Set the loop depth of every block.
+        A back edge is an edge to a block that is still on the depth first
+        search stack (the jump back to the label of a while). Its loop is the
+        header plus every block that reaches the source of the edge without
+        going through the header. The depth of a block is the number of
+        distinct headers whose loop contains it.
         '''
-        var_to_vn_map = {}
-        vn_to_var_map = {}
-        expr_to_vn_map = {}
-        current_value_number = 0
-        for idx, block in enumerate(self.basic_blocks):
-            for i, inst in enumerate(block.get_instructions()):
-                opcode = get_opcode(inst)
-                operands = get_operands(inst)
-                if opcode == 'movl':
-                    src = operands[0]
-                    dst = operands[1]
-                    if is_register(src) or is_memory(src):
-                        if is_var(dst):
-                            # if is_boxed_return(block, i, src):
-                            #     var_to_vn_map[dst] = current_value_number
-                            #     vn_to_var_map[current_value_number] = dst
-                            #     current_value_number += 1
-                            # else:
-                            var_to_vn_map[dst] = current_value_number
-                            vn_to_var_map[current_value_number] = dst
-                            current_value_number += 1
-                    if is_var(src):
-                        if src not in var_to_vn_map:
-                            var_to_vn_map[src] = current_value_number
-                            vn_to_var_map[current_value_number] = src
-                            current_value_number += 1
-                        src_vn = var_to_vn_map[src]
-                        var_to_vn_map[dst] = src_vn
-                        vn_to_var_map[src_vn] = dst
-                    if is_int(src):
-                        var_to_vn_map[dst] = current_value_number
-                        vn_to_var_map[current_value_number] = dst
-                        expr_to_vn_map[src] = ("const", current_value_number)
-                        current_value_number += 1
-                elif opcode == 'addl':
-                    left = operands[0]
-                    right = operands[1]
-                    dst = operands[1]
-                    # Unfortunately, because we are dealing with the IR, we will never have
-                    # a situation where left and right are both constants?
-                    if is_var(left) and is_var(right):
-                        if left not in var_to_vn_map:
-                            raise RuntimeError(
-                                "Variable not in var_to_vn_map: %s" % left)
-                        if right not in var_to_vn_map:
-                            raise RuntimeError(
-                                "Variable not in var_to_vn_map: %s" % right)
-                        left_vn = var_to_vn_map[left]
-                        right_vn = var_to_vn_map[right]
-                        expr = '%s + %s' % (left_vn, right_vn)
-                        if expr not in expr_to_vn_map:
-                            expr_to_vn_map[expr] = (
-                                "expr", current_value_number)
-                            vn_to_var_map[current_value_number] = dst
-                            var_to_vn_map[dst] = current_value_number
-                            current_value_number += 1
-                        else:
-                            vn = expr_to_vn_map[expr][1]
-                            if vn in vn_to_var_map:
-                                print vn_to_var_map[vn]
-                                # DO COPY FOLDING HERE
-                                self.basic_blocks[idx].instructions[i] = 'movl %s, %s' % (
-                                    vn_to_var_map[vn], dst)
-                                print self.basic_blocks[idx].instructions[i]
-                            var_to_vn_map[dst] = expr_to_vn_map[expr][1]
-                            vn_to_var_map[expr_to_vn_map[expr][1]] = dst
-                        print expr_to_vn_map, inst
-                    elif is_int(left) and is_var(right):
-                        if right not in var_to_vn_map:
-                            raise RuntimeError(
-                                "Variable not in var_to_vn_map: %s" % right)
-                        expr = '%s + %s' % (left, right)
-                        if expr not in expr_to_vn_map:
-                            expr_to_vn_map[expr] = (
-                                "expr", current_value_number)
-                            vn_to_var_map[current_value_number] = dst
-                            var_to_vn_map[dst] = current_value_number
-                            current_value_number += 1
-                        else:
-                            vn = expr_to_vn_map[expr][1]
-                            if vn in vn_to_var_map:
-                                # DO COPY FOLDING HERE
-                                self.basic_blocks[idx].instructions[i] = 'movl %s, %s' % (
-                                    vn_to_var_map[vn], dst)
-                            var_to_vn_map[dst] = expr_to_vn_map[expr][1]
-                            vn_to_var_map[expr_to_vn_map[expr][1]] = dst
-        return self.get_ir()
+        for block in self.basic_blocks:
+            block.loop_depth = 0
+        if not self.basic_blocks:
+            return
+        back_edges = []
+        visited = set([self.basic_blocks[0]])
+        on_stack = set([self.basic_blocks[0]])
+        stack = [(self.basic_blocks[0], iter(self.basic_blocks[0].get_successors()))]
+        while stack:
+            block, successors = stack[-1]
+            for succ in successors:
+                if succ in on_stack:
+                    back_edges.append((block, succ))
+                elif succ not in visited:
+                    visited.add(succ)
+                    on_stack.add(succ)
+                    stack.append((succ, iter(succ.get_successors())))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(block)
+
+        loops = {}
+        for tail, header in back_edges:
+            body = loops.setdefault(header, set([header]))
+            worklist = [tail]
+            while worklist:
+                block = worklist.pop()
+                if block not in body:
+                    body.add(block)
+                    worklist.extend(block.get_predecessors())
+        for body in loops.values():
+            for block in body:
+                block.loop_depth += 1
+
+    def reverse_postorder(self):
+        '''
+        The blocks reachable from the entry, in reverse postorder of a depth
+        first search: every block comes before its successors, but for the
+        targets of back edges.
+        '''
+        if not self.basic_blocks:
+            return []
+        order = []
+        entry = self.basic_blocks[0]
+        visited = set([entry])
+        stack = [(entry, iter(entry.get_successors()))]
+        while stack:
+            block, successors = stack[-1]
+            for succ in successors:
+                if succ not in visited:
+                    visited.add(succ)
+                    stack.append((succ, iter(succ.get_successors())))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+    def find_dominators(self):
+        '''
+        Set the immediate dominator and the dominator tree children of every
+        block, with the iterative algorithm of Cooper, Harvey and Kennedy over
+        the reverse postorder. The entry and the blocks that cannot be
+        reached from it have no immediate dominator.
+        return: the reachable blocks in reverse postorder
+        '''
+        order = self.reverse_postorder()
+        for block in self.basic_blocks:
+            block.idom = None
+            block.dom_children = []
+        if not order:
+            return order
+        index = dict((block, i) for i, block in enumerate(order))
+        entry = order[0]
+        entry.idom = entry
+
+        def intersect(a, b):
+            while a is not b:
+                while index[a] > index[b]:
+                    a = a.idom
+                while index[b] > index[a]:
+                    b = b.idom
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                idom = None
+                for pred in block.get_predecessors():
+                    if pred.idom is None or pred not in index:
+                        continue
+                    idom = pred if idom is None else intersect(pred, idom)
+                if idom is not block.idom:
+                    block.idom = idom
+                    changed = True
+        entry.idom = None
+        for block in order[1:]:
+            block.idom.dom_children.append(block)
+        return order
+
+    def dominance_frontiers(self, order):
+        '''
+        Dominance frontier of every reachable block: the blocks where its
+        dominance ends, that is the joins it reaches through one of their
+        predecessors without dominating the join itself.
+        The dominators must be up to date (see find_dominators).
+        param order: the reachable blocks, as returned by find_dominators
+        return: dict block -> set of blocks
+        '''
+        reachable = set(order)
+        frontiers = dict((block, set()) for block in order)
+        for block in order:
+            preds = [pred for pred in block.get_predecessors() if pred in reachable]
+            if len(preds) < 2:
+                continue
+            for pred in preds:
+                runner = pred
+                while runner is not None and runner is not block.idom:
+                    frontiers[runner].add(block)
+                    runner = runner.idom
+        return frontiers
+
+    def rebuild(self, ir):
+        '''
+        Build the blocks and their edges again from ir, after a pass removed
+        jumps or whole blocks. The numbering of the variables is kept.
+        '''
+        self.ir = ir
+        self.basic_blocks = []
+        self.blocks_by_label = {}
+        self.build_cfg()
+
+    def spill_weights(self):
+        '''
+        Spill weight of every variable: each use or definition counts
+        LOOP_WEIGHT ** (loop depth of its block), so a variable used in a
+        loop costs more to keep on the stack than one used once outside.
+        return: dict variable name -> weight
+        '''
+        weights = {}
+        for block in self.basic_blocks:
+            weight = LOOP_WEIGHT ** block.loop_depth
+            for inst in block.get_instructions():
+                for op in inst.operands:
+                    if op.is_var():
+                        weights[op.name] = weights.get(op.name, 0) + weight
+        return weights
 
     def run_dead_store_elimination(self):
         '''
-        Perform dead store elimination on the CFG
+        Perform dead store elimination on the CFG.
+        A sweep removes every store that is dead given the live sets it
+        started from, including chains of stores that only feed each other.
+        Starting from fresh liveness, the next sweep catches stores whose
+        variable was only kept live around a loop by a removed store;
+        usually it finds nothing.
         '''
-        # run fixed point analysis once so that the lvsets are populated
-        no_dead_store = False
-        while not no_dead_store:
-            old_inst_count = self.get_total_inst_count()
-            new_inst_count = self.dead_store_elimination()
-            no_dead_store = old_inst_count == new_inst_count
+        removed = True
+        while removed:
+            self.liveness_analysis()
+            removed = self.dead_store_elimination() > 0
         return self.get_ir()
 
     def dead_store_elimination(self):
-        self.run_fixed_point_liveness_analyis()
-        for idx, block in enumerate(self.basic_blocks):
-            lvsets = block.get_lvsets()
-
-            # Mark and Sweep (Mark with None)
-            for i, inst in enumerate(block.get_instructions()):
-                opcode = get_opcode(inst)
-                operands = get_operands(inst)
-                if opcode in ['movl', 'addl', 'andl', 'orl', 'shl', 'shr']:
-                    dst = operands[1]
-                    if is_var(dst) and dst not in lvsets[i + 1]:
-                        self.basic_blocks[idx].instructions[i] = None
-                elif opcode in ['negl', 'notl']:
-                    dst = operands[0]
-                    if is_var(dst) and dst not in lvsets[i + 1]:
-                        self.basic_blocks[idx].instructions[i] = None
-
-            # Remove None instructions
-            for i, inst in enumerate(block.get_instructions()):
-                if inst is None:
-                    self.basic_blocks[idx].instructions.pop(i)
-            self.basic_blocks[idx].set_lvsets([])
-        return self.get_total_inst_count()
+        '''
+        Walk every block backwards once from its live out set, dropping the
+        stores to variables that are not live and updating the live set as
+        it goes. When the live in of a block shrinks, its predecessors are
+        walked again. The blocks must hold the result of liveness_analysis.
+        return: the number of removed instructions
+        '''
+        removed = 0
+        worklist = list(self.basic_blocks)
+        on_worklist = set(worklist)
+        while worklist:
+            block = worklist.pop()
+            on_worklist.discard(block)
+            live = 0
+            for succ in block.get_successors():
+                live |= succ.live_in
+            block.live_out = live
+
+            instructions = block.get_instructions()
+            masks = block.get_masks(self.variables)
+            kept = []
+            kept_masks = []
+            for i in xrange(len(instructions) - 1, -1, -1):
+                inst = instructions[i]
+                read, write = masks[i]
+                # write is the bit of the destination when it is a variable
+                if inst.opcode in dead_store_opcodes and write and not live & write:
+                    continue
+                live = (live & ~write) | read
+                kept.append(inst)
+                kept_masks.append((read, write))
+            if len(kept) != len(instructions):
+                removed += len(instructions) - len(kept)
+                kept.reverse()
+                kept_masks.reverse()
+                block.set_instructions(kept)
+                block.masks = kept_masks
+
+            if live != block.live_in:
+                block.live_in = live
+                for pred in block.get_predecessors():
+                    if pred not in on_worklist:
+                        worklist.append(pred)
+                        on_worklist.add(pred)
+        return removed
 
     def get_total_inst_count(self):
         total_inst_count = 0
@@ -293,31 +442,45 @@ class CFG:
         return flatten_list(ir)
 
     def run_fixed_point_liveness_analyis(self):
-        # get the old global liveness sets, run liveness analysis, and get the new global liveness sets
-        # if the new global liveness sets are the same as the old global liveness sets, then we have a fixed point
-        # otherwise, we have not yet reached a fixed point
-        self.initialize_lvsets()
-        is_fixed_point = False
-        fixed_point_lvsets = []
-        while not is_fixed_point:
-            old_lvsets = self.get_global_lvsets()
-            new_lvsets = self.liveness_analysis()
-            is_fixed_point = old_lvsets == new_lvsets
-            fixed_point_lvsets = new_lvsets if is_fixed_point else fixed_point_lvsets
-        return fixed_point_lvsets
+        '''
+        Run liveness analysis to its fixed point
+        return: the live sets of the whole function, lvsets[i] is live before
+                instruction i and lvsets[i + 1] after it
+        '''
+        self.liveness_analysis()
+        return self.get_global_lvsets()
 
     def liveness_analysis(self):
-        # reverse enumerate the basic blocks
-        for idx, block in reversed(list(enumerate(self.basic_blocks))):
-            # if the block has successors, then the lvset[-1] of the block is the union of the lvset[0] of the successors
-            if len(block.get_successors()) > 0:
-                for succ in block.get_successors():
-                    block.lvsets[-1] = block.lvsets[-1].union(
-                        succ.get_lvsets()[0])
-            lvsets = lv.analyze_liveness_with_cfg(
-                block.get_instructions(), block.get_lvsets())
-            self.basic_blocks[idx].set_lvsets(lvsets)
-        return self.get_global_lvsets()
+        '''
+        Worklist liveness analysis over the blocks.
+        live_out of a block is the union of live_in of its successors, live_in
+        is live_out run backwards through the block. A block is only analyzed
+        again when the live_in of one of its successors grew, so blocks outside
+        of loops are visited once.
+        '''
+        for block in self.basic_blocks:
+            block.get_masks(self.variables)
+            block.live_in = 0
+            block.live_out = 0
+            block.set_lvsets([])
+        # Blocks are popped from the end: start with the last block since
+        # liveness flows backwards
+        worklist = list(self.basic_blocks)
+        on_worklist = set(worklist)
+        while worklist:
+            block = worklist.pop()
+            on_worklist.discard(block)
+            live_out = 0
+            for succ in block.get_successors():
+                live_out |= succ.live_in
+            block.live_out = live_out
+            live_in = lv.live_before(block.masks, live_out)
+            if live_in != block.live_in:
+                block.live_in = live_in
+                for pred in block.get_predecessors():
+                    if pred not in on_worklist:
+                        worklist.append(pred)
+                        on_worklist.add(pred)
 
     def get_global_lvsets(self):
         global_lvsets = []
@@ -331,10 +494,7 @@ class CFG:
         return global_lvsets
 
     def get_block_by_id(self, id):
-        for block in self.basic_blocks:
-            if block.get_src_id() == id:
-                return block
-        return None
+        return self.blocks_by_label.get(id)
 
     def get_blocks(self):
         return self.basic_blocks
@@ -348,78 +508,31 @@ class CFG:
         return out
 
 
+# A use inside a loop is counted as this many uses one level further out
+LOOP_WEIGHT = 10
+
+# Instructions that only write their destination; they are dead when the
+# destination variable is not live after them
+dead_store_opcodes = frozenset([Opcode.MOVL, Opcode.ADDL, Opcode.ANDL, Opcode.ORL,
+                                Opcode.SHL, Opcode.SHR, Opcode.SAR, Opcode.NEGL,
+                                Opcode.NOTL])
+
+
 def is_label(instruction):
-    return True if instruction.endswith(":") else False
+    return instruction.is_label()
 
 
 def is_jmp(instruction):
-    return True if instruction.startswith("jmp") or \
-        instruction.startswith("jle") or  \
-        instruction.startswith("jge") or  \
-        instruction.startswith("jne") or  \
-        instruction.startswith("je") or  \
-        instruction.startswith("jg") or  \
-        instruction.startswith("jl") else False
+    return instruction.is_jmp()
 
 
 def get_jmp_type(instruction):
-    opcode = instruction.split(" ")[0]
-    if opcode == "jmp":
+    if instruction.opcode is Opcode.JMP:
         return UNCONDITIONAL
-    elif opcode == "jle" or opcode == "jge" or opcode == "jne" or opcode == "je" or opcode == "jg" or opcode == "jl":
+    elif instruction.opcode in Opcode.CONDITIONAL_JUMPS:
         return CONDITIONAL
 
 
 def get_label(instruction):
-    # if the instruction is a jump then, just returnt the label
-    # which is the last word in the instruction.
-    # We can get the id from this using get_id_from_label
-    if is_jmp(instruction):
-        return instruction.split()[1]
-    return instruction.split(":")[0]
-
-
-def get_opcode(instruction):
-    return instruction.split()[0]
-
-
-def get_operands(instruction):
-    return instruction.replace(',', ' ').split()[1:]
-
-
-def is_var(operand):
-    var_flag = True
-    if '%' in operand:
-        var_flag = False
-    elif '$' in operand:
-        var_flag = False
-    return var_flag
-
-
-def is_int(operand):
-    if operand.startswith("$"):
-        return True
-    if (isinstance(operand, int)):
-        return True
-    else:
-        if operand[0] in ('-', '+'):
-            return operand[1:].isdigit()
-    return operand.isdigit()
-
-
-def is_register(operand):
-    return True if operand.startswith('%') else False
-
-
-def is_memory(operand):
-    return True if EBP in operand else False
-
-def is_boxed_return(block, idx, operand):
-    if idx < 2:
-        return False
-    if operand == EAX and \
-        block.get_instructions()[idx - 2].replace(',', 
-            ' ').split()[1] == "inject_int":
-        return True
-    return False
-        
+    # the label of a label instruction, or the target of a jump
+    return instruction.get_label()
@@ -0,0 +1,51 @@
+# client.py
+# Thin client for a compiler started with `compile.py --serve SOCKET`.
+# It only imports the standard library so that it starts much faster
+# than the compiler itself.
+import os
+import socket
+import sys
+
+
+def recv_all(conn):
+    '''
+    Read from the socket until the other side closes its write end.
+    '''
+    chunks = []
+    while True:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+def request_compile(socket_path, filenames):
+    '''
+    Ask the server listening on socket_path to compile filenames.
+    return: list of the reply lines, one per file
+    '''
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(socket_path)
+    try:
+        conn.sendall("".join(os.path.abspath(f) + "\n" for f in filenames))
+        conn.shutdown(socket.SHUT_WR)
+        return recv_all(conn).splitlines()
+    finally:
+        conn.close()
+
+
+def main(argv):
+    if len(argv) < 2:
+        print >> sys.stderr, "usage: client.py SOCKET filename..."
+        return 2
+    status = 0
+    for line in request_compile(argv[0], argv[1:]):
+        if not line.startswith("ok "):
+            print >> sys.stderr, line
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,146 +1,576 @@
+import heapq
 import utils
-from utils import num_registers, registers, REGISTER, caller_saved_registers, EBP
-from utils import SPILLFILE
+from utils import num_registers, registers, REGISTER, VARIABLE, CONST, caller_saved_registers, EBP, ECX
+from utils import register_preference
 import interferencegraph as ig
+import ir as IR
+from ir import Opcode
 
 
-def color(graph):
+def color(graph, weights=None):
+    '''
+    Color the graph with DSatur.
+    Colors below num_registers are the registers (see utils.registers),
+    the others are stack slots. Vertices that already have a color (stack
+    slots from an earlier spill round) and the caller saved registers keep it.
+    The next vertex colored is the uncolored one with the most unspillable,
+    then most saturated (distinct colors among its neighbors), then highest
+    degree, and it gets the first register of utils.register_preference
+    none of its neighbors has, or else the smallest such stack color.
+    Saturations are updated from the neighbors of the colored vertex only,
+    stale heap entries are skipped when they are popped.
+    When no register is left for a vertex, the neighbors holding the register
+    with the smallest total spill weight are moved to the stack instead if
+    they weigh less than the vertex (always for an unspillable vertex).
+    param graph: the interference graph
+    param weights: spill weight of the variables (cfg.CFG.spill_weights),
+                   without it the vertex that runs out of registers is spilled
+    return: the colored graph
+    '''
+    weights = weights or {}
     # Mapping: [0: %eax, 1: %ebx, 2: %ecx, 3: %edx, 4: %esi, 5: %edi]
-    colored_vertices = filter(lambda x: graph.get_color(
-        x) is not None, graph.get_vertices())
-    num_colors = num_registers + len(colored_vertices)
-
-    # Initialize possible colors to num colors
-    map(lambda vertex: graph.set_possible_colors(
-        vertex, range(num_colors)), graph.get_vertices())  
-
-    # Assign colors to (caller saved registers) in the graph
-    map(lambda vertex: graph.set_color(vertex, registers.index(vertex))
-        if graph.get_type(vertex) == REGISTER and vertex in caller_saved_registers else None, graph.get_vertices())
-
-    
-
-    uncolored_vertices = True
-    # While there are uncolored nodes
-    while uncolored_vertices:
-        # Remove colors that are already used in a given vertex from the possible colors of the neighboring vertices
-        for vertex in filter(lambda x: graph.get_color(x) is not None, graph.get_vertices()):
-            vertex_color = graph.get_color(vertex)
-            graph.set_possible_colors(vertex, set([vertex_color]))
+    for vertex in graph.get_vertices():
+        if graph.get_type(vertex) == REGISTER and vertex in caller_saved_registers:
+            graph.set_color(vertex, registers.index(vertex))
+
+    # color -> number of colored neighbors with that color, for every
+    # uncolored vertex; the saturation is the number of colors
+    neighbor_colors = {}
+    heap = []
+    for vertex in graph.get_vertices():
+        if graph.get_color(vertex) is None:
+            counts = {}
             for neighbor in graph.get_neighbors(vertex):
-                graph.set_possible_colors(
-                    neighbor, graph.get_possible_colors(neighbor) - set([vertex_color]))
-
-        # Get the vertex with the least possible colors
-        most_constrained_vertex = graph.get_most_constrained_vertex()
-        if most_constrained_vertex is None:
-            uncolored_vertices = False
-            break
-
-        color = num_colors
-        if len(graph.get_possible_colors(most_constrained_vertex)) == 0:
-            num_colors += 1
-            for vertex in filter(lambda x: graph.get_color(x) is None, graph.get_vertices()):
-                graph.set_possible_colors(
-                    vertex, graph.get_possible_colors(vertex) | set([color]))
-        else:
-            color = min(graph.get_possible_colors(most_constrained_vertex))
-        graph.set_color(most_constrained_vertex, color)
+                col = graph.get_color(neighbor)
+                if col is not None:
+                    counts[col] = counts.get(col, 0) + 1
+            neighbor_colors[vertex] = counts
+            heapq.heappush(heap, dsatur_key(graph, vertex, len(counts), weights))
+
+    def recount(vertex, old_color, new_color):
+        # the color of vertex changed, update the counts of its uncolored neighbors
+        for neighbor in graph.get_neighbors(vertex):
+            counts = neighbor_colors.get(neighbor)
+            if counts is None:
+                continue
+            saturation = len(counts)
+            if old_color is not None:
+                counts[old_color] -= 1
+                if counts[old_color] == 0:
+                    del counts[old_color]
+            counts[new_color] = counts.get(new_color, 0) + 1
+            if len(counts) != saturation:
+                heapq.heappush(heap, dsatur_key(graph, neighbor, len(counts), weights))
+
+    # vertices colored with a register here that can still be moved to the stack
+    evictable = set()
+    while heap:
+        _, saturation, _, _, vertex = heapq.heappop(heap)
+        counts = neighbor_colors.get(vertex)
+        # already colored, or pushed again since with another saturation
+        if counts is None or -saturation != len(counts):
+            continue
+        del neighbor_colors[vertex]
+
+        color = free_color(counts)
+        if color >= num_registers:
+            register = cheapest_register(graph, vertex, evictable, weights)
+            if register is not None:
+                for neighbor in graph.get_neighbors(vertex):
+                    if graph.get_color(neighbor) == register:
+                        slot = free_stack_color(graph, neighbor)
+                        graph.set_color(neighbor, slot)
+                        evictable.discard(neighbor)
+                        recount(neighbor, register, slot)
+                color = register
+        graph.set_color(vertex, color)
+        if (color < num_registers and graph.get_type(vertex) == VARIABLE
+                and not graph.is_unspillable(vertex)):
+            evictable.add(vertex)
+        recount(vertex, None, color)
 
     return graph
 
 
+def free_color(used):
+    '''
+    The first register in utils.register_preference that is not in used,
+    or else the smallest stack color that is not
+    '''
+    for color in register_preference:
+        if color not in used:
+            return color
+    color = num_registers
+    while color in used:
+        color += 1
+    return color
+
+
+def dsatur_key(graph, vertex, saturation, weights):
+    '''
+    Heap key of an uncolored vertex, the smallest key is colored first.
+    The spill weight and then the name break the remaining ties, so the
+    coloring is deterministic.
+    '''
+    return (not graph.is_unspillable(vertex), -saturation,
+            -graph.get_degree(vertex), -weights.get(vertex, 0), vertex)
+
+
+def cheapest_register(graph, vertex, evictable, weights):
+    '''
+    The register whose holders among the neighbors of vertex are cheapest
+    to spill, if they can all be spilled and cost less than vertex.
+    return: the register color or None
+    '''
+    costs = {}
+    for neighbor in graph.get_neighbors(vertex):
+        col = graph.get_color(neighbor)
+        if col is None or col >= num_registers:
+            continue
+        if neighbor not in evictable:
+            costs[col] = None
+        elif costs.get(col, 0) is not None:
+            costs[col] = costs.get(col, 0) + weights.get(neighbor, 0)
+    candidates = [(cost, col) for col, cost in costs.items() if cost is not None]
+    if not candidates:
+        return None
+    cost, col = min(candidates)
+    if graph.is_unspillable(vertex) or cost < weights.get(vertex, 0):
+        return col
+    return None
+
+
+def free_stack_color(graph, vertex):
+    '''
+    The smallest stack color none of the neighbors of vertex has
+    '''
+    used = set([graph.get_color(neighbor) for neighbor in graph.get_neighbors(vertex)])
+    color = num_registers
+    while color in used:
+        color += 1
+    return color
+
+
+def coalesce(graph, flow_graph):
+    '''
+    Conservative coalescing of the moves between two variables.
+    The operands of movl a, b are merged when they do not interfere, neither
+    has a color or is unspillable, and the merged vertex passes the Briggs
+    test or the George test, so coalescing never makes the graph harder to
+    color. Moves in deeper loops are tried first.
+    The blocks of flow_graph are rewritten to use the merged names and the
+    moves that became movl a, a are dropped.
+    return: the number of merged pairs
+    '''
+    moves = []
+    for block in flow_graph.get_blocks():
+        for inst in block.get_instructions():
+            if (inst.opcode is Opcode.MOVL and inst.operands[0].is_var()
+                    and inst.operands[1].is_var()):
+                moves.append((-block.loop_depth, inst.operands[0].name, inst.operands[1].name))
+    moves.sort(key=lambda move: move[0])
+
+    merged = 0
+    for _, src, dst in moves:
+        if src not in graph or dst not in graph:
+            continue
+        a = graph.get_name(src)
+        b = graph.get_name(dst)
+        if (a == b or graph.interferes(a, b)
+                or not coalescable(graph, a) or not coalescable(graph, b)):
+            continue
+        if briggs(graph, a, b) or george(graph, a, b) or george(graph, b, a):
+            graph.merge(a, b)
+            merged += 1
+
+    if merged:
+        for block in flow_graph.get_blocks():
+            instructions, renamed = rename_merged(block.get_instructions(), graph)
+            if renamed:
+                block.set_instructions(instructions)
+    return merged
+
+
+def coalescable(graph, vertex):
+    return (graph.get_type(vertex) == VARIABLE and graph.get_color(vertex) is None
+            and not graph.is_unspillable(vertex))
+
+
+def briggs(graph, a, b):
+    '''
+    Briggs test: the merged vertex has fewer than num_registers neighbors
+    of degree num_registers or more.
+    '''
+    neighbors_a = set(graph.get_neighbors(a))
+    significant = 0
+    for t in neighbors_a | set(graph.get_neighbors(b)):
+        degree = graph.get_degree(t)
+        # t loses one edge when it is a neighbor of both
+        if t in neighbors_a and graph.interferes(t, b):
+            degree -= 1
+        if degree >= num_registers:
+            significant += 1
+    return significant < num_registers
+
+
+def george(graph, a, b):
+    '''
+    George test for merging b into a: every neighbor of b already
+    interferes with a or has fewer than num_registers neighbors.
+    '''
+    for t in graph.get_neighbors(b):
+        if not graph.interferes(t, a) and graph.get_degree(t) >= num_registers:
+            return False
+    return True
+
+
+def rename_merged(ir, graph):
+    '''
+    Replace the variables merged by coalescing with the vertex they were
+    merged into and drop the moves of a variable to itself.
+    return: (instructions, whether anything changed)
+    '''
+    output = []
+    changed = False
+    for inst in ir:
+        operands = [graph.get_name(op.name) if op.is_var() and op.name in graph else op.name
+                    for op in inst.operands]
+        if operands == [op.name for op in inst.operands]:
+            output.append(inst)
+            continue
+        changed = True
+        if inst.opcode is Opcode.MOVL and operands[0] == operands[1]:
+            continue
+        output.append(IR.inst(inst.opcode, *operands))
+    return (output, changed)
+
+
 def generate_spillcode(ir, graph):
-    output = utils.InstGen()
+    output = []
     spilled = False
 
-    for line in ir:
-        stmt = list(map(lambda x: x.strip(','), line.split()))
-        if not stmt:
-            continue
+    def spill_tmpvar():
+        tmpvar = utils.tmpvar()
+        graph.add_vertex(tmpvar)
+        graph.set_unspillable(tmpvar, True)
+        return tmpvar
 
-        opcode = stmt[0]
-        if opcode == 'movl':
-            src = stmt[1]
-            dst = stmt[2]
-            if graph.get_vertex(src) is not None or graph.get_vertex(dst) is not None or EBP in src:
-                    if EBP in src and graph.get_color(dst) >= num_registers:
-                        tmpvar = utils.tmpvar()
-                        output.movl(src, tmpvar) \
-                            .movl(tmpvar, dst)
-                        graph.add_vertex(tmpvar)
-                        graph.set_unspillable(tmpvar, True)
-                        spilled = True
-                    else:
-                        output.raw_append(line)
-            elif (graph.get_color(src) >= num_registers and
-                  graph.get_color(dst) >= num_registers and
-                  graph.get_color(src) != graph.get_color(dst)):
-                tmpvar = utils.tmpvar()
-                output.movl(src, tmpvar) \
-                    .movl(tmpvar, dst)
-                graph.add_vertex(tmpvar)
-                graph.set_unspillable(tmpvar, True)
+    for inst in ir:
+        opcode = inst.opcode
+        if opcode is Opcode.MOVL:
+            src = inst.operands[0].name
+            dst = inst.operands[1].name
+            # x86 has no memory to memory move
+            if (on_stack(graph, src) and on_stack(graph, dst)
+                    and not (src in graph and graph.get_color(src) == graph.get_color(dst))):
+                tmpvar = spill_tmpvar()
+                output.append(IR.inst(Opcode.MOVL, src, tmpvar))
+                output.append(IR.inst(Opcode.MOVL, tmpvar, dst))
                 spilled = True
             else:
-                output.raw_append(line)
-        elif opcode == 'addl':
-            src = stmt[1]
-            dst = stmt[2]
-            if graph.get_vertex(dst) and graph.get_color(dst) >= num_registers:
-                tmpvar = utils.tmpvar()
-                output.movl(dst, tmpvar) \
-                    .addl(src, tmpvar) \
-                    .movl(tmpvar, dst)
-                graph.add_vertex(tmpvar)
-                graph.set_unspillable(tmpvar, True)
+                output.append(inst)
+        elif opcode is Opcode.CMPL:
+            src = inst.operands[0].name
+            dst = inst.operands[1].name
+            # nor a memory to memory compare
+            if on_stack(graph, src) and on_stack(graph, dst):
+                tmpvar = spill_tmpvar()
+                output.append(IR.inst(Opcode.MOVL, src, tmpvar))
+                output.append(IR.inst(Opcode.CMPL, tmpvar, dst))
                 spilled = True
             else:
-                output.raw_append(line)
-        elif opcode in ['shr', 'shl']:
-            src = stmt[1]
-            dst = stmt[2]
-            if graph.get_vertex(dst) and graph.get_color(dst) >= num_registers:
-                tmpvar = utils.tmpvar()
-                output.movl(dst, tmpvar)
-                if opcode == 'shr':
-                    output.shr(src, tmpvar)
-                else:
-                    output.shl(src, tmpvar)
-                output.movl(tmpvar, dst)
-                graph.add_vertex(tmpvar)
-                graph.set_unspillable(tmpvar, True)
+                output.append(inst)
+        elif opcode in IR.binary_opcodes:
+            src = inst.operands[0].name
+            dst = inst.operands[1].name
+            # the operation is done in a register, which also keeps
+            # "orl -4(%ebp), -8(%ebp)" out of the output
+            if dst in graph and graph.get_color(dst) >= num_registers:
+                tmpvar = spill_tmpvar()
+                output.append(IR.inst(Opcode.MOVL, dst, tmpvar))
+                output.append(IR.inst(opcode, src, tmpvar))
+                output.append(IR.inst(Opcode.MOVL, tmpvar, dst))
                 spilled = True
             else:
-                output.raw_append(line)
+                output.append(inst)
         else:
-            output.raw_append(line)
-    return (output.instructions, spilled)
+            output.append(inst)
+    return (output, spilled)
+
+
+def on_stack(graph, name):
+    '''
+    Whether an operand is in memory: a stack slot or a variable colored
+    with a stack color
+    '''
+    if name in graph:
+        return graph.get_color(name) >= num_registers
+    return EBP in name
+
+
+# A variable split around calls needs this many instructions using it
+# between two calls, otherwise it is cheaper to use it from the stack
+SPLIT_MIN_USES = 3
+
+
+def crosses_call(graph, vertex):
+    '''
+    Whether vertex is live across a call. %ecx is only ever written by calls,
+    so a variable interfering with it is live after one.
+    '''
+    return ECX in graph and graph.interferes(vertex, ECX)
+
+
+def split_around_calls(graph, flow_graph, done):
+    '''
+    Split the live ranges of the variables that are live across a call and
+    were colored with a stack color. Between two calls of a block, a variable
+    used at least SPLIT_MIN_USES times is replaced by a new variable that is
+    loaded from it before its first use (if that use reads it) and stored
+    back after its last write. The new variable is not live across a call,
+    so it can get a caller saved register in the next round while the
+    variable stays in its stack slot.
+    param done: the variables split in earlier rounds, they are not split
+                again; the variables split now are added
+    return: the number of new variables
+    '''
+    split_vars = set([vertex for vertex in graph.get_vertices()
+                      if graph.get_type(vertex) == VARIABLE
+                      and not graph.is_unspillable(vertex)
+                      and graph.get_color(vertex) >= num_registers
+                      and crosses_call(graph, vertex)]) - done
+    if not split_vars:
+        return 0
+    done |= split_vars
+    new_vars = 0
+    for block in flow_graph.get_blocks():
+        output = []
+        segment = []
+        split = False
+        for inst in block.get_instructions():
+            segment.append(inst)
+            if inst.opcode is Opcode.CALL:
+                segment, count = split_segment(segment, split_vars)
+                output.extend(segment)
+                segment = []
+                new_vars += count
+                split = split or count > 0
+        segment, count = split_segment(segment, split_vars)
+        output.extend(segment)
+        new_vars += count
+        if split or count > 0:
+            block.set_instructions(output)
+    return new_vars
+
+
+def split_segment(segment, split_vars):
+    '''
+    Split the variables of split_vars used often enough in a straight line
+    of instructions without calls (but for the last one).
+    return: (instructions, number of new variables)
+    '''
+    names = set([op.name for inst in segment for op in inst.operands
+                 if op.is_var() and op.name in split_vars])
+    count = 0
+    for name in sorted(names):
+        # the positions move as the loads and stores of the variables
+        # split before are inserted
+        indices = [i for i, inst in enumerate(segment)
+                   if any(op.name == name for op in inst.operands)]
+        if len(indices) < SPLIT_MIN_USES:
+            continue
+        part = utils.tmpvar()
+        first = indices[0]
+        writes = [i for i in indices if name in segment[i].writes]
+        output = []
+        for i, inst in enumerate(segment):
+            if i == first and name in inst.reads:
+                output.append(IR.inst(Opcode.MOVL, name, part))
+            if i in indices:
+                inst = IR.inst(inst.opcode, *[part if op.name == name else op.name
+                                               for op in inst.operands])
+            output.append(inst)
+            if writes and i == writes[-1]:
+                output.append(IR.inst(Opcode.MOVL, part, name))
+        segment = output
+        count += 1
+    return (segment, count)
+
+
+def pack_stack_slots(graph):
+    '''
+    Color the stack slots again so that spilled variables share as few
+    slots as possible. The variables with the same stack color form a slot,
+    two slots interfere when any of their variables do. Slots are taken by
+    decreasing degree and get the smallest stack color none of their
+    interfering slots has. Variables sharing a slot keep sharing it, so the
+    spill code (no memory to memory moves) stays valid.
+    return: (stack slots of the frame before, after), the frame reaches up
+            to the highest stack color so unused colors below it count
+    '''
+    slots = {}
+    for vertex in graph.get_vertices():
+        col = graph.get_color(vertex)
+        if col is not None and col >= num_registers:
+            slots.setdefault(col, []).append(vertex)
+    conflicts = dict((col, set()) for col in slots)
+    for col, vertices in slots.items():
+        for vertex in vertices:
+            for neighbor in graph.get_neighbors(vertex):
+                other = graph.get_color(neighbor)
+                if other != col and other in conflicts:
+                    conflicts[col].add(other)
+
+    packed = {}
+    for col in sorted(slots, key=lambda col: (-len(conflicts[col]), col)):
+        used = set([packed.get(other) for other in conflicts[col]])
+        new_color = num_registers
+        while new_color in used:
+            new_color += 1
+        packed[col] = new_color
+    for col, vertices in slots.items():
+        for vertex in vertices:
+            graph.set_color(vertex, packed[col])
+    if not slots:
+        return (0, 0)
+    return (max(slots) - num_registers + 1, max(packed.values()) - num_registers + 1)
+
+
+def rematerializable(flow_graph):
+    '''
+    The variables that always hold the same immediate or label: every
+    definition is a movl of that immediate, and every read is an operand
+    that may be an immediate, so the variable can be replaced by it.
+    return: dict variable name -> immediate ($3, $lambda_f_0)
+    '''
+    constants = {}
+    rejected = set()
+    for block in flow_graph.get_blocks():
+        for inst in block.get_instructions():
+            for name in inst.writes:
+                src = inst.operands[0]
+                if (inst.opcode is Opcode.MOVL and src.kind is CONST
+                        and constants.get(name, src.name) == src.name):
+                    constants[name] = src.name
+                else:
+                    rejected.add(name)
+            for i, op in enumerate(inst.operands):
+                if (op.name in inst.reads
+                        and IR.immediate_operands.get(inst.opcode) != i + 1):
+                    rejected.add(op.name)
+    for name in rejected:
+        constants.pop(name, None)
+    return constants
+
+
+def rematerialize(flow_graph, graph, constants):
+    '''
+    Replace the variables of constants colored with a stack color by their
+    immediate and drop their definitions, so they need neither a stack
+    slot nor spill code. Their stack color is cleared.
+    return: the number of variables replaced
+    '''
+    names = set([name for name in constants
+                 if name in graph and graph.get_color(name) >= num_registers])
+    if not names:
+        return 0
+    for block in flow_graph.get_blocks():
+        output = []
+        for inst in block.get_instructions():
+            if inst.writes & names:
+                continue
+            if inst.reads & names:
+                inst = IR.inst(inst.opcode, *[constants[op.name] if op.name in names else op.name
+                                               for op in inst.operands])
+            output.append(inst)
+        block.set_instructions(output)
+    for name in names:
+        graph.set_color(name, None)
+    return len(names)
+
+
+def allocation_weights(flow_graph, constants):
+    '''
+    Spill weights for coloring: a rematerializable variable costs nothing
+    on the stack, so it is the first one moved there
+    '''
+    weights = flow_graph.spill_weights()
+    for name in constants:
+        weights[name] = 0
+    return weights
+
+
+def spill_blocks(flow_graph, graph):
+    '''
+    Insert spill code in every block of the function.
+    Spill code never adds labels or jumps, so the edges of the CFG stay valid.
+    return: whether new spill temporaries were needed
+    '''
+    spilled = False
+    for block in flow_graph.get_blocks():
+        instructions, block_spilled = generate_spillcode(block.get_instructions(), graph)
+        if block_spilled:
+            block.set_instructions(instructions)
+            spilled = True
+    return spilled
+
+
+def carry_over_spills(graph, spilled_graph):
+    '''
+    Copy the stack colors and the unspillable flags of graph into
+    spilled_graph, the graph rebuilt after a spill round. Variables on the
+    stack keep their slot, the others are allocated again.
+    Rematerialized variables are no longer in the IR and are skipped.
+    '''
+    for vertex in graph.get_vertices():
+        if vertex not in spilled_graph:
+            continue
+        col = graph.get_color(vertex)
+        if col >= num_registers:
+            spilled_graph.set_color(vertex, col)
+        if graph.is_unspillable(vertex):
+            spilled_graph.set_unspillable(vertex, True)
 
 
-def color_and_spill(graph, IR):
-    graph = color(graph)
-    spilled = True
-    newIR, spilled = generate_spillcode(IR, graph)
-    oldIR = newIR
+def color_and_spill(graph, flow_graph, stats=None):
+    '''
+    Color the graph and insert spill code until no new spill
+    temporaries are needed.
+    param graph: the interference graph of the function
+    param flow_graph: the cfg.CFG of the function, spill code is added to its blocks
+    param stats: optional stats.PassRecord, gets the number of spill rounds,
+                 of coalesced moves, of live ranges split around calls, of
+                 rematerialized variables and of stack slots before and
+                 after pack_stack_slots
+    return: (colored graph, IR with spill code)
+    '''
+    coalesced = coalesce(graph, flow_graph)
+    constants = rematerializable(flow_graph)
+    graph = color(graph, allocation_weights(flow_graph, constants))
+    remat = rematerialize(flow_graph, graph, constants)
+    # after a split the graph is built and colored again before spilling
+    split_vars = set()
+    split = split_around_calls(graph, flow_graph, split_vars)
+    spilled = split > 0 or spill_blocks(flow_graph, graph)
     roundNo = 1
     while spilled:
-        utils.write_to_file(SPILLFILE, newIR)
-        spilled_graph = ig.create_interference_graph(
-            utils.read_file(SPILLFILE))
-        #add stack colors and unspill to new graph
-        for vertex in graph.get_vertices():
-            col = graph.get_color(vertex)
-            if col >= num_registers:
-                spilled_graph.set_color(vertex, col)
-            if graph.is_unspillable(vertex):
-                spilled_graph.set_unspillable(vertex, True)
-
-        spilled_graph = color(spilled_graph)
-        oldIR = newIR
-        newIR, spilled = generate_spillcode(
-            utils.read_file(SPILLFILE), spilled_graph)
+        spilled_graph = ig.create_interference_graph(flow_graph)
+        carry_over_spills(graph, spilled_graph)
+        coalesced += coalesce(spilled_graph, flow_graph)
+        constants = rematerializable(flow_graph)
+        spilled_graph = color(spilled_graph, allocation_weights(flow_graph, constants))
+        remat += rematerialize(flow_graph, spilled_graph, constants)
+        count = split_around_calls(spilled_graph, flow_graph, split_vars)
+        split += count
+        spilled = count > 0 or spill_blocks(flow_graph, spilled_graph)
         graph = spilled_graph
-        utils.write_to_file(SPILLFILE, oldIR)
         roundNo += 1
-    return (graph, oldIR)
+    slots, packed = pack_stack_slots(graph)
+    if stats is not None:
+        stats.set("spill_rounds", roundNo - 1)
+        stats.set("coalesced", coalesced)
+        stats.set("split", split)
+        stats.set("rematerialized", remat)
+        stats.set("stack_slots", slots)
+        stats.set("stack_slots_packed", packed)
+    return (graph, flow_graph.get_ir())
@@ -4,48 +4,220 @@ import argparse
 import uniquify as uniq
 import heapify as hpfy
 import closure as clsr
+import constfold
+import typeinfer
 import explicate
 import flatten
 import irgen
+import ir as IR
 import os
+import signal
+import socket
+import sys
+import traceback
 import reg_alloc as ra
-
-argparser = argparse.ArgumentParser(
-    description='Compile python P_0 to x86 assembly')
-argparser.add_argument('filename', metavar='filename', type=str,
-                       help='the python file to compile')
-args = argparser.parse_args()
-filename = args.filename
-
-
-raw_ast = compiler.parseFile(filename)
-
-uniquified_ast = uniq.get_uniquified_ast(raw_ast)
-
-heap_vars = hpfy.get_heap_vars(uniquified_ast)
-heapified_ast = hpfy.get_heapified_ast(uniquified_ast)
-
-closurified_ast = clsr.get_converted_ast(heapified_ast, heap_vars)
-
-# Explicate the Raw AST
-explicit_ast = explicate.get_explicated_ast(closurified_ast)
-
-fname = os.path.splitext(filename)[0] # filename without the extension
-utils.write_to_file(fname+ "_flat", flatten.get_flattened_statements(explicit_ast), ".py")
-
-
-# Flatten the Explicit AST
-flattened_ast = flatten.get_flattened_ast(explicit_ast)
-
-
-# # Generate IR
-ir_list = irgen.get_ir_list(flattened_ast)
-
-# print IR to the .ir file for debugging
-utils.write_to_file(fname + "_flat", utils.flatten_list(ir_list), ".ir")
-
-# Register Allocation and Assigning Home
-x86asm_list = ra.reg_alloc(ir_list)
-
-
-utils.write_to_file(filename, utils.flatten_list(x86asm_list), suffix=".s")
+import stats as ps
+import quality
+from client import recv_all
+
+
+def compile_file(filename, stats=None, debug_dir=None, allocator=ra.GRAPH):
+    '''
+    Run the whole pipeline on a single python file and write
+    the x86 assembly next to it (foo.py -> foo.s).
+    param filename: the python file to compile
+    param stats: optional stats.PassStats collecting per pass measurements
+    param debug_dir: if given, intermediate dumps (foo_flat.py, foo_flat.ir,
+                     IR after every backend pass) are written to this directory
+    param allocator: the register allocator, ra.GRAPH or ra.LINEAR
+    '''
+    stats = stats or ps.disabled
+    debug_prefix = None
+    if debug_dir is not None:
+        if not os.path.isdir(debug_dir):
+            os.makedirs(debug_dir)
+        # filename without the directory and the extension
+        debug_prefix = os.path.join(debug_dir, os.path.splitext(os.path.basename(filename))[0])
+
+    # Every compile starts from the same temporary counter so that the
+    # output does not depend on what was compiled before in this process
+    utils.reset_tmpvar()
+    IR.reset_operands()
+
+    with stats.timed("parse") as rec:
+        raw_ast = compiler.parseFile(filename)
+    rec.ast(raw_ast)
+
+    with stats.timed("uniquify") as rec:
+        uniquified_ast = uniq.get_uniquified_ast(raw_ast)
+    rec.ast(uniquified_ast)
+
+    with stats.timed("heapify") as rec:
+        heap_vars = hpfy.get_heap_vars(uniquified_ast)
+        heapified_ast = hpfy.get_heapified_ast(uniquified_ast)
+    rec.ast(heapified_ast)
+    rec.set("heap_vars", len(heap_vars))
+
+    with stats.timed("closure") as rec:
+        closurified_ast = clsr.get_converted_ast(heapified_ast, heap_vars)
+    rec.ast(closurified_ast)
+
+    with stats.timed("constfold") as rec:
+        folded_ast, folded = constfold.get_folded_ast(closurified_ast)
+    rec.ast(folded_ast)
+    rec.set("folded", folded)
+
+    # Find the expressions whose type is known before running
+    with stats.timed("typeinfer") as rec:
+        types = typeinfer.get_types(folded_ast)
+    rec.set("typed", len(types))
+
+    # Explicate the Raw AST
+    with stats.timed("explicate") as rec:
+        explicit_ast = explicate.get_explicated_ast(folded_ast, types)
+    rec.ast(explicit_ast)
+
+    # Flatten the Explicit AST
+    with stats.timed("flatten") as rec:
+        flattened_ast = flatten.get_flattened_ast(explicit_ast)
+    rec.ast(flattened_ast)
+
+    if debug_prefix is not None:
+        with stats.timed("dump_flat_py"):
+            utils.write_debug_file(debug_prefix, "_flat.py", flatten.get_flattened_statements(flattened_ast))
+
+
+    # # Generate IR
+    with stats.timed("irgen") as rec:
+        ir_list = irgen.get_ir_list(flattened_ast)
+    rec.ir(utils.flatten_list(ir_list))
+    rec.set("functions", len(ir_list))
+
+    # print IR to the .ir file for debugging
+    if debug_prefix is not None:
+        with stats.timed("dump_flat_ir"):
+            utils.write_debug_file(debug_prefix, "_flat.ir", IR.to_text(utils.flatten_list(ir_list)))
+
+    # Register Allocation and Assigning Home
+    x86asm_list = ra.reg_alloc(ir_list, stats, debug_prefix, allocator)
+
+
+    with stats.timed("emit") as rec:
+        utils.write_to_file(filename, utils.flatten_list(x86asm_list), suffix=".s")
+    rec.set("x86_insts", len(utils.flatten_list(x86asm_list)))
+
+
+def compile_files(filenames, stats_format=None, debug_dir=None, allocator=ra.GRAPH,
+                  quality_report=False):
+    '''
+    Compile every file in filenames in this process.
+    A failing file does not stop the rest of the batch.
+    param stats_format: None, "text" (table on stderr) or
+                        "json" (written to foo.stats.json)
+    param debug_dir: directory for the intermediate dumps of every file
+    param allocator: the register allocator, ra.GRAPH or ra.LINEAR
+    param quality_report: write the code quality of every function
+                          to foo.quality.json
+    return: list of (filename, error message) for the files that failed
+    '''
+    failures = []
+    for filename in filenames:
+        # the quality report is made from the pass statistics
+        stats = ps.PassStats(filename) if stats_format or quality_report else None
+        try:
+            compile_file(filename, stats, debug_dir, allocator)
+        except Exception:
+            traceback.print_exc()
+            failures.append((filename, traceback.format_exc().splitlines()[-1]))
+            continue
+        if quality_report:
+            utils.write_to_file(filename, [quality.to_json(quality.quality_report(stats))],
+                                suffix=".quality.json")
+        if stats_format == "json":
+            utils.write_to_file(filename, [stats.to_json()], suffix=".stats.json")
+        elif stats_format == "text":
+            print >> sys.stderr, stats.format_table()
+    return failures
+
+
+def serve(socket_path, allocator=ra.GRAPH, stats_format=None, debug_dir=None,
+          quality_report=False):
+    '''
+    Keep the compiler warm and compile files on demand.
+    The protocol is line based: a client sends one absolute path per line
+    and closes its write end. The server answers with one line per file,
+    "ok <file>" or "error <file>: <message>".
+    param socket_path: the unix socket to listen on
+    param allocator: the register allocator used for every file
+    param stats_format, debug_dir, quality_report: as for compile_files,
+                        applied to every file
+    '''
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+    # Leave through the finally below (and remove the socket) when killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                request = recv_all(conn)
+                reply = []
+                for filename in request.splitlines():
+                    if not filename:
+                        continue
+                    failures = compile_files([filename], stats_format, debug_dir,
+                                             allocator, quality_report)
+                    if failures:
+                        reply.append("error %s: %s" % failures[0])
+                    else:
+                        reply.append("ok %s" % filename)
+                conn.sendall("\n".join(reply) + "\n")
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def main(argv):
+    argparser = argparse.ArgumentParser(
+        description='Compile python P_0 to x86 assembly')
+    argparser.add_argument('filenames', metavar='filename', type=str, nargs='*',
+                           help='the python file(s) to compile')
+    argparser.add_argument('--serve', metavar='SOCKET', type=str, default=None,
+                           help='stay resident and compile files sent over the unix socket SOCKET')
+    argparser.add_argument('--stats', choices=['text', 'json'], default=None,
+                           help='record time, peak memory growth and sizes of every pass; '
+                                'text prints a table on stderr, json writes foo.stats.json')
+    argparser.add_argument('--time-passes', dest='stats', action='store_const', const='text',
+                           help='same as --stats=text')
+    argparser.add_argument('--emit-debug', metavar='DIR', type=str, default=None,
+                           help='write the flattened program and the IR after every pass to DIR')
+    argparser.add_argument('--regalloc', choices=ra.allocators, default=ra.GRAPH,
+                           help='register allocator: graph coloring (default) or '
+                                'linear scan, which compiles faster but spills more')
+    argparser.add_argument('--quality-report', action='store_true',
+                           help='write the registers used, spills, frame size and moves '
+                                'of every function to foo.quality.json')
+    args = argparser.parse_args(argv)
+
+    if args.serve is not None:
+        if args.filenames:
+            argparser.error('--serve compiles the files sent over the socket, '
+                            'not files given on the command line')
+        serve(args.serve, args.regalloc, args.stats, args.emit_debug, args.quality_report)
+        return 0
+
+    if not args.filenames:
+        argparser.error('no input files')
+
+    failures = compile_files(args.filenames, args.stats, args.emit_debug, args.regalloc,
+                             args.quality_report)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,307 @@
+# constfold.py
+# Constant folding and propagation over the closure converted AST, run
+# before typeinfer. Operations on constants are computed at compile time,
+# branches whose test is a constant are replaced by the branch that runs,
+# and a variable assigned exactly once, from a constant, is replaced by the
+# constant everywhere in its function.
+# Constants are ints (Const) and bools (the names True and False).
+import compiler
+from compiler.ast import Const
+from compiler.ast import Name
+from compiler.ast import Discard
+from compiler.ast import Assign
+from compiler.ast import AssName
+from compiler.ast import Module
+from compiler.ast import Add
+from compiler.ast import Stmt
+from compiler.ast import UnarySub
+from compiler.ast import Printnl
+from compiler.ast import IfExp
+from compiler.ast import And
+from compiler.ast import Or
+from compiler.ast import Not
+from compiler.ast import Compare
+from compiler.ast import List
+from compiler.ast import Subscript
+from compiler.ast import Dict
+from compiler.ast import Function
+from compiler.ast import Return
+from compiler.ast import CallFunc
+from compiler.ast import While
+from compiler.ast import If
+from closure import GetFunPtr, GetFreeVars
+
+
+def value_of(node):
+    '''
+    The value of a constant expression (an int or a bool), None if node
+    is not a constant
+    '''
+    if isinstance(node, Const):
+        return node.value
+    if isinstance(node, Name) and node.name in ['True', 'False']:
+        return node.name == 'True'
+    return None
+
+
+def constant(value):
+    '''
+    The expression of a constant value
+    '''
+    if isinstance(value, bool):
+        return Name(str(value))
+    return Const(value)
+
+
+def compare(op, left, right):
+    '''
+    Value of a comparison of two constants. The runtime compares the tagged
+    values for is, so an int is never a bool.
+    '''
+    if op == '==':
+        return left == right
+    if op == '!=':
+        return left != right
+    same = type(left) == type(right) and left == right
+    return same if op == 'is' else not same
+
+
+def statements(node):
+    '''
+    The statements of a folded statement: a folded if is the Stmt of the
+    branch that runs, a dropped statement is None
+    '''
+    if node is None:
+        return []
+    if isinstance(node, Stmt):
+        return node.nodes
+    return [node]
+
+
+class ConstantFoldingVisitor(compiler.visitor.ASTVisitor):
+    '''
+    Rebuild the AST with the constant expressions folded. Statements return
+    a statement, a Stmt to splice in their place, or None to drop them.
+    '''
+
+    def __init__(self, constants):
+        self.folded_ast = None
+        # function name -> (variable -> value) of the propagated variables
+        self.constants = constants
+        self.env = {}
+        # number of expressions replaced by a constant
+        self.folded = 0
+
+    def fold(self, value):
+        self.folded += 1
+        return constant(value)
+
+    # Statements
+
+    def visitModule(self, node):
+        self.folded_ast = Module(None, self.visit(node.node))
+
+    def visitStmt(self, node):
+        children = []
+        for child in node.nodes:
+            children.extend(statements(self.visit(child)))
+        return Stmt(children)
+
+    def visitFunction(self, node):
+        self.env = self.constants.get(node.name, {})
+        body = self.visit(node.code)
+        return Function(node.decorators, node.name, node.argnames, node.defaults,
+                        node.flags, node.doc, body)
+
+    def visitAssign(self, node):
+        target = node.nodes[0]
+        if isinstance(target, AssName) and target.name in self.env:
+            # every read of the variable is replaced by its value
+            return None
+        return Assign([self.visit(target)], self.visit(node.expr))
+
+    def visitAssName(self, node):
+        return node
+
+    def visitDiscard(self, node):
+        expr = self.visit(node.expr)
+        if value_of(expr) is not None:
+            return None
+        return Discard(expr)
+
+    def visitPrintnl(self, node):
+        return Printnl([self.visit(node.nodes[0])], None)
+
+    def visitReturn(self, node):
+        return Return(self.visit(node.value))
+
+    def visitIf(self, node):
+        test = self.visit(node.tests[0][0])
+        value = value_of(test)
+        if value is None:
+            else_ = self.visit(node.else_) if node.else_ is not None else None
+            return If([(test, self.visit(node.tests[0][1]))], else_)
+        self.folded += 1
+        if value:
+            return self.visit(node.tests[0][1])
+        return self.visit(node.else_) if node.else_ is not None else None
+
+    def visitWhile(self, node):
+        test = self.visit(node.test)
+        value = value_of(test)
+        if value is not None and not value:
+            self.folded += 1
+            return None
+        return While(test, self.visit(node.body), None)
+
+    # Expressions
+
+    def visitConst(self, node):
+        return node
+
+    def visitName(self, node):
+        if node.name in self.env:
+            return self.fold(self.env[node.name])
+        return node
+
+    def visitAdd(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        lvalue = value_of(left)
+        rvalue = value_of(right)
+        if lvalue is not None and rvalue is not None:
+            return self.fold(int(lvalue + rvalue))
+        return Add((left, right))
+
+    def visitUnarySub(self, node):
+        expr = self.visit(node.expr)
+        value = value_of(expr)
+        if value is not None:
+            return self.fold(int(-value))
+        return UnarySub(expr)
+
+    def visitCompare(self, node):
+        expr = self.visit(node.expr)
+        ops = [(op, self.visit(child)) for op, child in node.ops]
+        left = value_of(expr)
+        right = value_of(ops[0][1])
+        if len(ops) == 1 and left is not None and right is not None:
+            return self.fold(compare(ops[0][0], left, right))
+        return Compare(expr, ops)
+
+    def visitNot(self, node):
+        expr = self.visit(node.expr)
+        value = value_of(expr)
+        if value is not None:
+            return self.fold(not value)
+        return Not(expr)
+
+    def visitAnd(self, node):
+        return self.logical(And, [self.visit(child) for child in node.nodes], False)
+
+    def visitOr(self, node):
+        return self.logical(Or, [self.visit(child) for child in node.nodes], True)
+
+    def logical(self, cls, nodes, stop):
+        '''
+        Fold the constant operands at the start of an and (stop is False)
+        or an or (stop is True): an operand whose truth is stop is the
+        value, the others are skipped.
+        '''
+        while len(nodes) > 1:
+            value = value_of(nodes[0])
+            if value is None:
+                break
+            self.folded += 1
+            if bool(value) == stop:
+                return nodes[0]
+            nodes = nodes[1:]
+        if len(nodes) == 1:
+            return nodes[0]
+        return cls(nodes)
+
+    def visitIfExp(self, node):
+        test = self.visit(node.test)
+        value = value_of(test)
+        if value is None:
+            return IfExp(test, self.visit(node.then), self.visit(node.else_))
+        self.folded += 1
+        return self.visit(node.then) if value else self.visit(node.else_)
+
+    def visitList(self, node):
+        return List([self.visit(child) for child in node.nodes])
+
+    def visitDict(self, node):
+        return Dict([(self.visit(key), self.visit(value)) for key, value in node.items])
+
+    def visitSubscript(self, node):
+        return Subscript(self.visit(node.expr), node.flags,
+                         [self.visit(sub) for sub in node.subs])
+
+    def visitCallFunc(self, node):
+        return CallFunc(self.visit(node.node), [self.visit(arg) for arg in node.args])
+
+    def visitCreateClosure(self, node):
+        return node
+
+    def visitGetFunPtr(self, node):
+        return GetFunPtr(self.visit(node.func))
+
+    def visitGetFreeVars(self, node):
+        return GetFreeVars(self.visit(node.func))
+
+
+def find_constants(function):
+    '''
+    The variables of a function assigned exactly once, from a constant.
+    Parameters are left out. The variables a closure is created with are
+    heapified, they are assigned a list.
+    return: dict variable -> value
+    '''
+    assigned = dict((name, None) for name in function.argnames)
+    constants = {}
+    work = [function.code]
+    while work:
+        node = work.pop()
+        if isinstance(node, Stmt):
+            work.extend(node.nodes)
+        elif isinstance(node, If):
+            work.append(node.tests[0][1])
+            if node.else_ is not None:
+                work.append(node.else_)
+        elif isinstance(node, While):
+            work.append(node.body)
+        elif isinstance(node, Assign) and isinstance(node.nodes[0], AssName):
+            name = node.nodes[0].name
+            if name in assigned:
+                constants.pop(name, None)
+            else:
+                value = value_of(node.expr)
+                if value is not None:
+                    constants[name] = value
+            assigned[name] = None
+    return constants
+
+
+def get_folded_ast(node):
+    '''
+    Fold the constants of a closure converted AST until nothing changes:
+    folding an expression or a branch can leave more variables assigned
+    once from a constant.
+    return: (the folded AST, number of expressions folded)
+    '''
+    constants = {}
+    folded = 0
+    while True:
+        visitor = compiler.visitor.walk(node, ConstantFoldingVisitor(constants))
+        node = visitor.folded_ast
+        folded += visitor.folded
+        found = False
+        for function in node.node.nodes:
+            env = constants.setdefault(function.name, {})
+            for name, value in find_constants(function).iteritems():
+                if name not in env:
+                    env[name] = value
+                    found = True
+        if not found:
+            return (node, folded)
@@ -29,6 +29,7 @@ from compiler.ast import If
 import utils
 from utils import INT, BOOL, BIG
 import uniquify
+from typeinfer import is_small, int_variables
 from closure import GetFunPtr, GetFreeVars, CreateClosure
 
 # Setup for Dynamic Dispatch
@@ -93,6 +94,32 @@ class AddBig(Add):
         return "AddBig(%s)" % (str(self.asList()))
 
 
+class AddInt(Add):
+    '''
+    Add of two untagged ints, the result is untagged
+    '''
+    def __repr__(self):
+        return "AddInt(%s)" % (str(self.asList()))
+
+
+class UnarySubInt(UnarySub):
+    '''
+    Negation of an untagged int, the result is untagged
+    '''
+    def __repr__(self):
+        return "UnarySubInt(%s)" % (repr(self.expr))
+
+
+class CompareInt(Compare):
+    '''
+    Compare of two untagged ints: no tag test and no comparison of bigs.
+    The result is a tagged bool, except in the test of an if, where the
+    branch jumps on the comparison (see ExplicateVisitor.branch_test).
+    '''
+    def __repr__(self):
+        return "CompareInt(%s, %s)" % (repr(self.expr), repr(self.ops))
+
+
 class IsTrue(IsInt):
     def __repr__(self):
         return self.printName('IsTrue')
@@ -108,8 +135,12 @@ class TypeError(Node):
 
 # Explicate Nodes
 class ExplicateVisitor(compiler.visitor.ASTVisitor):
-    def __init__(self):
+    def __init__(self, types=None):
         self.explicit_ast = None
+        # expression node -> INT, BOOL or BIG, from typeinfer
+        self.types = types or {}
+        # variables of the current function holding untagged ints
+        self.int_vars = set()
 
     # Handle NonP2 Specific Nodes
 
@@ -133,7 +164,10 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
     # Handle Assign
 
     def visitAssign(self, node):
-        return Assign([self.visit(node.nodes[0])], self.visit(node.expr))
+        target = node.nodes[0]
+        if isinstance(target, AssName) and target.name in self.int_vars:
+            return Assign([target], self.unboxed(node.expr))
+        return Assign([self.visit(target)], self.visit(node.expr))
 
     # Handle AssName
 
@@ -156,8 +190,41 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
         if node.name in ['True', 'False']:
             return InjectFrom(BOOL,
                               Const(0) if node.name == 'False' else Const(1))
+        if node.name in self.int_vars:
+            # the value escapes to code expecting a tagged value
+            return InjectFrom(INT, node)
         return node
 
+    def unboxed(self, node):
+        '''
+        Explicate an expression of type int or bool (see typeinfer) to
+        its untagged value
+        '''
+        if isinstance(node, Const):
+            return node
+        if isinstance(node, Name):
+            if node.name in ['True', 'False']:
+                return Const(0) if node.name == 'False' else Const(1)
+            if node.name in self.int_vars:
+                return node
+        elif isinstance(node, Add):
+            left = self.unboxed(node.left)
+            right = self.unboxed(node.right)
+            if isinstance(left, Const) and isinstance(right, Const):
+                return Const(left.value + right.value)
+            return AddInt((left, right))
+        elif isinstance(node, UnarySub) and is_small(self.types.get(node.expr)):
+            operand = self.unboxed(node.expr)
+            if isinstance(operand, Const):
+                return Const(-operand.value)
+            return UnarySubInt(operand)
+        elif isinstance(node, IfExp):
+            return IfExp(self.branch_test(node.test), self.unboxed(node.then),
+                         self.unboxed(node.else_))
+        elif is_input(node):
+            return CallFunc(node.node, [])
+        return ProjectTo(self.types[node], self.visit(node))
+
     # Handle Add
 
     def visitAdd(self, node):
@@ -176,6 +243,8 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
 
         Use temporary variables to store the lhs and rhs until the 
         dynamic dispatch is done. (Accomplished by using `Let`)
+        Only the operands whose type typeinfer could not find are
+        checked, and only for the branches that can still run.
         '''
 
         # Check if lhs and rhs are both ints or bools
@@ -196,33 +265,51 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
             
 
 
+        left_type = self.types.get(node.left)
+        right_type = self.types.get(node.right)
+        if is_small(left_type) and is_small(right_type):
+            return InjectFrom(INT, self.unboxed(node))
+        if left_type == BIG and right_type == BIG:
+            return InjectFrom(BIG, AddBig((ProjectTo(BIG, self.visit(node.left)),
+                                           ProjectTo(BIG, self.visit(node.right)))))
+
         ltemp = Name(utils.tmpvar())
         rtemp = Name(utils.tmpvar())
-        big_check = And([InjectFrom(INT, IsBig(ltemp)),
-                        InjectFrom(INT, IsBig(rtemp))])
-
-        ltemp_check = Or([InjectFrom(INT, IsInt(ltemp)),
-                         InjectFrom(INT, IsBool(ltemp))])
-        rtemp_check = Or([InjectFrom(INT, IsInt(rtemp)),
-                         InjectFrom(INT, IsBool(rtemp))])
+        int_add = InjectFrom(INT, Add((ltemp, rtemp)))
+        big_add = InjectFrom(BIG, AddBig((ProjectTo(BIG, ltemp), ProjectTo(BIG, rtemp))))
+        type_error = TypeError("Unsupported Types for Addition")
+
+        if is_small(left_type) and right_type is None:
+            dispatch = IfExp(small_check(rtemp), int_add, type_error)
+        elif is_small(right_type) and left_type is None:
+            dispatch = IfExp(small_check(ltemp), int_add, type_error)
+        elif left_type == BIG and right_type is None:
+            dispatch = IfExp(InjectFrom(BOOL, IsBig(rtemp)), big_add, type_error)
+        elif right_type == BIG and left_type is None:
+            dispatch = IfExp(InjectFrom(BOOL, IsBig(ltemp)), big_add, type_error)
+        else:
+            big_check = And([InjectFrom(BOOL, IsBig(ltemp)),
+                            InjectFrom(BOOL, IsBig(rtemp))])
+            dispatch = IfExp(And([small_check(ltemp), small_check(rtemp)]),
+                             int_add,
+                             IfExp(big_check, big_add, type_error))  # Type Error
 
         return Let(ltemp, self.visit(node.left),
-                   Let(rtemp, self.visit(node.right),
-                       IfExp(And([ltemp_check, rtemp_check]),
-                             InjectFrom(INT, Add((ltemp, rtemp))),
-                             IfExp(big_check,
-                                   InjectFrom(BIG, AddBig(
-                                       (ProjectTo(BIG, ltemp), ProjectTo(BIG, rtemp)))),
-                                   TypeError("Unsupported Types for Addition")))))  # Type Error
+                   Let(rtemp, self.visit(node.right), dispatch))
 
     # Handle UnarySub
 
     def visitUnarySub(self, node):
+        if is_small(self.types.get(node.expr)):
+            return InjectFrom(INT, self.unboxed(node))
         return InjectFrom(INT, UnarySub(self.visit(node.expr)))
 
     # Handle CallFunc
 
     def visitCallFunc(self, node):
+        if is_input(node):
+            # input() returns an untagged int
+            return InjectFrom(INT, CallFunc(node.node, []))
         name = self.visit(node.node)
         args = [self.visit(arg) for arg in node.args]
         return CallFunc(name, args)
@@ -254,19 +341,30 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
     # Handle IfExp
 
     def visitIfExp(self, node):
-        return IfExp(self.visit(node.test), self.visit(node.then), self.visit(node.else_))
+        return IfExp(self.branch_test(node.test), self.visit(node.then), self.visit(node.else_))
 
     def visitIf(self, node):
-        test = self.visit(node.tests[0][0])
+        test = self.branch_test(node.tests[0][0])
         body = self.visit(node.tests[0][1])
         else_ = self.visit(node.else_)
         return If([(test, body)], else_)
 
     def visitWhile(self, node):
-        test = self.visit(node.test)
+        test = self.branch_test(node.test)
         body = self.visit(node.body)
         return While(test, body, None)
 
+    def branch_test(self, node):
+        '''
+        Explicate the test of an if or a loop. A comparison of ints stays a
+        CompareInt and a test of type int or bool becomes a CompareInt of
+        its untagged value with 0, so the branch jumps on the comparison
+        instead of tagging a bool and dispatching on it in is_true.
+        '''
+        if is_small(self.types.get(node)) and not isinstance(node, Compare):
+            return CompareInt(self.unboxed(node), [('!=', Const(0))])
+        return self.visit(node)
+
     # Handle Logical Operators
 
     def visitAnd(self, node):
@@ -287,6 +385,13 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
     # Handle Compare
 
     def visitCompare(self, node):
+        op, rhs = node.ops[0]
+        left_type = self.types.get(node.expr)
+        right_type = self.types.get(rhs)
+        # an int is never a bool, which the untagged values cannot tell
+        if is_small(left_type) and is_small(right_type) and \
+                (op in ['==', '!='] or left_type == right_type):
+            return CompareInt(self.unboxed(node.expr), [(op, self.unboxed(rhs))])
         exp_children = []
         for op, child in node.ops:
             exp_children.append((op, self.visit(child)))
@@ -307,6 +412,7 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
         defaults = node.defaults
         flags = node.flags
         doc = node.doc
+        self.int_vars = int_variables(node, self.types)
         body = self.visit(node.code)
 
         return Function(decorators, name, args, defaults, flags, doc, body)
@@ -342,7 +448,25 @@ class ExplicateVisitor(compiler.visitor.ASTVisitor):
         return GetFreeVars(self.visit(node.func))
 
 
+def is_input(node):
+    '''
+    Whether node is a call of input()
+    '''
+    return isinstance(node, CallFunc) and getattr(node.node, "name", None) == "input" \
+        and not node.args
+
+
+def small_check(name):
+    '''
+    Test that the value of name is an int or a bool
+    '''
+    return Or([InjectFrom(BOOL, IsInt(name)), InjectFrom(BOOL, IsBool(name))])
+
+
 # Helper function to explicate the AST
-def get_explicated_ast(node):
+def get_explicated_ast(node, types=None):
+    '''
+    param types: the types found by typeinfer.get_types, if any
+    '''
     return compiler.visitor.walk(node,
-                                 ExplicateVisitor()).explicit_ast
+                                 ExplicateVisitor(types)).explicit_ast
@@ -2,7 +2,6 @@ import compiler
 from compiler.ast import Const
 from compiler.ast import Name
 from compiler.ast import AssName
-from compiler.ast import Node
 from compiler.ast import Stmt
 from compiler.ast import Assign
 from compiler.ast import CallFunc
@@ -10,7 +9,13 @@ from compiler.ast import IfExp
 from compiler.ast import And
 from compiler.ast import Or
 from compiler.ast import Subscript
-from explicate import InjectFrom
+from compiler.ast import Module
+from compiler.ast import List
+from compiler.ast import Dict
+from compiler.ast import Printnl
+from compiler.ast import Function
+from compiler.ast import Return
+from explicate import InjectFrom, CompareInt
 from compiler.ast import Break
 from compiler.ast import While
 from compiler.ast import If
@@ -20,63 +25,67 @@ import utils
 
 class FlattenVisitor(compiler.visitor.ASTVisitor):
     '''
-    Visitor class to walk the ast and flatten it
+    Visitor class to walk the ast and flatten it.
+    The flattened program is built directly as AST nodes:
+    expressions are reduced to a Name or a Const and every
+    intermediate result is assigned to a temporary in the
+    innermost block being built.
     '''
 
     def __init__(self):
-        self.env = {}
-        self.flattened_stmts = []
-        self.indent = 0
-        self.stack_offset = 0
-        self.stack_offset_map = {}
+        self.blocks = [[]]
+        self.flattened_ast = None
 
     def get_ast(self):
         '''
         Return the flattened ast
         return: the flattened ast
         '''
-        prog = ""
-        for stmt in self.flattened_stmts:
-            prog += stmt + "\n"
-        return compiler.parse(prog)
+        return self.flattened_ast
 
-    def rvalue(self, lval):
+    def add_stmt(self, stmt):
         '''
-        Return the right hand side of an assignment given the left hand side
-        param: lval: the left hand side of an assignment
-        return: the right hand side of an assignment, or None if not found
+        Add a statement to the innermost block being built.
+        Flattened expressions (Name, Const) and None are not statements and are dropped.
+        param: stmt: the statement(s) to add
+        return: No return value
         '''
-        return self.env.get(lval)
+        if isinstance(stmt, list):
+            for s in stmt:
+                self.add_stmt(s)
+        elif stmt is not None and not isinstance(stmt, (Name, Const)):
+            self.blocks[-1].append(stmt)
 
-    def lvalue(self, rval):
+    def begin_block(self):
         '''
-        Return the left hand side of an assignment given the right hand side
-        param: rval: the right hand side of an assignment
-        return: the left hand side of an assignment, or None if not found
+        Start collecting the statements of a nested block (if/else/while/def body)
         '''
-        for lval in self.env.keys():
-            if self.rvalue(lval) == rval:
-                return lval
-        return None
+        self.blocks.append([])
 
-    def add_stmt(self, stmt):
+    def end_block(self):
         '''
-        Add a statement to the flattened list of statements.
-        Also indent the statement based the current indentation level in self.indent
-        param: stmt: the statement(s) to add
-        return: No return value
+        Stop collecting the current nested block
+        return: the Stmt node of the block
         '''
-        if isinstance(stmt, list):
-            for s in stmt:
-                s = " " * self.indent + str(s)
-                self.flattened_stmts.append(s)
-        else:
-            s = " " * self.indent + str(stmt)
-            self.flattened_stmts.append(s)
+        return Stmt(self.blocks.pop())
+
+    def assign_tmp(self, expr):
+        '''
+        Assign expr to a new temporary
+        param: expr: the (already flattened) right hand side
+        return: the Name of the temporary
+        '''
+        tmpvar = utils.tmpvar()
+        self.add_stmt(Assign([AssName(tmpvar, "OP_ASSIGN")], expr))
+        return Name(tmpvar)
+
+    def visitModule(self, node):
+        self.visit(node.node)
+        self.flattened_ast = Module(None, Stmt(self.blocks[0]))
 
     def visitStmt(self, node):
         '''
-        Visits a Stmt node and flattens it. This could come from a Module node, 
+        Visits a Stmt node and flattens it. This could come from a Module node,
         or an IfExp inside a Let node because of the boxing and unboxing.
         param: node: the Stmt node to visit
         return: list of flattened statements from the immediate ancestor of Stmt
@@ -85,51 +94,35 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         for child in node.nodes:
             stmt = self.visit(child)
             stmts.append(stmt)
-            # If the child_stmt is an inject_from, don't add it to the flattened_stmts
-            # because it is already in the flattened_stmts of the ancestor.
-            # This is a temporary fix, need a better, more consistent solution
-            # if not isinstance(child, InjectFrom):
             self.add_stmt(stmt)
-        self.flattened_stmts = utils.flatten_list(self.flattened_stmts)
         return utils.flatten_list(stmts)
 
     def visitPrintnl(self, node):
         '''
         Visits a Printnl node and flattens it. Can only come from a Stmt node.
         param: node: the Printnl node to visit
-        return: Flattened Print expression to Stmt
+        return: Flattened Print statement to Stmt
         '''
-        expr = "print("
-        for child in node.nodes:
-            expr += str(self.visit(child)) + ","
-        expr = expr[:-1] + ")"
-        # self.add_stmt(expr)
-        return expr
+        return Printnl([self.visit(child) for child in node.nodes], None)
 
     def visitAssign(self, node):
         '''
-        Visits an Assign node and flattens it. 
+        Visits an Assign node and flattens it.
         This could come any node except a Module node, a Const node, an AssName node or a Name node
         param: node: the Assign node to visit
         return: Flattened assignment
         '''
-        assignment = ""
+        assignment = None
         for child in node.nodes:
             lval = self.visit(child)
             rval = self.visit(node.expr)
-            assignment = str(lval) + " = " + str(rval)
+            assignment = Assign([AssName(lval.name, "OP_ASSIGN")], rval)
             if (isinstance(child, Subscript)):
                 # if the lval is a subscript, then assign back the lval to the subscript
                 var = self.visit(child.expr)
                 index = self.visit(child.subs[0])
                 self.add_stmt(assignment)
-                rval = lval
-                lval = str(var) + "[" + str(index) + "]"
-                assignment = self.visit(
-                    Assign([AssName(lval, "OP_ASSIGN")], Name(rval)))
-            self.env[lval] = rval
-            self.stack_offset += 4
-            self.stack_offset_map[lval] = self.stack_offset
+                assignment = Assign([Subscript(var, "OP_ASSIGN", [index])], lval)
         return assignment
 
     def visitAssName(self, node):
@@ -139,35 +132,37 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the AssName node to visit
         return: Name of the left hand side of the assignment
         '''
-        return node.name
+        return Name(node.name)
 
     def visitDiscard(self, node):
         '''
         Visits a Discard node and flattens it.
-        This can come from any node.
+        This can come from any node. Only the side effects of the
+        expression are kept, the value itself is dropped.
         param: node: the Discard node to visit
-        return: Flattened Discard node
+        return: None
         '''
-        return self.visit(node.expr)
+        self.visit(node.expr)
+        return None
 
     def visitConst(self, node):
         '''
         Visits a Const node and flattens it.
         This can come from any node. This is always an integer
         param: node: the Const node to visit
-        return: The string representation of the integer
+        return: The Const node of the integer
         '''
-        return str(node.value)
+        return Const(node.value)
 
     def visitName(self, node):
         '''
         Visits a Name node and flattens it.
-        This can come from any node. This is always a variable or a function name because 
+        This can come from any node. This is always a variable or a function name because
         the "True" and "False" are taken care of in the explicate pass
         param: node: the Name node to visit
-        return: The name of the variable or function
+        return: The Name of the variable or function
         '''
-        return node.name
+        return Name(node.name)
 
     def visitGetFunPtr(self, node):
         '''
@@ -197,18 +192,17 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         args = []
         args.append(self.visit(node.func))
         args.append(self.visit(node.free_vars))
-        
+
         return self.visit(CallFunc(Name("create_closure"), args))
 
     def visitTypeError(self, node):
         '''
-        This is only called when the explicate pass fails. 
+        This is only called when the explicate pass fails.
         param: node: the TypeError node to visit.
         return: Returns a function call to the error function in runtime.c called pyob_error
         '''
-        # FIXME: There is a bug here. We don't handle String nodes when parsing an AST.
-        # This will crash the program because the outut is of the form "pyobj_error(Some message string that the compiler.parse can't handle)".
-        return self.visit(CallFunc(Name("error_pyobj"), ["0"]))
+        # The message is not passed on, the runtime has no string objects.
+        return self.visit(CallFunc(Name("error_pyobj"), [Const(0)]))
 
     def visitIsTrue(self, node):
         '''
@@ -261,8 +255,6 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the InjectFrom node to visit
         return: Returns a function call to the inject_<specific_type> function in runtime.c
         '''
-        # FIXME: There is a bug here. We add the inject var to the flattened_stmts list.
-        # For now, we will just ignore it as its not needed and is probably a harmless bug.
         return self.visit(CallFunc(Name("inject_" + node.typ), [self.visit(node.arg)]))
 
     def visitLet(self, node):
@@ -272,10 +264,9 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the Let node to visit
         return: Flattened Let node
         '''
-        # Not sure if this is the best way to do this. Should I be creating an assignment?
-        # The book says that let statements should not be part of the output. #AskAsher or on the class-question Slack channel
+        # The let variable simply becomes an assignment in the current block
         self.add_stmt(self.visit(
-            Assign([AssName(self.visit(node.var), "OP_ASSIGN")], node.rhs)))
+            Assign([AssName(self.visit(node.var).name, "OP_ASSIGN")], node.rhs)))
         return self.visit(node.body)
 
     def visitAddBig(self, node):
@@ -291,19 +282,17 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
 
     def visitAdd(self, node):
         '''
-        Visits an Add node and flattens it. This usually comes from the explicated ast and 
+        Visits an Add node and flattens it. This usually comes from the explicated ast and
         is used to add two ints or two bools or a bool and an int. We will encounter this only when we are adding.
         param: node: the Add node to visit
         return: Flattened Add node
         '''
         op1 = self.visit(node.left)
         op2 = self.visit(node.right)
-        # Should this be the runtime call to add bigs instead of just '+'?
-        var = op1 + " + " + op2
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(var))))
-        return tmpvar
+        # an AddInt stays one for irgen
+        return self.assign_tmp(node.__class__((op1, op2)))
+
+    visitAddInt = visitAdd
 
     def visitSubscript(self, node):
         '''
@@ -313,23 +302,16 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         '''
         var = self.visit(node.expr)
         index = self.visit(node.subs[0])
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(var + "[" + index + "]"))))
-        return tmpvar
+        return self.assign_tmp(Subscript(var, "OP_APPLY", [index]))
 
     def visitList(self, node):
         '''
-        Visits a List node and flattens it. Because of the injection of the List type in explication, 
+        Visits a List node and flattens it. Because of the injection of the List type in explication,
         this can come any node except a UnarySub node or a Module
         param: node: the List node to visit
         return: Flattened List node with injection of the List type
         '''
-        var = "[" + ", ".join([self.visit(e) for e in node.nodes]) + "]"
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(var))))
-        return tmpvar
+        return self.assign_tmp(List([self.visit(e) for e in node.nodes]))
 
     def visitDict(self, node):
         '''
@@ -338,84 +320,74 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the Dict node to visit
         return: Flattened Dict node with injection of the Dict type
         '''
-        var = "{"
+        items = []
         for k, v in node.items:
-            var = var + self.visit(k) + ": " + self.visit(v) + ", "
-        var = var + "}"
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(var))))
-        return tmpvar
+            items.append((self.visit(k), self.visit(v)))
+        return self.assign_tmp(Dict(items))
 
     def visitIfExp(self, node, parent=None):
         '''
-        Visits an IfExp node and flattens it. 
-        For now only this makes use of the self.indent because of the if-then-else expansion
+        Visits an IfExp node and flattens it into an if-then-else
+        statement that assigns the result of either branch to a temporary.
         param: node: the IfExp node to visit
-        return: if-then-else statement
+        return: the temporary holding the result
         '''
         # convert if-else to if-then-else
-        test = self.visit(node.test)
+        test = self.branch_test(node.test)
         var = self.visit(InjectFrom("int", Const(0)))
-        test = self.visit(CallFunc(Name("is_true"), [test]))
-        if_exp = "if %s:" % str(test)
-        self.add_stmt(if_exp)
-        self.indent += 4
+        self.begin_block()
         then_op = self.visit(node.then)
-        # FIXME: We know that Stmt coming Add is a List, Otherwise it isn't.
-        # One issue is that when it is coming from a Stmt, we are doing an add_stmt of the lhs from the injection
-        # This leads to one extra line of code (it is harmless since it is a discard but needs attention).
-        # To reproduce this, try: 1 + 2 as your program and see the second last line of the "then" statements in the output
-        then = var + " = " + \
-            str(then_op[0] if isinstance(then_op, list) else then_op)
-        self.add_stmt(then)
-        self.indent -= 4
-        else_exp = "else:"
-        self.add_stmt(else_exp)
-        self.indent += 4
-        else_ = var + " = " + str(self.visit(node.else_))
-        self.add_stmt(else_)
-        self.indent -= 4
+        if isinstance(then_op, list):
+            then_op = then_op[0]
+        self.add_stmt(Assign([AssName(var.name, "OP_ASSIGN")], then_op))
+        then = self.end_block()
+        self.begin_block()
+        self.add_stmt(Assign([AssName(var.name, "OP_ASSIGN")], self.visit(node.else_)))
+        else_ = self.end_block()
+        self.add_stmt(If([(test, then)], else_))
         return var
 
     def visitIf(self, node):
         '''
         Visits an If node and flattens it. This usually comes from the explicated ast and is used to create a if-then-else statement
         param: node: the If node to visit
-        return: if-then-else statement
+        return: None, the if statement is added to the current block
         '''
-        test = self.visit(node.tests[0][0])
-        # var = self.visit(InjectFrom("int", Const(0)))
-        test = self.visit(CallFunc(Name("is_true"), [test]))
-        if_exp = "if %s:" % str(test)
-        self.add_stmt(if_exp)
-        self.indent += 4
+        test = self.branch_test(node.tests[0][0])
+        self.begin_block()
         self.visit(node.tests[0][1])
-        # FIXME: We know that Stmt coming Add is a List, Otherwise it isn't.
-        # One issue is that when it is coming from a Stmt, we are doing an add_stmt of the lhs from the injection
-        # This leads to one extra line of code (it is harmless since it is a discard but needs attention).
-        # To reproduce this, try: 1 + 2 as your program and see the second last line of the "then" statements in the output
-        self.indent -= 4
-        else_exp = "else:"
-        self.add_stmt(else_exp)
-        self.indent += 4
+        body = self.end_block()
+        self.begin_block()
         self.visit(node.else_)
-        self.indent -= 4
-        return ""
+        else_ = self.end_block()
+        self.add_stmt(If([(test, body)], else_))
+        return None
+
+    def branch_test(self, node):
+        '''
+        Flattens the test of an if. A CompareInt is kept as the test, irgen
+        jumps on the comparison; any other test goes through is_true.
+        param: node: the explicated test
+        return: the CompareInt of two flattened operands, or the result of is_true
+        '''
+        if isinstance(node, CompareInt):
+            return CompareInt(self.visit(node.expr), [(node.ops[0][0], self.visit(node.ops[0][1]))])
+        return self.visit(CallFunc(Name("is_true"), [self.visit(node)]))
 
     def visitWhile(self, node):
         '''
         Visits a While node and flattens it. This usually comes from the explicated ast and is used to create a while loop
+        The loop becomes an infinite loop whose body re-evaluates the test and breaks out when it is false.
         param: node: the While node to visit
-        return: while loop
+        return: None, the while statement is added to the current block
         '''
         InfiniteLoop = InjectFrom("int", Const(1))
-        while_exp = "while %s:" % str(self.visit(InfiniteLoop))
-        self.add_stmt(while_exp)
-        self.indent += 4
+        test = self.visit(InfiniteLoop)
+        self.begin_block()
         self.visit(If([(node.test, node.body)], Stmt([Break()])))
-        self.indent -= 4
-        return ""
+        body = self.end_block()
+        self.add_stmt(While(test, body, None))
+        return None
 
     def visitBreak(self, node):
         '''
@@ -423,11 +395,11 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the Break node to visit
         return: break statement
         '''
-        return "break"
+        return Break()
 
     def visitAnd(self, node):
         '''
-        Visits an And node and flattens it. This can be a list of operand. 
+        Visits an And node and flattens it. This can be a list of operand.
         We need to split it into expression of two operands and then and them.
         Python has weird behavior where it return the last true operand if there is no false operand.
         or else it returns the first false operand.
@@ -437,10 +409,10 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         and_operands = [self.visit(n) for n in node.nodes[:2]]
         op1 = and_operands[0]
         op2 = and_operands[1]
-        and_res = self.visit(IfExp(Name(op1), Name(op2), Name(op1)))
+        and_res = self.visit(IfExp(op1, op2, op1))
         deepest_var = and_res
         if len(node.nodes) > 2:
-            deepest_var = self.visit(And([Name(deepest_var)] + node.nodes[2:]))
+            deepest_var = self.visit(And([deepest_var] + node.nodes[2:]))
         return deepest_var
 
     def visitOr(self, node):
@@ -455,10 +427,10 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         or_operands = [self.visit(n) for n in node.nodes[:2]]
         op1 = or_operands[0]
         op2 = or_operands[1]
-        or_res = self.visit(IfExp(Name(op1), Name(op1), Name(op2)))
+        or_res = self.visit(IfExp(op1, op1, op2))
         deepest_var = or_res
         if len(node.nodes) > 2:
-            deepest_var = self.visit(Or([Name(deepest_var)] + node.nodes[2:]))
+            deepest_var = self.visit(Or([deepest_var] + node.nodes[2:]))
         return deepest_var
 
     def visitNot(self, node):
@@ -468,7 +440,7 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         return: Flattened Not node
         '''
         op1 = self.visit(node.expr)
-        not_res = self.visit(IfExp(Name(op1), InjectFrom(
+        not_res = self.visit(IfExp(op1, InjectFrom(
             "bool", Const(0)), InjectFrom("bool", Const(1))))
         return not_res
 
@@ -478,15 +450,13 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the Compare node to visit
         return: Flattened Compare node
         '''
-        var = ""
         lhs = self.visit(node.expr)
         rhs = self.visit(node.ops[0][1])
         op = node.ops[0][0]
-        var = lhs + " " + op + " " + rhs
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(var))))
-        return tmpvar
+        # a CompareInt stays one for irgen
+        return self.assign_tmp(node.__class__(lhs, [(op, rhs)]))
+
+    visitCompareInt = visitCompare
 
     def visitUnarySub(self, node):
         '''
@@ -494,11 +464,9 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the UnarySub node to visit
         return: Flattened UnarySub node
         '''
-        var = "-" + str(self.visit(node.expr))
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(var))))
-        return tmpvar
+        return self.assign_tmp(node.__class__(self.visit(node.expr)))
+
+    visitUnarySubInt = visitUnarySub
 
     def visitCallFunc(self, node):
         '''
@@ -506,55 +474,127 @@ class FlattenVisitor(compiler.visitor.ASTVisitor):
         param: node: the CallFunc node to visit
         return: Flattened CallFunc node
         '''
-        args = "(" + ", ".join([self.visit(arg) \
-            if isinstance(arg, Node) else arg \
-            for arg in node.args]) + ")"
-        func = self.visit(node.node) + args
-        tmpvar = utils.tmpvar()
-        self.add_stmt(self.visit(
-            Assign([AssName(tmpvar, "OP_ASSIGN")], Name(func))))
-        if func == "input()":
-            tmpvar = self.visit(InjectFrom("int", Name(tmpvar)))
-
-        return tmpvar
+        args = [self.visit(arg) for arg in node.args]
+        func = self.visit(node.node)
+        return self.assign_tmp(CallFunc(func, args))
 
     def visitFunction(self, node):
         '''
         Visits a Function node and flattens it.
         param: node: the Function node to visit
-        return: Flattened Function node
+        return: None, the function definition is added to the current block
         '''
-        func_signature = "def " + node.name + "(" + \
-            ", ".join([arg for arg in node.argnames]) + "):"
-        self.add_stmt(func_signature)
-        self.indent += 4
+        self.begin_block()
         self.visit(node.code)
-        self.indent -= 4
-        return ""
+        code = self.end_block()
+        self.add_stmt(Function(None, node.name, list(node.argnames), [], 0, None, code))
+        return None
 
     def visitReturn(self, node):
         '''
         Visits a Return node and flattens it.
         I am assuming that the return is always a part of a function.
-        So indent it.
         param: node: the Return node to visit
-        return: Flattened Return node
+        return: None, the return statement is added to the current block
         '''
-        self.add_stmt("return " + str(self.visit(node.value)))
-        return ""
+        self.add_stmt(Return(self.visit(node.value)))
+        return None
+
+
+class FlatSourceVisitor(compiler.visitor.ASTVisitor):
+    '''
+    Print a flattened AST as python source, one line per statement.
+    Only used to dump the _flat.py file for debugging.
+    '''
+
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+
+    def add_line(self, line):
+        self.lines.append(" " * self.indent + line)
+
+    def block(self, node):
+        self.indent += 4
+        self.visit(node)
+        self.indent -= 4
+
+    def visitModule(self, node):
+        self.visit(node.node)
+
+    def visitStmt(self, node):
+        for child in node.nodes:
+            self.visit(child)
+
+    def visitFunction(self, node):
+        self.add_line("def %s(%s):" % (node.name, ", ".join(node.argnames)))
+        self.block(node.code)
+
+    def visitIf(self, node):
+        self.add_line("if %s:" % self.visit(node.tests[0][0]))
+        self.block(node.tests[0][1])
+        self.add_line("else:")
+        self.block(node.else_)
+
+    def visitWhile(self, node):
+        self.add_line("while %s:" % self.visit(node.test))
+        self.block(node.body)
+
+    def visitBreak(self, node):
+        self.add_line("break")
+
+    def visitReturn(self, node):
+        self.add_line("return %s" % self.visit(node.value))
+
+    def visitPrintnl(self, node):
+        self.add_line("print(%s)" % ", ".join(self.visit(n) for n in node.nodes))
+
+    def visitAssign(self, node):
+        self.add_line("%s = %s" % (self.visit(node.nodes[0]), self.visit(node.expr)))
+
+    def visitAssName(self, node):
+        return node.name
+
+    def visitName(self, node):
+        return node.name
+
+    def visitConst(self, node):
+        return str(node.value)
+
+    def visitAdd(self, node):
+        return "%s + %s" % (self.visit(node.left), self.visit(node.right))
+
+    visitAddInt = visitAdd
+
+    def visitUnarySub(self, node):
+        return "-%s" % self.visit(node.expr)
+
+    visitUnarySubInt = visitUnarySub
+
+    def visitCompare(self, node):
+        return "%s %s %s" % (self.visit(node.expr), node.ops[0][0], self.visit(node.ops[0][1]))
+
+    visitCompareInt = visitCompare
+
+    def visitSubscript(self, node):
+        return "%s[%s]" % (self.visit(node.expr), self.visit(node.subs[0]))
+
+    def visitList(self, node):
+        return "[%s]" % ", ".join(self.visit(n) for n in node.nodes)
+
+    def visitDict(self, node):
+        return "{%s}" % ", ".join("%s: %s" % (self.visit(k), self.visit(v)) for k, v in node.items)
+
+    def visitCallFunc(self, node):
+        return "%s(%s)" % (self.visit(node.node), ", ".join(self.visit(a) for a in node.args))
 
 
 # Helper Functions to get Flattened AST and Flattened Statements
 
 def get_flattened_ast(node):
-    flattener = compiler.visitor.walk(node,
-                          FlattenVisitor())
-    prog = ""
-    for stmt in flattener.flattened_stmts:
-        prog += stmt + "\n"
-    return compiler.parse(prog)
-
-def get_flattened_statements(node):
-    flattener = compiler.visitor.walk(node,
-                          FlattenVisitor())
-    return flattener.flattened_stmts
+    return compiler.visitor.walk(node,
+                          FlattenVisitor()).get_ast()
+
+def get_flattened_statements(flattened_ast):
+    return compiler.visitor.walk(flattened_ast,
+                          FlatSourceVisitor()).lines
@@ -0,0 +1,389 @@
+###########################################################
+# File: src/pyyc/gvn.py                                   #
+# Description: Global value numbering over the dominators #
+###########################################################
+
+# The IR is not in SSA form: a variable can be written many times, so a
+# value number names a value, and each block knows which variables and
+# registers hold which value at every point. Blocks are visited in a
+# preorder of the dominator tree and start from what their immediate
+# dominator knew at its end, minus the locations written on a path from
+# the dominator to the block. The table of expressions is shared by the
+# whole function since a value number means the same value everywhere.
+
+from utils import EAX, ECX, EDX, ESP, EBP, VARIABLE, REGISTER, CONST
+import ir as IR
+from ir import Opcode
+
+# Opcodes computing their last operand from their operands only
+pure_opcodes = IR.binary_opcodes | IR.unary_opcodes
+commutative_opcodes = frozenset([Opcode.ADDL, Opcode.ANDL, Opcode.ORL])
+
+# Runtime functions without side effects whose result only depends on the
+# bits of their arguments -> number of arguments
+pure_calls = {"inject_int": 1, "inject_bool": 1, "inject_big": 1,
+              "project_int": 1, "project_bool": 1, "project_big": 1,
+              "is_int": 1, "is_bool": 1, "is_big": 1,
+              "get_fun_ptr": 1, "get_free_vars": 1}
+
+caller_saved = (EAX, ECX, EDX)
+
+
+def is_tracked(op):
+    '''
+    Whether the value of an operand is followed: variables and the
+    registers but for the stack and frame pointers
+    '''
+    return op.kind is VARIABLE or (op.kind is REGISTER and op.name not in (ESP, EBP))
+
+
+def written(inst):
+    '''
+    The variables and registers an instruction overwrites
+    '''
+    if inst.opcode is Opcode.CALL:
+        return set(caller_saved)
+    if inst.is_label() or inst.is_jmp():
+        return set()
+    if inst.opcode not in IR.ir_write_inst_map:
+        # an opcode without a known effect may write any operand
+        return set([op.name for op in inst.operands if is_tracked(op)])
+    names = set(inst.writes)
+    for i in IR.ir_write_inst_map[inst.opcode]:
+        if inst.operands[i - 1].kind is REGISTER:
+            names.add(inst.operands[i - 1].name)
+    return names
+
+
+def read_only(inst):
+    '''
+    Positions (0 based) of the operands an instruction reads but does not write
+    '''
+    if inst.opcode is Opcode.CALL:
+        return [0] if inst.reads else []
+    writes = IR.ir_write_inst_map.get(inst.opcode, [])
+    return [i - 1 for i in IR.ir_read_inst_map.get(inst.opcode, []) if i not in writes]
+
+
+def pops_arguments(inst, count):
+    '''
+    Whether inst is the addl $4*count, %esp dropping the arguments of a call
+    '''
+    return (inst.opcode is Opcode.ADDL and inst.operands[0].name == "$%d" % (4 * count)
+            and inst.operands[1].name == ESP)
+
+
+class Locations(object):
+    '''
+    What the locations hold at one point of the function: the value number
+    of every variable and register, the variables holding each value
+    number (oldest first), and how many calls were made before each
+    location was written, counted along the dominator tree.
+    '''
+
+    def __init__(self):
+        self.values = {}
+        self.holders = {}
+        self.epochs = {}
+        self.epoch = 0
+
+    def copy(self):
+        locations = Locations()
+        locations.values = dict(self.values)
+        locations.holders = dict(self.holders)
+        locations.epochs = dict(self.epochs)
+        locations.epoch = self.epoch
+        return locations
+
+    def define(self, name, vn):
+        '''
+        name now holds the value number vn
+        '''
+        self.forget(name)
+        self.values[name] = vn
+        self.epochs[name] = self.epoch
+        if IR.operand(name).kind is VARIABLE:
+            self.holders[vn] = self.holders.get(vn, ()) + (name,)
+
+    def forget(self, name):
+        '''
+        The value of name is no longer known
+        '''
+        vn = self.values.pop(name, None)
+        if vn is not None and vn in self.holders:
+            kept = tuple([holder for holder in self.holders[vn] if holder != name])
+            if kept:
+                self.holders[vn] = kept
+            else:
+                del self.holders[vn]
+
+    def holder(self, vn):
+        '''
+        The oldest variable holding the value number, if any
+        '''
+        holders = self.holders.get(vn)
+        return holders[0] if holders else None
+
+    def cheap_holder(self, vn, variables, live, recent=True):
+        '''
+        A variable holding the value number that can be read here without
+        making register allocation harder: one live after this point anyway,
+        or else (if recent) one written since the last call, which is not
+        kept alive across a call by the read.
+        param live: live set after this point, over the numbering variables
+        return: the variable or None
+        '''
+        found = None
+        for name in self.holders.get(vn, ()):
+            if variables.is_live(live, name):
+                return name
+            if recent and found is None and self.epochs[name] == self.epoch:
+                found = name
+        return found
+
+
+class ValueNumbering(object):
+    '''
+    Value numbers of one function and the rewriting of its blocks.
+    '''
+
+    def __init__(self, variables):
+        self.variables = variables
+        self.count = 0
+        # expression key -> value number, for the whole function
+        self.expressions = {}
+        # value number -> immediate, for the constants
+        self.constants = {}
+        self.replaced = 0
+        self.folded = 0
+
+    def fresh(self):
+        self.count += 1
+        return self.count
+
+    def value(self, locations, op):
+        '''
+        The value number of an operand; a location that holds no known
+        value gets a new one.
+        '''
+        if op.kind is CONST:
+            key = ("const", op.name)
+            vn = self.expressions.get(key)
+            if vn is None:
+                vn = self.fresh()
+                self.expressions[key] = vn
+                self.constants[vn] = op.name
+            return vn
+        if not is_tracked(op):
+            return self.fresh()
+        vn = locations.values.get(op.name)
+        if vn is None:
+            vn = self.fresh()
+            locations.define(op.name, vn)
+        return vn
+
+    def number_block(self, block, locations):
+        '''
+        Number the instructions of block, replacing the pure calls whose
+        value a variable already holds with a move from it, and the
+        expressions whose value is in a variable that is cheap to read
+        (see Locations.cheap_holder). Reads of a variable are folded to
+        the immediate of a constant where the operand may be one.
+        Only writes to variables are dropped when the location already
+        holds the value: liveness does not follow the registers, so a
+        register has to be written again wherever irgen wrote it.
+        The live sets of the block must be up to date.
+        return: the new instructions, locations is updated to the end of the block
+        '''
+        instructions = block.get_instructions()
+        lvsets = block.get_lvsets()
+        output = []
+        # (position in output, value number) of the pushes just before
+        pushes = []
+        i = 0
+        while i < len(instructions):
+            inst = instructions[i]
+            live = lvsets[i + 1]
+            i += 1
+            opcode = inst.opcode
+            if inst.is_label() or inst.is_jmp():
+                output.append(inst)
+                pushes = []
+                continue
+            inst = self.fold_reads(inst, locations, live)
+
+            if opcode is Opcode.PUSHL:
+                pushes.append((len(output), self.value(locations, inst.operands[0])))
+                output.append(inst)
+                continue
+
+            if opcode is Opcode.CALL:
+                target = inst.operands[0].name
+                count = pure_calls.get(target)
+                vn = None
+                if (count is not None and len(pushes) >= count and i < len(instructions)
+                        and pops_arguments(instructions[i], count)):
+                    first = len(pushes) - count
+                    key = (target,) + tuple([value for _, value in pushes[first:]])
+                    vn = self.expressions.get(key)
+                    # a runtime call costs more than keeping its result,
+                    # even on the stack
+                    holder = locations.holder(vn)
+                    if holder is not None:
+                        # drop the pushes, the call and the addl to %esp
+                        del output[pushes[first][0]:]
+                        output.append(IR.inst(Opcode.MOVL, holder, EAX))
+                        locations.define(EAX, vn)
+                        self.replaced += 1
+                        pushes = []
+                        i += 1
+                        continue
+                    if vn is None:
+                        vn = self.fresh()
+                        self.expressions[key] = vn
+                locations.epoch += 1
+                for name in caller_saved:
+                    locations.forget(name)
+                locations.define(EAX, vn or self.fresh())
+                output.append(inst)
+                pushes = []
+                continue
+            pushes = []
+
+            if opcode is Opcode.MOVL:
+                src, dst = inst.operands
+                vn = self.value(locations, src)
+                if is_tracked(dst):
+                    if dst.kind is VARIABLE and locations.values.get(dst.name) == vn:
+                        self.folded += 1
+                        continue
+                    locations.define(dst.name, vn)
+                output.append(inst)
+                continue
+
+            if opcode in pure_opcodes and is_tracked(inst.operands[-1]):
+                dst = inst.operands[-1]
+                key = (opcode,) + tuple([self.value(locations, op) for op in inst.operands])
+                if opcode in commutative_opcodes:
+                    key = (opcode,) + tuple(sorted(key[1:]))
+                vn = self.expressions.get(key)
+                if vn is None:
+                    vn = self.fresh()
+                    self.expressions[key] = vn
+                elif dst.kind is VARIABLE and locations.values.get(dst.name) == vn:
+                    self.folded += 1
+                    continue
+                else:
+                    holder = locations.cheap_holder(vn, self.variables, live)
+                    if holder is not None:
+                        inst = IR.inst(Opcode.MOVL, holder, dst.name)
+                        self.replaced += 1
+                output.append(inst)
+                locations.define(dst.name, vn)
+                continue
+
+            for name in written(inst):
+                locations.define(name, self.fresh())
+            output.append(inst)
+        return output
+
+    def fold_reads(self, inst, locations, live):
+        '''
+        inst with the variables it only reads replaced by the immediate
+        holding the same value, or by another variable holding it that is
+        live after inst when the variable itself is not
+        param live: live set after inst
+        '''
+        operands = None
+        immediate = IR.immediate_operands.get(inst.opcode)
+        for i in read_only(inst):
+            op = inst.operands[i]
+            if op.kind is not VARIABLE:
+                continue
+            vn = locations.values.get(op.name)
+            if vn is None:
+                continue
+            name = self.constants.get(vn) if immediate == i + 1 else None
+            if name is None and not self.variables.is_live(live, op.name):
+                name = locations.cheap_holder(vn, self.variables, live, recent=False)
+            if name is not None and name != op.name:
+                if operands is None:
+                    operands = [o.name for o in inst.operands]
+                operands[i] = name
+        if operands is None:
+            return inst
+        return IR.inst(inst.opcode, *operands)
+
+
+def killed_on_entry(block, writes):
+    '''
+    The locations that may be written on a path from the end of the
+    immediate dominator of block to its start: the writes of every block
+    reaching block without going through its immediate dominator.
+    param writes: block -> set of the locations written in it
+    '''
+    idom = block.idom
+    preds = block.get_predecessors()
+    if len(preds) == 1 and preds[0] is idom:
+        return set()
+    killed = set()
+    visited = set()
+    worklist = [pred for pred in preds if pred is not idom]
+    while worklist:
+        pred = worklist.pop()
+        if pred in visited:
+            continue
+        visited.add(pred)
+        killed |= writes[pred]
+        worklist.extend([p for p in pred.get_predecessors() if p is not idom])
+    return killed
+
+
+def gvn(flow_graph, stats=None):
+    '''
+    Global value numbering of a function over its dominator tree.
+    Covers the pure opcodes of the IR and the pure runtime calls; a
+    computation whose value a variable already holds becomes a move from
+    that variable, and moves of a value to a location that already holds
+    it are dropped. Dead store elimination runs afterwards to remove the
+    copies and computations that are no longer read.
+    param flow_graph: the cfg.CFG of the function, its blocks are rewritten
+    param stats: optional stats.PassRecord, gets the number of replaced
+                 computations and dropped moves
+    return: the IR of the function
+    '''
+    order = flow_graph.find_dominators()
+    flow_graph.liveness_analysis()
+    writes = {}
+    for block in order:
+        names = set()
+        for inst in block.get_instructions():
+            names |= written(inst)
+        writes[block] = names
+
+    numbering = ValueNumbering(flow_graph.variables)
+    if order:
+        # (block, locations at the end of its immediate dominator)
+        stack = [(order[0], Locations())]
+        while stack:
+            block, locations = stack.pop()
+            locations = locations.copy()
+            killed = killed_on_entry(block, writes)
+            for name in killed:
+                locations.forget(name)
+            # %ecx is only written by calls
+            if ECX in killed:
+                locations.epoch += 1
+            instructions = block.get_instructions()
+            numbered = numbering.number_block(block, locations)
+            if numbered != instructions:
+                block.set_instructions(numbered)
+            for child in block.dom_children:
+                stack.append((child, locations))
+
+    if numbering.replaced or numbering.folded:
+        flow_graph.run_dead_store_elimination()
+    if stats is not None:
+        stats.set("replaced", numbering.replaced)
+        stats.set("folded_moves", numbering.folded)
+    return flow_graph.get_ir()
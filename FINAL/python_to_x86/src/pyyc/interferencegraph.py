@@ -1,8 +1,7 @@
-from ctypes import util
 import utils
 from utils import Graph
-from utils import caller_saved_registers, EBP, ESP
-import cfg
+from utils import caller_saved_registers, EBP, ESP, CONST, STACK
+from ir import Opcode
 
 
 def add_all_vertices(graph, ir):
@@ -12,27 +11,23 @@ def add_all_vertices(graph, ir):
     param graph: the graph to add the vertices to
     param ir: the IR to get the vertices from
     '''
-    for idx, inst in enumerate(ir):
-        op = inst.split()
-        if len(op) == 2:
-            if op[0] in ["notl", "negl", "pushl"]:
-                op1 = op[1].strip(",")
-                if "$" not in op1:
-                    graph.add_vertex(op1)
-        elif len(op) == 3:
-            op1 = op[1].strip(",")
-            op2 = op[2].strip(",")
-            if "$" not in op1 and EBP not in op1 and ESP not in op1:
-                graph.add_vertex(op1)
-            if "$" not in op2 and EBP not in op2 and ESP not in op2:
-                graph.add_vertex(op2)
+    for inst in ir:
+        operands = inst.operands
+        if len(operands) == 1:
+            if inst.opcode in [Opcode.NOTL, Opcode.NEGL, Opcode.PUSHL]:
+                if operands[0].kind is not CONST:
+                    graph.add_vertex(operands[0].name)
+        elif len(operands) == 2:
+            for op in operands:
+                if op.kind is not CONST and op.kind is not STACK and op.name not in (EBP, ESP):
+                    graph.add_vertex(op.name)
     return graph
 
 
-def create_interference_graph(ir):
+def create_interference_graph(flow_graph):
     '''
-    Create the interference graph from the IR
-    param: ir: the IR
+    Create the interference graph of a function
+    param: flow_graph: the cfg.CFG of the function
     return: the interference graph
     '''
     # addedge(t, v) \forall v \in lvset_{after}(inst), where v != t or v != s and inst == "movl s, t"
@@ -42,10 +37,8 @@ def create_interference_graph(ir):
     # addedge(r, v) \forall r \in caller_saved_registers and v \in lvset_{after}(inst), where inst == "call label"
 
     graph = Graph()
-    cfg1 = cfg.CFG(ir)
-    cfg1.build_cfg()
-    lvsets = cfg1.run_fixed_point_liveness_analyis()
-    # lvsets = lv.analyze_liveness(ir)
+    ir = flow_graph.get_ir()
+    lvsets = flow_graph.run_fixed_point_liveness_analyis()
     
 
     # Add all vertices to the graph
@@ -53,59 +46,55 @@ def create_interference_graph(ir):
 
     
 
+    # the live sets are bit vectors over the numbering of flow_graph.variables
+    variables = flow_graph.variables
     for idx, inst in enumerate(ir):
-        op = inst.split()
-        if not op:
+        live = lvsets[idx + 1] & ~variables.known_mask(save_set(inst))
+        if not live:
             continue
-        op = op[0]
-        sset = save_set(inst, op)
-        for v in lvsets[idx + 1] - sset:
-            iset = interference_set(inst, op)
-            map(lambda x: graph.add_vertex(x), iset)
-            map(lambda x: graph.add_edge(x, v), iset)
+        live = variables.names_of(live)
+        for x in interference_set(inst):
+            graph.add_vertex(x)
+            for v in live:
+                graph.add_edge(x, v)
     return graph
 
-def save_set(inst, opcode):
+
+# lookup table for ensuring that we are not creating a self-edge or a redundant edge
+ir_ig_inst_save_map = {Opcode.MOVL: [1, 2], Opcode.ADDL: [2], Opcode.NEGL: [],
+                       Opcode.PUSHL: [], Opcode.POPL: [], Opcode.CALL: [],
+                       Opcode.CMPL: [1, 2],
+                       Opcode.ORL: [2], Opcode.ANDL: [2], Opcode.NOTL: [],
+                       Opcode.SHR: [2], Opcode.SAR: [2], Opcode.SHL: [2]}
+
+# lookup table containing all the variables/registers that interfere with the given variable
+ir_ig_inst_int_map = {Opcode.MOVL: [2], Opcode.ADDL: [2], Opcode.NEGL: [1],
+                      Opcode.PUSHL: [], Opcode.POPL: [], Opcode.CALL: caller_saved_registers,
+                      Opcode.CMPL: [2],
+                      Opcode.ORL: [2], Opcode.ANDL: [2], Opcode.NOTL: [1],
+                      Opcode.SHR: [2], Opcode.SAR: [2], Opcode.SHL: [2]}
+
+
+def save_set(inst):
     '''
     Get the save set for the given instruction
     param inst: the instruction
-    param ir_ig_inst_save_map: the lookup table
     return: the save set
     '''
-    # lookup table for ensuring that we are not creating a self-edge or a redundant edge
-    ir_ig_inst_save_map = {"movl": [1, 2], "addl": [2], "negl": [],
-                           "pushl": [], "popl": [], "call": [],
-                           "cmpl": [1, 2], "else": [], "endif": [],
-                           "orl": [2], "andl": [2], "notl": [],
-                           "shr": [2], "shl": [2]}
-
-    sset = set([])
-    for operand in ir_ig_inst_save_map.get(opcode, []):
-        sset.add(inst.split()[operand].strip(","))
+    return set([inst.operands[i - 1].name for i in ir_ig_inst_save_map.get(inst.opcode, [])])
 
-    return sset
 
-def interference_set(inst, opcode):
+def interference_set(inst):
     '''
     Get the interference set for the given instruction
     param inst: the instruction
-    param ir_ig_inst_int_map: the lookup table
     return: the interference set
     '''
-    # lookup table containing all the variables/registers that interfere with the given variable
-    ir_ig_inst_int_map = {"movl": [2], "addl": [2], "negl": [1],
-                          "pushl": [], "popl": [], "call": caller_saved_registers,
-                          "cmpl": [2], "else": [], "endif": [],
-                          "orl": [2], "andl": [2], "notl": [1],
-                          "shr": [2], "shl": [2]}
-
     iset = set([])
-    for operand in ir_ig_inst_int_map.get(opcode, []):
+    for operand in ir_ig_inst_int_map.get(inst.opcode, []):
         if isinstance(operand, int):
-            iset.add(inst.split()[operand].strip(","))
+            iset.add(inst.operands[operand - 1].name)
         else:
             iset.add(operand)
-        
-        # remove EBP and ESP from the set as they might be used for function calls in IR
-        iset = iset - set([EBP, ESP])
-    return iset
+    # remove EBP and ESP from the set as they might be used for function calls in IR
+    return iset - set([EBP, ESP])
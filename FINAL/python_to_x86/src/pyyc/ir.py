@@ -0,0 +1,266 @@
+###########################################################
+# File: src/pyyc/ir.py                                    #
+# Description: Structured IR instructions for the backend #
+###########################################################
+
+# irgen emits the IR as text ("movl tmp_17_5, %eax"). It is parsed once,
+# right after irgen, into Instruction objects so that the backend passes
+# never split or strip instruction strings again. str() of an instruction
+# gives back the original text, which is what the .ir dumps contain.
+
+from utils import REGISTER, STACK, CONST, VARIABLE
+
+
+class Opcode(object):
+    '''
+    The opcodes of the IR. The values are interned strings, so that
+    comparing opcodes is a pointer comparison and printing needs no table.
+    '''
+    MOVL = intern("movl")
+    ADDL = intern("addl")
+    SUBL = intern("subl")
+    NEGL = intern("negl")
+    ANDL = intern("andl")
+    ORL = intern("orl")
+    NOTL = intern("notl")
+    SHL = intern("shl")
+    SHR = intern("shr")
+    SAR = intern("sar")
+    PUSHL = intern("pushl")
+    POPL = intern("popl")
+    CMPL = intern("cmpl")
+    CALL = intern("call")
+    JMP = intern("jmp")
+    JNE = intern("jne")
+    JE = intern("je")
+    JL = intern("jl")
+    JLE = intern("jle")
+    JG = intern("jg")
+    JGE = intern("jge")
+    # "name:" is a label instruction whose only operand is the name
+    LABEL = intern("label")
+
+    CONDITIONAL_JUMPS = frozenset([JNE, JE, JL, JLE, JG, JGE])
+    JUMPS = CONDITIONAL_JUMPS | frozenset([JMP])
+
+
+# Operands of the IR read and written by each opcode (1 based, like the
+# operands of the text form). Only variables end up in the sets.
+ir_read_inst_map = {Opcode.MOVL: [1], Opcode.ADDL: [1, 2], Opcode.SUBL: [1, 2], Opcode.NEGL: [1],
+                    Opcode.PUSHL: [1], Opcode.CALL: [], Opcode.CMPL: [1, 2],
+                    Opcode.ORL: [1, 2], Opcode.ANDL: [1, 2], Opcode.NOTL: [1],
+                    Opcode.SHR: [1, 2], Opcode.SAR: [1, 2], Opcode.SHL: [1, 2]}
+ir_write_inst_map = {Opcode.MOVL: [2], Opcode.ADDL: [2], Opcode.SUBL: [2], Opcode.NEGL: [1],
+                     Opcode.PUSHL: [], Opcode.CALL: [], Opcode.CMPL: [],
+                     Opcode.ORL: [2], Opcode.ANDL: [2], Opcode.NOTL: [1],
+                     Opcode.SHR: [2], Opcode.SAR: [2], Opcode.SHL: [2]}
+
+# Opcodes computing their last operand from their operands only, shared by
+# the passes that fold (sccp) or number (gvn) them
+binary_opcodes = frozenset([Opcode.ADDL, Opcode.SUBL, Opcode.ANDL, Opcode.ORL,
+                            Opcode.SHL, Opcode.SHR, Opcode.SAR])
+unary_opcodes = frozenset([Opcode.NEGL, Opcode.NOTL])
+
+# Operand (1 based) of each opcode that may be an immediate instead of a variable
+immediate_operands = {Opcode.MOVL: 1, Opcode.ADDL: 1, Opcode.SUBL: 1, Opcode.ANDL: 1,
+                      Opcode.ORL: 1, Opcode.SHL: 1, Opcode.SHR: 1, Opcode.SAR: 1,
+                      Opcode.PUSHL: 1,
+                      Opcode.CMPL: 1}
+
+# Functions of the runtime (and the closure call through %eax) that are
+# called directly. Any other call target that is not a function label
+# is a variable holding a function pointer.
+direct_call_targets = frozenset([
+    "get_fun_ptr",
+    "get_free_vars",
+    "print_any",
+    "input",
+    "create_closure",
+    "is_int",
+    "is_true",
+    "add",
+    "error_pyobj",
+    "is_bool",
+    "is_big",
+    "project_int",
+    "project_bool",
+    "project_big",
+    "inject_int",
+    "inject_bool",
+    "inject_big",
+    "set_subscript",
+    "equal",
+    "not_equal",
+    "get_subscript",
+    "create_list",
+    "create_dict",
+    "*%eax",
+])
+
+
+def classify(name):
+    '''
+    Kind of an operand from its text.
+    $5, $lambda_f -> CONST, -8(%ebp) -> STACK (any memory operand),
+    %eax -> REGISTER, anything else (tmp_17_5, x_0, labels) -> VARIABLE
+    '''
+    if "$" in name:
+        return CONST
+    if "(" in name:
+        return STACK
+    if "%" in name:
+        return REGISTER
+    return VARIABLE
+
+
+class Operand(object):
+    '''
+    An operand of an instruction. Operands are interned: there is a single
+    Operand per name, get one with operand(name).
+    '''
+    __slots__ = ("name", "kind")
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+
+    def is_var(self):
+        return self.kind is VARIABLE
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "Operand(%s)" % self.name
+
+
+_operands = {}
+
+
+def reset_operands():
+    '''
+    Forget the interned operands (once per compiled file), so that a
+    resident compiler does not keep the temporaries of every file it
+    compiled.
+    '''
+    _operands.clear()
+
+
+def operand(name):
+    '''
+    The interned Operand for name. Integers become immediates ($5).
+    param name: the operand text, an Operand or an integer
+    return: the Operand
+    '''
+    if isinstance(name, Operand):
+        return name
+    if isinstance(name, (int, long)):
+        name = "$%d" % name
+    op = _operands.get(name)
+    if op is None:
+        name = intern(name)
+        op = Operand(name, classify(name))
+        _operands[name] = op
+    return op
+
+
+def is_indirect_call(target):
+    '''
+    Whether a call goes through a variable holding a function pointer
+    (call tmp_13_216) rather than to a runtime function or a lambda.
+    param target: the Operand called
+    '''
+    name = target.name
+    return name not in direct_call_targets and not name.startswith("lambda_")
+
+
+def variables(operands, indices):
+    return frozenset(operands[i - 1].name for i in indices
+                     if operands[i - 1].kind is VARIABLE)
+
+
+class Instruction(object):
+    '''
+    One IR instruction: an opcode and a tuple of interned operands.
+    The variables read and written are computed once, when the instruction
+    is created, since liveness asks for them on every iteration.
+    '''
+    __slots__ = ("opcode", "operands", "reads", "writes")
+
+    def __init__(self, opcode, operands=()):
+        self.opcode = opcode
+        self.operands = tuple(operand(op) for op in operands)
+        if opcode is Opcode.CALL:
+            # An indirect call reads the variable holding the function
+            # pointer, dead store elimination must keep its definition
+            self.reads = variables(self.operands,
+                                   [1] if is_indirect_call(self.operands[0]) else [])
+        else:
+            self.reads = variables(self.operands, ir_read_inst_map.get(opcode, []))
+        self.writes = variables(self.operands, ir_write_inst_map.get(opcode, []))
+
+    def is_label(self):
+        return self.opcode is Opcode.LABEL
+
+    def is_jmp(self):
+        return self.opcode in Opcode.JUMPS
+
+    def get_label(self):
+        '''
+        The label defined by a label instruction or the target of a jump
+        '''
+        return self.operands[0].name
+
+    def __str__(self):
+        if self.opcode is Opcode.LABEL:
+            return self.operands[0].name + ":"
+        if not self.operands:
+            return self.opcode
+        return self.opcode + " " + ", ".join([op.name for op in self.operands])
+
+    def __repr__(self):
+        return "Instruction(%s)" % str(self)
+
+
+def inst(opcode, *operands):
+    '''
+    Build an instruction.
+    Usage: inst(Opcode.MOVL, "tmp_17_5", EAX)
+    '''
+    return Instruction(opcode, operands)
+
+
+def label(name):
+    return Instruction(Opcode.LABEL, (name,))
+
+
+def parse(line):
+    '''
+    Parse the text form of one instruction, e.g. "addl $4, %esp" or "else_tmp_17_3:"
+    param line: the instruction text
+    return: the Instruction
+    '''
+    line = line.strip()
+    if line.endswith(":"):
+        return label(line[:-1])
+    parts = line.split(None, 1)
+    if not parts:
+        raise RuntimeError("Empty IR instruction")
+    operands = []
+    if len(parts) == 2:
+        operands = [op.strip() for op in parts[1].split(",")]
+    return Instruction(intern(parts[0]), operands)
+
+
+def parse_ir(lines):
+    '''
+    Parse the IR of one function
+    '''
+    return [parse(line) for line in lines]
+
+
+def to_text(ir):
+    '''
+    Text form of a list of instructions, one line per instruction (for the .ir dumps)
+    '''
+    return [str(i) for i in ir]
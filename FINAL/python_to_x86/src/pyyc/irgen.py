@@ -4,14 +4,25 @@ from compiler.ast import UnarySub
 from compiler.ast import Subscript
 from compiler.ast import While
 from compiler.ast import Break
+from explicate import AddInt, UnarySubInt, CompareInt
 import utils
+import ir as IR
 from utils import InstGen
-from utils import EAX, SHIFT, MASK, from_ebp, ESP
+from utils import EAX, SHIFT, MASK, from_ebp, ESP, INT_TAG, BOOL_TAG, BIG_TAG
 
 # Very Important:
 # Make sure that every jump  is followed by a label
 # We need it to be able to create a CFG
 
+# Runtime functions on the tag of a value (runtime.h) that are emitted
+# inline instead of called
+tag_functions = frozenset(["inject_int", "inject_bool", "inject_big",
+                           "project_int", "project_bool", "project_big",
+                           "is_int", "is_bool", "is_big", "is_true"])
+
+# tag checked by the is_* functions
+checked_tags = {"is_int": INT_TAG, "is_bool": BOOL_TAG, "is_big": BIG_TAG}
+
 
 class IRGenVisitor(compiler.visitor.ASTVisitor):
     '''
@@ -81,17 +92,24 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         src_var_1 = utils.tmpvar()
         src_var_2 = utils.tmpvar()
 
-        if isinstance(node.expr, Add):
+        if isinstance(node.expr, AddInt):
+            # untagged ints, see explicate.unboxed
+            self.ir.movl(src[0], dst) \
+                .addl(src[1], dst)
+        elif isinstance(node.expr, UnarySubInt):
+            self.ir.movl(src, dst) \
+                .negl(dst)
+        elif isinstance(node.expr, Add):
             self.ir.movl(src[0], src_var_1) \
                 .movl(src_var_1, dst) \
-                .shr(SHIFT, dst) \
+                .sar(SHIFT, dst) \
                 .movl(src[1], src_var_2) \
-                .shr(SHIFT, src_var_2) \
+                .sar(SHIFT, src_var_2) \
                 .addl(src_var_2, dst)
         elif isinstance(node.expr, UnarySub):
             self.ir.movl(src, src_var_1) \
                 .movl(src_var_1, dst) \
-                .shr(SHIFT, dst) \
+                .sar(SHIFT, dst) \
                 .negl(dst)
         else:
             self.ir.movl(src, src_var_1) \
@@ -117,8 +135,9 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
             .movl(op2, rvar) \
             .movl(op1, lvar)
         if op in ['==', '!=']:
-            self.ir.movl(MASK, cmpvar) \
-                .notl(cmpvar) \
+            # the mask clearing the tag is a plain immediate move, so the
+            # register allocator can rematerialize it instead of spilling
+            self.ir.movl(~MASK, cmpvar) \
                 .andl(cmpvar, lvar) \
                 .andl(cmpvar, rvar)  \
                 .pushl(lvar) \
@@ -137,28 +156,50 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
             else:
                 self.ir.movl(1, EAX)
             self.ir.endif_(control_flow_labels[1])
-        self.ir.else_(control_flow_labels[0]) \
-            .movl(op1, lvar) \
+        self.ir.else_(control_flow_labels[0])
+        self.small_compare(op, op1, op2, lvar, rvar, control_flow_labels[2], True)
+        self.ir.endif_(control_flow_labels[0]) \
+            .shl(SHIFT, EAX) \
+            .orl(1, EAX)
+
+        return EAX  # this is where the result is stored
+
+    def small_compare(self, op, op1, op2, lvar, rvar, label, tagged):
+        '''
+        Compare two ints or bools, leaving 1 or 0 in EAX
+        param label: label of the if/else on the result of the comparison
+        param tagged: whether the operands are tagged, == then ignores the tags
+        '''
+        self.ir.movl(op1, lvar) \
             .movl(op2, rvar)
-        if (op in ["==", "!="]):
+        if tagged and op in ["==", "!="]:
             self.ir.shr(SHIFT, lvar) \
                 .shr(SHIFT, rvar)
-        self.ir.ifeq(rvar, lvar, control_flow_labels[2])
+        self.ir.ifeq(rvar, lvar, label)
         if op in ['==', 'is']:
             self.ir.movl(1, EAX)
         else:
             self.ir.movl(0, EAX)
-        self.ir.else_(control_flow_labels[2])
+        self.ir.else_(label)
         if op in ['==', 'is']:
             self.ir.movl(0, EAX)
         else:
             self.ir.movl(1, EAX)
-        self.ir.endif_(control_flow_labels[2]) \
-            .endif_(control_flow_labels[0]) \
-            .shl(SHIFT, EAX) \
-            .orl(1, EAX)
+        self.ir.endif_(label)
 
-        return EAX  # this is where the result is stored
+    def visitCompareInt(self, node):
+        '''
+        Compare two untagged ints (see explicate.unboxed), without the tag
+        test and the comparison of bigs of visitCompare.
+        '''
+        op1 = self.visit(node.expr)
+        op2 = self.visit(node.ops[0][1])
+        lvar = utils.tmpvar()
+        rvar = utils.tmpvar()
+        self.small_compare(node.ops[0][0], op1, op2, lvar, rvar, utils.tmpvar(), False)
+        self.ir.shl(SHIFT, EAX) \
+            .orl(1, EAX)
+        return EAX
 
     def visitIf(self, node):
         '''
@@ -169,16 +210,25 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         '''
         test = node.tests[0][0]
         control_flow_label = utils.tmpvar()
-        self.ir.ifeq(1, self.visit(test), control_flow_label)
+        if isinstance(test, CompareInt):
+            # jump on the comparison of the untagged ints, no bool is made
+            lvar = utils.tmpvar()
+            self.ir.movl(self.visit(test.expr), lvar)
+            if test.ops[0][0] in ['==', 'is']:
+                self.ir.ifeq(self.visit(test.ops[0][1]), lvar, control_flow_label)
+            else:
+                self.ir.ifne(self.visit(test.ops[0][1]), lvar, control_flow_label)
+        else:
+            self.ir.ifeq(1, self.visit(test), control_flow_label)
         self.visit(node.tests[0][1])
-        if hasattr(node.else_, "nodes") and isinstance(node.else_.nodes[0], Break):
+        # a branch can be empty once constfold drops its statements
+        if getattr(node.else_, "nodes", None) and isinstance(node.else_.nodes[0], Break):
             # FIXME: This is a very hacky and dangerous way to handle loops.
             # We should have a better way to handle loops.
             # We are assuming that break statement will only be used by us in loops.
             # Although it is true, this is not a safe assumption if we want to
             # handle loops in a general way or extend the compiler in future.
             self.ir.jmp("while_" + str(self.loop_label))
-            self.loop_label = None
             self.ir.else_(control_flow_label, False)
         else:
             self.ir.else_(control_flow_label)
@@ -202,8 +252,11 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         control_flow_label = utils.tmpvar()
         self.ir.while_(control_flow_label)
         # Don't worry about test, it is an infinite loop
+        # Loops nest: the loop around this one gets its label back at the end
+        outer_loop_label = self.loop_label
         self.loop_label = control_flow_label
         self.visit(node.body)
+        self.loop_label = outer_loop_label
         return None
 
     def visitAdd(self, node):
@@ -218,6 +271,8 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         op2 = self.visit(node.right)
         return (op1, op2)
 
+    visitAddInt = visitAdd
+
     def visitUnarySub(self, node):
         '''
         Negate the value of the operand.
@@ -225,6 +280,8 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         op = self.visit(node.expr)
         return str(op)
 
+    visitUnarySubInt = visitUnarySub
+
     def visitSubscript(self, node, dest=None):
         '''
         - get the value of the list using get_subscript(list, key)
@@ -291,6 +348,8 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         compare, and, or, not, isint, isbool, isbig.
         '''
         #TODO(raghu): Check if the label is a function 
+        if node.node.name in tag_functions:
+            return self.tag_function(node.node.name, self.visit(node.args[0]))
         args = []
         for idx, arg in enumerate(node.args):
             arg  = self.visit(arg)
@@ -302,6 +361,63 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
         self.ir.addl(len(node.args)*4, ESP)
         return EAX
 
+    def tag_function(self, name, value):
+        '''
+        Inline code of a runtime function on the tag of a value, a few
+        instructions on the tagged word instead of a call.
+        is_true is only inlined for ints and bools, a big is still passed
+        to the runtime.
+        param value: the argument of the call
+        return: the variable holding the result
+        '''
+        result = utils.tmpvar()
+        self.ir.movl(value, result)
+        if name == "inject_int":
+            self.ir.shl(SHIFT, result)
+        elif name == "inject_bool":
+            self.ir.shl(SHIFT, result) \
+                .orl(BOOL_TAG, result)
+        elif name == "inject_big":
+            self.ir.orl(BIG_TAG, result)
+        elif name in ["project_int", "project_bool"]:
+            self.ir.sar(SHIFT, result)
+        elif name == "project_big":
+            self.ir.andl(~MASK, result)
+        elif name == "is_true":
+            # when the tag is known (sccp) only one of the cases is left
+            labels = [utils.tmpvar() for i in range(2)]
+            sign = utils.tmpvar()
+            self.ir.andl(MASK, result) \
+                .ifeq(BIG_TAG, result, labels[0]) \
+                .pushl(value) \
+                .call('is_true') \
+                .addl(4, ESP) \
+                .movl(EAX, result) \
+                .else_(labels[0]) \
+                .ifeq(BOOL_TAG, result, labels[1]) \
+                .movl(value, result) \
+                .shr(SHIFT, result) \
+                .else_(labels[1])
+            # an int is true when its value bits are not all 0: then
+            # either the value or its negation has the sign bit set
+            self.ir.movl(value, result) \
+                .andl(~MASK, result) \
+                .movl(result, sign) \
+                .negl(sign) \
+                .orl(sign, result) \
+                .shr(31, result) \
+                .endif_(labels[1]) \
+                .endif_(labels[0])
+        else:
+            label = utils.tmpvar()
+            self.ir.andl(MASK, result) \
+                .ifeq(checked_tags[name], result, label) \
+                .movl(1, result) \
+                .else_(label) \
+                .movl(0, result) \
+                .endif_(label)
+        return result
+
     def visitConst(self, node):
         val = str(node.value)
         return str(val)
@@ -342,7 +458,11 @@ class IRGenVisitor(compiler.visitor.ASTVisitor):
 
 # Helper function to get IR from the flattened AST
 def get_ir_list(node):
-    return compiler.visitor.walk(node,
+    '''
+    return: one list of ir.Instruction per function, starting with the function label
+    '''
+    ir_list = compiler.visitor.walk(node,
                           IRGenVisitor()).ir_list
+    return [IR.parse_ir(instructions) for instructions in ir_list]
 
 
@@ -0,0 +1,192 @@
+from bisect import bisect_left
+import heapq
+import interferencegraph as ig
+import color_and_spill as cs
+from utils import Graph
+from utils import num_registers, registers, register_preference, REGISTER
+
+
+def live_intervals(flow_graph):
+    '''
+    Live interval of every variable over the instructions of the function
+    in block order: from the first point where it is defined or live to the
+    last one. Liveness must be up to date (CFG.liveness_analysis).
+    A variable live on entry (exit) of a block covers the start (end) of the
+    block, so the interval holds every point where the variable is live.
+    return: dict variable name -> [start, end]
+    '''
+    intervals = {}
+
+    def extend(name, point):
+        interval = intervals.get(name)
+        if interval is None:
+            intervals[name] = [point, point]
+        elif point < interval[0]:
+            interval[0] = point
+        elif point > interval[1]:
+            interval[1] = point
+
+    variables = flow_graph.variables
+    start = 0
+    for block in flow_graph.get_blocks():
+        instructions = block.get_instructions()
+        end = start + len(instructions) - 1
+        for name in variables.names_of(block.live_in):
+            extend(name, start)
+        for name in variables.names_of(block.live_out):
+            extend(name, end)
+        for i, inst in enumerate(instructions):
+            for op in inst.operands:
+                if op.is_var():
+                    extend(op.name, start + i)
+        start = end + 1
+    return intervals
+
+
+def register_writes(flow_graph):
+    '''
+    Points where each register is overwritten: explicit writes to the
+    register and, for the caller saved ones, every call.
+    return: list indexed by color of sorted lists of points
+    '''
+    writes = [[] for _ in registers]
+    point = 0
+    for block in flow_graph.get_blocks():
+        for inst in block.get_instructions():
+            for name in ig.interference_set(inst):
+                if name in registers:
+                    writes[registers.index(name)].append(point)
+            point += 1
+    return writes
+
+
+def is_clobbered(writes, interval):
+    '''
+    Whether a register written at the points writes would be overwritten
+    while a variable with this interval is live in it
+    '''
+    k = bisect_left(writes, interval[0])
+    return k < len(writes) and writes[k] < interval[1]
+
+
+def scan(graph, intervals, writes):
+    '''
+    Linear scan: walk the intervals by start point, free the registers of
+    the intervals that ended, and give the interval the first free register
+    (in utils.register_preference) that is not overwritten during it.
+    Without one, the active interval ending last that could use the
+    register instead is moved to the stack if it ends after this one,
+    otherwise this one goes to the stack. Unspillable
+    vertices (spill temporaries) are never moved to the stack.
+    Stack slots of expired intervals are reused by intervals starting
+    after them.
+    Vertices that already have a color keep it.
+    '''
+    order = sorted([(interval[0], interval[1], name) for name, interval in intervals.items()
+                    if name in graph and graph.get_color(name) is None])
+    # (end, name) of the intervals holding a register, and a heap of
+    # those holding a stack slot
+    active = []
+    active_slots = []
+    # (end of the last interval in the slot, stack color)
+    free_slots = []
+    next_slot = num_registers
+    for vertex in graph.get_vertices():
+        col = graph.get_color(vertex)
+        if col is not None and col >= num_registers:
+            next_slot = max(next_slot, col + 1)
+
+    for start, end, name in order:
+        for end_active, vertex in list(active):
+            if end_active <= start:
+                active.remove((end_active, vertex))
+        while active_slots and active_slots[0][0] <= start:
+            end_slot, vertex = heapq.heappop(active_slots)
+            free_slots.append((end_slot, graph.get_color(vertex)))
+
+        used = set([graph.get_color(vertex) for _, vertex in active])
+        color = None
+        for col in register_preference:
+            if col not in used and not is_clobbered(writes[col], (start, end)):
+                color = col
+                break
+
+        if color is None:
+            candidates = [(end_active, vertex) for end_active, vertex in active
+                          if not graph.is_unspillable(vertex)
+                          and not is_clobbered(writes[graph.get_color(vertex)], (start, end))]
+            if candidates:
+                end_active, vertex = max(candidates)
+                if end_active > end or graph.is_unspillable(name):
+                    color = graph.get_color(vertex)
+                    active.remove((end_active, vertex))
+                    slot, next_slot = take_slot(free_slots, next_slot, intervals[vertex][0])
+                    graph.set_color(vertex, slot)
+                    heapq.heappush(active_slots, (end_active, vertex))
+
+        if color is not None:
+            graph.set_color(name, color)
+            active.append((end, name))
+        else:
+            slot, next_slot = take_slot(free_slots, next_slot, start)
+            graph.set_color(name, slot)
+            heapq.heappush(active_slots, (end, name))
+    return graph
+
+
+def take_slot(free_slots, next_slot, start):
+    '''
+    A stack slot for an interval beginning at start: the lowest free slot
+    whose last interval ended by then, or a new one.
+    return: (stack color to use, next unused stack color)
+    '''
+    usable = [(slot, end) for end, slot in free_slots if end <= start]
+    if usable:
+        slot, end = min(usable)
+        free_slots.remove((end, slot))
+        return (slot, next_slot)
+    return (next_slot, next_slot + 1)
+
+
+def allocation_graph(flow_graph):
+    '''
+    A graph with a vertex for every variable and register of the function
+    and no edges; the registers get their own color. It carries the
+    allocation to the spill code and x86gen like the interference graph.
+    '''
+    graph = ig.add_all_vertices(Graph(), flow_graph.get_ir())
+    for vertex in graph.get_vertices():
+        if graph.get_type(vertex) == REGISTER and vertex in registers:
+            graph.set_color(vertex, registers.index(vertex))
+    return graph
+
+
+def linear_scan(flow_graph, stats=None):
+    '''
+    Allocate registers with linear scan instead of graph coloring, and
+    insert spill code until no new spill temporaries are needed.
+    Faster to compile than color_and_spill but the intervals are coarser
+    than the interference graph, so more variables end up on the stack.
+    param flow_graph: the cfg.CFG of the function, spill code is added to its blocks
+    param stats: optional stats.PassRecord, gets the number of spill rounds
+                 and of rematerialized variables
+    return: (graph with the colors, IR with spill code)
+    '''
+    graph = allocation_graph(flow_graph)
+    roundNo = 0
+    remat = 0
+    while True:
+        flow_graph.liveness_analysis()
+        graph = scan(graph, live_intervals(flow_graph), register_writes(flow_graph))
+        remat += cs.rematerialize(flow_graph, graph, cs.rematerializable(flow_graph))
+        if not cs.spill_blocks(flow_graph, graph):
+            break
+        # the spill temporaries are new vertices
+        spilled_graph = allocation_graph(flow_graph)
+        cs.carry_over_spills(graph, spilled_graph)
+        graph = spilled_graph
+        roundNo += 1
+    if stats is not None:
+        stats.set("spill_rounds", roundNo)
+        stats.set("rematerialized", remat)
+    return (graph, flow_graph.get_ir())
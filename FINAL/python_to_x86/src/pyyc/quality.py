@@ -0,0 +1,84 @@
+# quality.py
+# Per-function code quality report (--quality-report), written next to
+# the assembly as foo.quality.json, and the check of a report against a
+# baseline:  python2 quality.py baseline.quality.json foo.quality.json
+import json
+import sys
+
+# Passes that allocate registers, one of them runs for every function
+allocation_passes = ["color_and_spill", "linear_scan"]
+
+# Measurements of the report where a higher number is worse
+regression_keys = ["spilled", "frame_size", "spill_rounds", "movl_insts"]
+
+
+def function_report(function):
+    '''
+    The quality measurements of one function from its pass records.
+    param function: a function of stats.PassStats (name and pass records)
+    return: dict of the measurements
+    '''
+    passes = dict((record["name"], record) for record in function["passes"])
+    allocation = {}
+    for name in allocation_passes:
+        if name in passes:
+            allocation = passes[name]
+    x86gen = passes.get("x86gen", {})
+    return {"name": function["name"],
+            "registers_used": allocation.get("registers_used", []),
+            "spilled": allocation.get("spilled", 0),
+            "spill_rounds": allocation.get("spill_rounds", 0),
+            "frame_size": x86gen.get("frame_size", 0),
+            "moves_removed": x86gen.get("moves_removed", 0),
+            "movl_insts": x86gen.get("movl_insts", 0)}
+
+
+def quality_report(stats):
+    '''
+    Quality report of a compiled file.
+    param stats: the enabled stats.PassStats of the compile
+    return: dict with the file and a report per function
+    '''
+    return {"file": stats.filename,
+            "functions": [function_report(function) for function in stats.functions]}
+
+
+def to_json(report):
+    return json.dumps(report, indent=2, sort_keys=True)
+
+
+def regressions(baseline, report):
+    '''
+    Measurements of report that got worse than in baseline. Functions are
+    matched by their position in the file, since the names of the lambdas
+    come from utils.tmpvar and change with the date, so reports with a
+    different number of functions cannot be compared and are a failure.
+    return: list of (function, key, baseline value, new value)
+    '''
+    count = len(baseline["functions"])
+    if len(report["functions"]) != count:
+        return [(report["file"], "functions", count, len(report["functions"]))]
+    worse = []
+    for before, function in zip(baseline["functions"], report["functions"]):
+        for key in regression_keys:
+            if function[key] > before.get(key, 0):
+                worse.append((function["name"], key, before.get(key, 0), function[key]))
+    return worse
+
+
+def main(argv):
+    if len(argv) != 2:
+        print >> sys.stderr, "usage: quality.py baseline.quality.json new.quality.json"
+        return 2
+    with open(argv[0]) as f:
+        baseline = json.load(f)
+    with open(argv[1]) as f:
+        report = json.load(f)
+    worse = regressions(baseline, report)
+    for name, key, before, after in worse:
+        print "%s: %s went from %s to %s" % (name, key, before, after)
+    return 1 if worse else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
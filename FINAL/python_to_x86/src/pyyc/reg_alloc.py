@@ -1,35 +1,92 @@
 import interferencegraph as ig
 import color_and_spill as cs
-from x86gen import x86CodeGen
+import linear_scan as ls
+import sccp
+import gvn
+from x86gen import x86CodeGen, frame_size
 import utils
 import cfg
+import ir as IR
+import stats as ps
 
-def reg_alloc(ir_list):
+# Register allocators selectable with --regalloc
+GRAPH = "graph"
+LINEAR = "linear"
+allocators = [GRAPH, LINEAR]
+
+
+def reg_alloc(ir_list, stats=None, debug_prefix=None, allocator=GRAPH):
+    '''
+    Allocate registers and generate x86 for every function.
+    param ir_list: one IR list per function, each starting with its label
+    param stats: optional stats.PassStats collecting per pass measurements
+    param debug_prefix: if given, the IR after dse, sccp, gvn and spilling is
+                        dumped to <debug_prefix>_<pass>_<function>.ir
+    param allocator: GRAPH colors the interference graph, LINEAR runs a
+                     linear scan over live intervals (faster to compile,
+                     usually more spills)
+    return: one list of x86 instructions per function
+    '''
+    stats = stats or ps.disabled
     x86asm_list = []
     # Run register allocation for each function
     # ir_list contains ir for every function in the program 
     # as a list
     for ir in ir_list:
-        func_name = ir[0][:-1]
+        func_name = ir[0].get_label()
+        stats.begin_function(func_name)
         
+        # The CFG is built once, the passes below edit its blocks in place
+        with stats.timed("cfg") as rec:
+            flow_graph = cfg.CFG(ir)
+            flow_graph.build_cfg()
+        rec.set("blocks", len(flow_graph.get_blocks()))
+
         # Run dead store elimination
-        cfg_dse = cfg.CFG(ir)
-        cfg_dse.build_cfg()
-        ir = cfg_dse.run_dead_store_elimination()
-        utils.write_to_file("dse" + func_name + ".ir", ir)
+        with stats.timed("dse") as rec:
+            ir = flow_graph.run_dead_store_elimination()
+        utils.write_debug_file(debug_prefix, "_dse_" + func_name + ".ir", IR.to_text(ir))
+        rec.ir(ir)
+
+        with stats.timed("sccp") as rec:
+            ir = sccp.sccp(flow_graph, rec)
+        utils.write_debug_file(debug_prefix, "_sccp_" + func_name + ".ir", IR.to_text(ir))
+        rec.ir(ir)
+        rec.set("blocks", len(flow_graph.get_blocks()))
 
-        cfg_lvn = cfg.CFG(ir)
-        cfg_lvn.build_cfg()
-        ir = cfg_lvn.lvn()
-        utils.write_to_file("lvn_" + func_name + ".ir", ir)
+        with stats.timed("gvn") as rec:
+            ir = gvn.gvn(flow_graph, rec)
+        utils.write_debug_file(debug_prefix, "_gvn_" + func_name + ".ir", IR.to_text(ir))
+        rec.ir(ir)
 
-        # Generate Interference Graph
-        interference_graph = ig.create_interference_graph(ir)
+        if allocator == LINEAR:
+            with stats.timed("linear_scan") as rec:
+                graph, ir = ls.linear_scan(flow_graph, rec)
+            rec.ir(ir)
+            rec.set("vertices", len(graph))
+            rec.allocation(graph)
+        else:
+            # Generate Interference Graph
+            with stats.timed("interference") as rec:
+                interference_graph = ig.create_interference_graph(flow_graph)
+            rec.graph(interference_graph)
 
-        # # Allocate Registers for the nodes in the interference graph
-        graph, ir = cs.color_and_spill(interference_graph, ir)
+            # # Allocate Registers for the nodes in the interference graph
+            with stats.timed("color_and_spill") as rec:
+                graph, ir = cs.color_and_spill(interference_graph, flow_graph, rec)
+            rec.ir(ir)
+            rec.graph(graph)
+            rec.allocation(graph)
+        utils.write_debug_file(debug_prefix, "_spill_" + func_name + ".ir", IR.to_text(ir))
 
         # # Generate x86 Assembly
-        x86asm = x86CodeGen().x86gen(graph, ir[1:], func_name=func_name)
+        with stats.timed("x86gen") as rec:
+            codegen = x86CodeGen()
+            x86asm = codegen.x86gen(graph, ir[1:], func_name=func_name)
+        rec.set("x86_insts", len(x86asm))
+        rec.set("frame_size", frame_size(graph))
+        rec.set("moves_removed", codegen.moves_removed)
+        rec.set("movl_insts", len([inst for inst in x86asm if inst.startswith("movl ")]))
         x86asm_list.append(x86asm)
+        stats.end_function()
     return x86asm_list
@@ -0,0 +1,467 @@
+###########################################################
+# File: src/pyyc/sccp.py                                  #
+# Description: Sparse conditional constant propagation    #
+###########################################################
+
+# Wegman and Zadeck's algorithm over the SSA form of ssa.py. A value is
+# TOP (not computed yet), a constant, a tag (only the low MASK bits are
+# known, e.g. the result of inject_int or of a shl by SHIFT), or BOTTOM.
+# Knowing the tags is what makes the branches of the explicated code
+# constant: is_int of an injected int is 1 even though the int itself
+# came from input().
+
+from utils import EAX, SHIFT, MASK, CONST, REGISTER, INT_TAG, BOOL_TAG, BIG_TAG
+import ir as IR
+from ir import Opcode, binary_opcodes, unary_opcodes
+from gvn import is_tracked, written, read_only, pops_arguments
+import ssa as SSA
+
+TOP = "top"
+BOTTOM = "bottom"
+
+
+def tag(bits):
+    return ("tag", bits & MASK)
+
+
+def is_constant(value):
+    return isinstance(value, (int, long))
+
+
+def low_bits(value):
+    '''
+    The tag bits of a value, None when they are not known
+    '''
+    if is_constant(value):
+        return value & MASK
+    if isinstance(value, tuple):
+        return value[1]
+    return None
+
+
+def word(value):
+    '''
+    value as a signed 32 bit integer
+    '''
+    value &= 0xffffffff
+    return int(value - (1 << 32) if value & 0x80000000 else value)
+
+
+def meet(a, b):
+    if a == TOP:
+        return b
+    if b == TOP or a == b:
+        return a
+    bits = low_bits(a)
+    if bits is not None and bits == low_bits(b):
+        return tag(bits)
+    return BOTTOM
+
+
+def immediate(op):
+    '''
+    Value of a constant operand; $lambda_f and the like are not known
+    '''
+    try:
+        return int(op.name[1:])
+    except ValueError:
+        return BOTTOM
+
+
+def fold(opcode, src, dst):
+    if opcode is Opcode.ADDL:
+        return word(dst + src)
+    if opcode is Opcode.SUBL:
+        return word(dst - src)
+    if opcode is Opcode.ANDL:
+        return word(dst & src)
+    if opcode is Opcode.ORL:
+        return word(dst | src)
+    if opcode is Opcode.SHL:
+        return word(dst << (src & 31))
+    if opcode is Opcode.SHR:
+        return word((dst & 0xffffffff) >> (src & 31))
+    if opcode is Opcode.SAR:
+        return word(dst >> (src & 31))
+    if opcode is Opcode.NEGL:
+        return word(-dst)
+    return word(~dst)
+
+
+def evaluate(opcode, src, dst):
+    '''
+    Value written by "opcode src, dst" (src is None for the unary opcodes)
+    '''
+    if src == TOP or dst == TOP:
+        return TOP
+    if is_constant(dst) and (src is None or is_constant(src)):
+        return fold(opcode, src, dst)
+    s, d = low_bits(src), low_bits(dst)
+    if opcode is Opcode.ANDL:
+        # a mask within the tag bits leaves a constant
+        if is_constant(src) and src & ~MASK == 0 and d is not None:
+            return src & d
+        if is_constant(dst) and dst & ~MASK == 0 and s is not None:
+            return dst & s
+        if s is not None and d is not None:
+            return tag(s & d)
+        if s == 0 or d == 0:
+            return tag(0)
+    elif opcode is Opcode.ORL:
+        if s is not None and d is not None:
+            return tag(s | d)
+        if s == MASK or d == MASK:
+            return tag(MASK)
+    elif opcode is Opcode.ADDL and s is not None and d is not None:
+        return tag(d + s)
+    elif opcode is Opcode.SUBL and s is not None and d is not None:
+        return tag(d - s)
+    elif opcode is Opcode.SHL and is_constant(src):
+        count = src & 31
+        if count >= SHIFT:
+            return tag(0)
+        if count == 0:
+            return dst
+        if d is not None:
+            return tag(d << count)
+    elif opcode is Opcode.NEGL and d is not None:
+        return tag(-d)
+    elif opcode is Opcode.NOTL and d is not None:
+        return tag(~d)
+    return BOTTOM
+
+
+def evaluate_call(target, arg):
+    '''
+    Result of a runtime function of one argument, see runtime.c.
+    Only the functions without side effects are known.
+    '''
+    if arg == TOP:
+        return TOP
+    bits = low_bits(arg)
+    if target == "inject_int":
+        return word(arg << SHIFT) if is_constant(arg) else tag(INT_TAG)
+    if target == "inject_bool":
+        return word((arg << SHIFT) | BOOL_TAG) if is_constant(arg) else tag(BOOL_TAG)
+    if target == "inject_big":
+        return tag(BIG_TAG)
+    if target in ("project_int", "project_bool") and is_constant(arg):
+        # project_* assert the tag, the call stays when it would fail
+        if bits == (INT_TAG if target == "project_int" else BOOL_TAG):
+            return arg >> SHIFT
+    elif target in ("is_int", "is_bool", "is_big") and bits is not None:
+        return int(bits == {"is_int": INT_TAG, "is_bool": BOOL_TAG, "is_big": BIG_TAG}[target])
+    elif target == "is_true" and is_constant(arg) and bits in (INT_TAG, BOOL_TAG):
+        return int(arg >> SHIFT != 0)
+    return BOTTOM
+
+
+# Runtime functions evaluate_call knows
+known_calls = frozenset(["inject_int", "inject_bool", "inject_big", "project_int",
+                         "project_bool", "is_int", "is_bool", "is_big", "is_true"])
+
+
+def branch(opcode, lhs, rhs):
+    '''
+    Whether "cmpl lhs, rhs; opcode" jumps: True, False, TOP when an
+    operand is not computed yet, or BOTTOM when both ways are possible
+    '''
+    if lhs == TOP or rhs == TOP:
+        return TOP
+    if is_constant(lhs) and is_constant(rhs):
+        return {Opcode.JE: rhs == lhs, Opcode.JNE: rhs != lhs,
+                Opcode.JL: rhs < lhs, Opcode.JLE: rhs <= lhs,
+                Opcode.JG: rhs > lhs, Opcode.JGE: rhs >= lhs}[opcode]
+    bits = low_bits(lhs)
+    if opcode in (Opcode.JE, Opcode.JNE) and bits is not None and low_bits(rhs) not in (None, bits):
+        return opcode is Opcode.JNE
+    return BOTTOM
+
+
+class Propagation(object):
+    '''
+    State of the propagation over one function: the value of every SSA
+    value, the executable edges and blocks, and how every conditional
+    jump goes.
+    '''
+
+    def __init__(self, ssa):
+        self.ssa = ssa
+        self.values = [TOP] * ssa.num_values()
+        for value in ssa.entry.itervalues():
+            self.values[value] = BOTTOM
+        self.edges = set()
+        self.executable = set()
+        # block -> True (always jumps), False (never) or BOTTOM
+        self.branches = {}
+        self.flow_work = []
+        # (block, instruction index or ssa.PHIS) to evaluate again
+        self.ssa_work = []
+
+    def set(self, value, result):
+        result = meet(self.values[value], result)
+        if result != self.values[value]:
+            self.values[value] = result
+            self.ssa_work.extend(self.ssa.users[value])
+
+    def operand(self, op, uses):
+        if op.kind is CONST:
+            return immediate(op)
+        if is_tracked(op):
+            return self.values[uses[op.name]]
+        return BOTTOM
+
+    def run(self):
+        order = self.ssa.order
+        if not order:
+            return
+        self.flow_work.append((None, order[0]))
+        while self.flow_work or self.ssa_work:
+            if self.flow_work:
+                edge = self.flow_work.pop()
+                if edge in self.edges:
+                    continue
+                self.edges.add(edge)
+                block = edge[1]
+                if block in self.executable:
+                    self.visit_phis(block)
+                else:
+                    self.executable.add(block)
+                    self.visit(block)
+            else:
+                block, i = self.ssa_work.pop()
+                if block not in self.executable:
+                    continue
+                if i == SSA.PHIS:
+                    self.visit_phis(block)
+                else:
+                    self.visit_instruction(block, i)
+
+    def visit(self, block):
+        '''
+        Evaluate the phis and the instructions of a block that just became
+        executable
+        '''
+        self.visit_phis(block)
+        instructions = block.get_instructions()
+        for i in xrange(len(instructions)):
+            self.visit_instruction(block, i)
+        if not instructions or not instructions[-1].is_jmp():
+            # falls through to the next block
+            for succ in block.get_successors():
+                self.flow_work.append((block, succ))
+
+    def visit_phis(self, block):
+        preds = block.get_predecessors()
+        for phi in self.ssa.phis[block]:
+            result = TOP
+            for i, arg in enumerate(phi.args):
+                if (preds[i], block) in self.edges:
+                    result = meet(result, self.values[arg])
+            self.set(phi.value, result)
+
+    def visit_instruction(self, block, i):
+        '''
+        Evaluate the i-th instruction of block. A push is evaluated with the
+        call reading it and a cmpl with the jump after it.
+        '''
+        instructions = block.get_instructions()
+        inst = instructions[i]
+        opcode = inst.opcode
+        uses = self.ssa.uses[block]
+        operands = inst.operands
+        if inst.is_label():
+            return
+        if inst.is_jmp():
+            previous = instructions[i - 1] if i > 0 else None
+            self.visit_jump(block, inst, previous, uses[i - 1] if i > 0 else {})
+            return
+        if opcode is Opcode.PUSHL or opcode is Opcode.CMPL:
+            j = i + 1
+            while j < len(instructions) and instructions[j].opcode is Opcode.PUSHL:
+                j += 1
+            if j < len(instructions) and (instructions[j].opcode is Opcode.CALL
+                                          or instructions[j].is_jmp()):
+                self.visit_instruction(block, j)
+            return
+        result = {}
+        if opcode is Opcode.CALL:
+            target = operands[0].name
+            if (target in known_calls and i > 0 and instructions[i - 1].opcode is Opcode.PUSHL
+                    and i + 1 < len(instructions) and pops_arguments(instructions[i + 1], 1)):
+                result[EAX] = evaluate_call(target, self.operand(instructions[i - 1].operands[0],
+                                                                 uses[i - 1]))
+        elif opcode is Opcode.MOVL:
+            result[operands[1].name] = self.operand(operands[0], uses[i])
+        elif opcode in binary_opcodes:
+            result[operands[1].name] = evaluate(opcode, self.operand(operands[0], uses[i]),
+                                                self.operand(operands[1], uses[i]))
+        elif opcode in unary_opcodes:
+            result[operands[0].name] = evaluate(opcode, None, self.operand(operands[0], uses[i]))
+        for name, value in self.ssa.defs[block][i].iteritems():
+            self.set(value, result.get(name, BOTTOM))
+
+    def visit_jump(self, block, jump, previous, uses):
+        successors = block.get_successors()
+        if jump.opcode is Opcode.JMP:
+            taken = True
+        elif previous is not None and previous.opcode is Opcode.CMPL:
+            lhs, rhs = previous.operands
+            taken = branch(jump.opcode, self.operand(lhs, uses), self.operand(rhs, uses))
+        else:
+            taken = BOTTOM
+        # a jump that went both ways stays so
+        before = self.branches.get(block, TOP)
+        if before != TOP and before != taken:
+            taken = BOTTOM
+        self.branches[block] = taken
+        if taken == TOP:
+            return
+        # the target first, then the block falling through (see cfg.CFG)
+        if taken is True or taken == BOTTOM:
+            self.flow_work.append((block, successors[0]))
+        if (taken is False or taken == BOTTOM) and len(successors) > 1:
+            self.flow_work.append((block, successors[1]))
+
+
+class Rewrite(object):
+    '''
+    Rewrite of the function from the result of the propagation: the
+    blocks that never run go away, the jumps that always go one way become
+    jmp or disappear, known calls with a constant result become a movl,
+    and constants are read as immediates.
+    '''
+
+    def __init__(self, propagation):
+        self.propagation = propagation
+        self.values = propagation.values
+        self.blocks_removed = 0
+        self.branches_folded = 0
+        self.calls_folded = 0
+        self.constants = 0
+
+    def constant(self, value):
+        result = self.values[value]
+        return "$%d" % result if is_constant(result) else None
+
+    def block(self, block):
+        '''
+        return: the new instructions of block
+        '''
+        if block not in self.propagation.executable:
+            self.blocks_removed += 1
+            return []
+        ssa = self.propagation.ssa
+        instructions = block.get_instructions()
+        uses = ssa.uses[block]
+        defs = ssa.defs[block]
+        output = []
+        # positions in output of the pushes just before
+        pushes = []
+        i = 0
+        while i < len(instructions):
+            inst = instructions[i]
+            opcode = inst.opcode
+            i += 1
+            if opcode is Opcode.CALL and pushes and EAX in defs[i - 1]:
+                result = self.constant(defs[i - 1][EAX])
+                if result is not None and inst.operands[0].name in known_calls:
+                    # drop the push, the call and the addl to %esp
+                    del output[pushes[-1]:]
+                    output.append(IR.inst(Opcode.MOVL, result, EAX))
+                    self.calls_folded += 1
+                    pushes = []
+                    i += 1
+                    continue
+            if opcode is Opcode.PUSHL:
+                pushes.append(len(output))
+            else:
+                pushes = []
+
+            if inst.is_jmp() and opcode is not Opcode.JMP:
+                taken = self.propagation.branches.get(block)
+                if taken is True or taken is False:
+                    self.branches_folded += 1
+                    if output and output[-1].opcode is Opcode.CMPL:
+                        output.pop()
+                    if taken:
+                        output.append(IR.inst(Opcode.JMP, inst.operands[0].name))
+                    continue
+
+            targets = [op.name for op in inst.operands if is_tracked(op) and op.name in defs[i - 1]]
+            if (opcode is Opcode.MOVL or opcode in binary_opcodes or opcode in unary_opcodes) \
+                    and len(targets) == 1:
+                result = self.constant(defs[i - 1][targets[0]])
+                if result is not None:
+                    if opcode is not Opcode.MOVL or inst.operands[0].name != result:
+                        self.constants += 1
+                    output.append(IR.inst(Opcode.MOVL, result, targets[0]))
+                    continue
+            output.append(self.substitute(inst, uses[i - 1]))
+        return drop_overwritten(output)
+
+    def substitute(self, inst, uses):
+        '''
+        inst reading the constants as immediates where the operand may be one
+        '''
+        position = IR.immediate_operands.get(inst.opcode)
+        if position is None or position - 1 not in read_only(inst):
+            return inst
+        op = inst.operands[position - 1]
+        if not is_tracked(op):
+            return inst
+        result = self.constant(uses[op.name])
+        if result is None:
+            return inst
+        self.constants += 1
+        operands = [o.name for o in inst.operands]
+        operands[position - 1] = result
+        return IR.inst(inst.opcode, *operands)
+
+
+def drop_overwritten(instructions):
+    '''
+    instructions without the moves of a constant to a register that is
+    written again further down the block before being read, which the
+    calls folded to a movl leave behind. Dead store elimination only
+    looks at variables.
+    '''
+    kept = []
+    overwritten = set()
+    for inst in reversed(instructions):
+        if (inst.opcode is Opcode.MOVL and inst.operands[0].kind is CONST
+                and inst.operands[1].name in overwritten):
+            continue
+        overwritten |= set([name for name in written(inst) if IR.operand(name).kind is REGISTER])
+        overwritten -= set(SSA.tracked_reads(inst))
+        kept.append(inst)
+    kept.reverse()
+    return kept
+
+
+def sccp(flow_graph, stats=None):
+    '''
+    Sparse conditional constant propagation of a function. The function
+    goes into SSA form, the values and the executable blocks are found,
+    the blocks are rewritten and the function leaves SSA form.
+    param flow_graph: the cfg.CFG of the function, rebuilt when anything changed
+    param stats: optional stats.PassRecord, gets the number of removed
+                 blocks, folded branches and calls, and constants used
+    return: the IR of the function
+    '''
+    ssa = SSA.to_ssa(flow_graph)
+    propagation = Propagation(ssa)
+    propagation.run()
+    rewrite = Rewrite(propagation)
+    ir = []
+    for block in flow_graph.get_blocks():
+        ir.extend(rewrite.block(block))
+    if stats is not None:
+        stats.set("blocks_removed", rewrite.blocks_removed)
+        stats.set("branches_folded", rewrite.branches_folded)
+        stats.set("calls_folded", rewrite.calls_folded)
+        stats.set("constants", rewrite.constants)
+    if not (rewrite.blocks_removed or rewrite.branches_folded or rewrite.calls_folded
+            or rewrite.constants):
+        return flow_graph.get_ir()
+    return SSA.from_ssa(flow_graph, ir)
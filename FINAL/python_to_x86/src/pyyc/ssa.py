@@ -0,0 +1,212 @@
+###########################################################
+# File: src/pyyc/ssa.py                                   #
+# Description: SSA form of a function, out of SSA         #
+###########################################################
+
+# The IR is two-address: "addl y, x" reads x and writes it again, so the
+# operands cannot be renamed to x_1 = x_0 + y without a copy in front of
+# every such instruction. The SSA form is kept next to the instructions
+# instead: every definition of a variable or register gets a value, every
+# read is linked to the value it sees, and the joins get phis. Passes
+# working on it (see sccp.py) only replace reads by constants and delete
+# instructions and blocks, so no two values of a name are ever live at the
+# same time and leaving SSA is dropping the tables (see from_ssa).
+
+from utils import EAX, VARIABLE
+import ir as IR
+from ir import Opcode
+from gvn import is_tracked, written
+
+
+def tracked_reads(inst):
+    '''
+    The variables and registers an instruction reads
+    '''
+    if inst.opcode is Opcode.CALL:
+        # call *%eax reads the closure pointer in %eax
+        if inst.operands[0].name == "*" + EAX:
+            return [EAX]
+        return list(inst.reads)
+    if inst.is_label() or inst.is_jmp():
+        return []
+    if inst.opcode not in IR.ir_read_inst_map:
+        # an opcode without a known effect may read any operand
+        return [op.name for op in inst.operands if is_tracked(op)]
+    return [inst.operands[i - 1].name for i in IR.ir_read_inst_map[inst.opcode]
+            if is_tracked(inst.operands[i - 1])]
+
+
+# Index standing for the phis of a block in SSAForm.users
+PHIS = -1
+
+
+class Phi(object):
+    '''
+    phi of a name at the start of a block: value is defined from args[i]
+    when the block is entered from its i-th predecessor
+    '''
+    __slots__ = ("name", "value", "args")
+
+    def __init__(self, name, value, count):
+        self.name = name
+        self.value = value
+        self.args = [None] * count
+
+    def __repr__(self):
+        return "Phi(%s_%d = %s)" % (self.name, self.value, self.args)
+
+
+class SSAForm(object):
+    '''
+    SSA form of one function. Values are numbered from 0; the blocks are
+    the cfg.BasicBlock of the function, unreachable blocks have no entry.
+    '''
+
+    def __init__(self, order):
+        # the reachable blocks in reverse postorder
+        self.order = order
+        # block -> list of Phi
+        self.phis = dict((block, []) for block in order)
+        # block -> one dict name -> value per instruction, for its reads and writes
+        self.uses = {}
+        self.defs = {}
+        # value -> name
+        self.names = []
+        # value -> (block, index of the instruction) reading it, the index
+        # is PHIS for the phis of the block
+        self.users = []
+        # name -> value the name has on entry of the function
+        self.entry = {}
+
+    def new_value(self, name):
+        self.names.append(name)
+        self.users.append(set())
+        return len(self.names) - 1
+
+    def entry_value(self, name):
+        '''
+        The value of a name read before any definition: the arguments and
+        whatever the caller left in the registers
+        '''
+        value = self.entry.get(name)
+        if value is None:
+            value = self.entry[name] = self.new_value(name)
+        return value
+
+    def num_values(self):
+        return len(self.names)
+
+
+def place_phis(flow_graph, order, ssa):
+    '''
+    Put a phi for every name at the iterated dominance frontier of its
+    definitions. Variables only get one where they are live on entry of
+    the block (pruned SSA); registers, which liveness does not follow, get
+    one wherever they may be needed.
+    '''
+    frontiers = flow_graph.dominance_frontiers(order)
+    variables = flow_graph.variables
+    flow_graph.liveness_analysis()
+    definitions = {}
+    for block in order:
+        for inst in block.get_instructions():
+            for name in written(inst):
+                definitions.setdefault(name, set()).add(block)
+    for name, blocks in definitions.iteritems():
+        is_register = IR.operand(name).kind is not VARIABLE
+        placed = set()
+        worklist = list(blocks)
+        while worklist:
+            block = worklist.pop()
+            for join in frontiers[block]:
+                if join in placed:
+                    continue
+                placed.add(join)
+                if is_register or variables.is_live(join.live_in, name):
+                    count = len(join.get_predecessors())
+                    ssa.phis[join].append(Phi(name, ssa.new_value(name), count))
+                if join not in blocks:
+                    worklist.append(join)
+
+
+def rename(order, ssa):
+    '''
+    Link every read to the value it sees and give every definition its
+    own value, walking the dominator tree with a stack of values per name.
+    '''
+    stacks = {}
+
+    def current(name):
+        stack = stacks.get(name)
+        return stack[-1] if stack else ssa.entry_value(name)
+
+    # (block, None) enters a block, (block, names) leaves it and pops
+    # the values it pushed for names
+    work = [(order[0], None)] if order else []
+    while work:
+        block, pushed = work.pop()
+        if pushed is not None:
+            for name in pushed:
+                stacks[name].pop()
+            continue
+        pushed = []
+        for phi in ssa.phis[block]:
+            stacks.setdefault(phi.name, []).append(phi.value)
+            pushed.append(phi.name)
+        uses = []
+        defs = []
+        for i, inst in enumerate(block.get_instructions()):
+            read = {}
+            for name in tracked_reads(inst):
+                value = read[name] = current(name)
+                ssa.users[value].add((block, i))
+            wrote = {}
+            for name in written(inst):
+                value = wrote[name] = ssa.new_value(name)
+                stacks.setdefault(name, []).append(value)
+                pushed.append(name)
+            uses.append(read)
+            defs.append(wrote)
+        ssa.uses[block] = uses
+        ssa.defs[block] = defs
+        for succ in block.get_successors():
+            if succ not in ssa.phis:
+                continue
+            for i, pred in enumerate(succ.get_predecessors()):
+                if pred is not block:
+                    continue
+                for phi in ssa.phis[succ]:
+                    value = phi.args[i] = current(phi.name)
+                    ssa.users[value].add((succ, PHIS))
+        work.append((block, pushed))
+        for child in reversed(block.dom_children):
+            work.append((child, None))
+
+
+def to_ssa(flow_graph):
+    '''
+    SSA form of a function: dominators, dominance frontiers, phi placement
+    and renaming. The instructions of the blocks are not changed.
+    param flow_graph: the cfg.CFG of the function
+    return: the SSAForm
+    '''
+    order = flow_graph.find_dominators()
+    ssa = SSAForm(order)
+    place_phis(flow_graph, order, ssa)
+    rename(order, ssa)
+    return ssa
+
+
+def from_ssa(flow_graph, ir):
+    '''
+    Leave SSA form once a pass rewrote the function to ir. The values of a
+    name never overlap (see the top of this file), so every name keeps its
+    register or stack slot for all of its values and the phis disappear
+    without copies. The blocks and edges are built again since jumps and
+    blocks may have been removed, and dead stores are removed, ready for
+    the interference graph.
+    param flow_graph: the cfg.CFG of the function, rebuilt from ir
+    return: the IR of the function
+    '''
+    flow_graph.rebuild(ir)
+    return flow_graph.run_dead_store_elimination()
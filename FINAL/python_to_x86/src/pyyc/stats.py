@@ -0,0 +1,181 @@
+# stats.py
+# Per-pass compile statistics (--time-passes / --stats=json).
+import json
+import resource
+import time
+from contextlib import contextmanager
+from compiler.ast import Node
+from utils import num_registers, registers, VARIABLE
+
+
+def child_nodes(node):
+    '''
+    Children of an AST node. Our own nodes (InjectFrom, Let, GetFunPtr, ...)
+    do not implement getChildNodes, so look at their attributes instead.
+    '''
+    children = node.getChildNodes()
+    if children is not None:
+        return children
+    children = []
+    for value in vars(node).values():
+        if isinstance(value, Node):
+            children.append(value)
+        elif isinstance(value, (list, tuple)):
+            children.extend(v for v in value if isinstance(v, Node))
+    return children
+
+
+def count_ast_nodes(node):
+    '''
+    Count the nodes of an AST.
+    '''
+    count = 0
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        count += 1
+        stack.extend(child_nodes(n))
+    return count
+
+
+def peak_rss_kb():
+    '''
+    Peak resident set size of this process so far (kilobytes on Linux).
+    It only grows: what a pass adds is the difference between its value
+    at the end and at the start of the pass, and a pass that fits in
+    memory freed by earlier passes adds nothing.
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PassRecord(dict):
+    '''
+    Measurements of one pass. The helpers are no-ops when statistics
+    are disabled so that passes never pay for counting.
+    '''
+
+    def __init__(self, name, enabled):
+        dict.__init__(self, name=name)
+        self.enabled = enabled
+
+    def set(self, key, value):
+        if self.enabled:
+            self[key] = value
+
+    def ast(self, node):
+        if self.enabled:
+            self["ast_nodes"] = count_ast_nodes(node)
+
+    def ir(self, ir):
+        if self.enabled:
+            self["ir_insts"] = len(ir)
+
+    def graph(self, graph):
+        if self.enabled:
+            self["vertices"] = len(graph)
+            self["edges"] = graph.get_num_edges()
+
+    def allocation(self, graph):
+        '''
+        Registers given to variables and number of variables on the stack
+        '''
+        if self.enabled:
+            used = set()
+            spilled = 0
+            for vertex in graph.get_vertices():
+                col = graph.get_color(vertex)
+                if graph.get_type(vertex) != VARIABLE or col is None:
+                    continue
+                if col < num_registers:
+                    used.add(registers[col])
+                else:
+                    spilled += 1
+            self["registers_used"] = sorted(used)
+            self["spilled"] = spilled
+
+
+class PassStats(object):
+    '''
+    Collects a PassRecord per pass. Passes run inside begin_function/
+    end_function are filed under that function, the others under the
+    whole program.
+    '''
+
+    def __init__(self, filename=None, enabled=True):
+        self.filename = filename
+        self.enabled = enabled
+        self.passes = []
+        self.functions = []
+        self.function = None
+        self.start_rss_kb = peak_rss_kb() if enabled else 0
+
+    @contextmanager
+    def timed(self, name):
+        record = PassRecord(name, self.enabled)
+        start_rss_kb = peak_rss_kb() if self.enabled else 0
+        start = time.time()
+        yield record
+        if not self.enabled:
+            return
+        record["time"] = time.time() - start
+        record["rss_growth_kb"] = peak_rss_kb() - start_rss_kb
+        if self.function is not None:
+            self.function["passes"].append(record)
+        else:
+            self.passes.append(record)
+
+    def begin_function(self, name):
+        if self.enabled:
+            self.function = {"name": name, "passes": []}
+            self.functions.append(self.function)
+
+    def end_function(self):
+        self.function = None
+
+    def total_time(self):
+        total = sum(p["time"] for p in self.passes)
+        for function in self.functions:
+            total += sum(p["time"] for p in function["passes"])
+        return total
+
+    def rss_growth_kb(self):
+        '''
+        Growth of the peak resident set size since the collector was created
+        '''
+        return peak_rss_kb() - self.start_rss_kb
+
+    def to_dict(self):
+        return {"file": self.filename,
+                "time": self.total_time(),
+                "rss_growth_kb": self.rss_growth_kb(),
+                "passes": self.passes,
+                "functions": self.functions}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def format_table(self):
+        '''
+        Human readable report in the spirit of -time-passes.
+        '''
+        lines = ["===== pass statistics: %s =====" % self.filename,
+                 "%10s %10s  %s" % ("time(s)", "+peak(KB)", "pass")]
+
+        def add(record, indent):
+            details = " ".join("%s=%s" % (k, record[k]) for k in sorted(record)
+                               if k not in ("name", "time", "rss_growth_kb"))
+            lines.append("%10.4f %10d  %s%s %s" % (record["time"], record["rss_growth_kb"],
+                                                   indent, record["name"], details))
+
+        for record in self.passes:
+            add(record, "")
+        for function in self.functions:
+            lines.append("%21s  function %s" % ("", function["name"]))
+            for record in function["passes"]:
+                add(record, "  ")
+        lines.append("%10.4f %10d  total" % (self.total_time(), self.rss_growth_kb()))
+        return "\n".join(lines)
+
+
+# Shared collector for callers that do not ask for statistics
+disabled = PassStats(enabled=False)
@@ -0,0 +1,248 @@
+# typeinfer.py
+# Flow sensitive type inference over the closure converted AST, run
+# between closure conversion and explicate. Every expression whose value
+# is known to be an int, a bool or a big at compile time is recorded, and
+# explicate leaves out the dispatch branches that cannot run.
+# Functions are analyzed one at a time: their parameters and the free
+# variables they read from the closure are of unknown type.
+import compiler
+from compiler.ast import AssName, Assign, Stmt, If, While
+from utils import INT, BOOL, BIG
+
+
+def join(a, b):
+    '''
+    Type of a value that is either of type a or of type b (None is unknown)
+    '''
+    return a if a == b else None
+
+
+def join_env(a, b):
+    '''
+    Types of the variables after two paths meet
+    '''
+    return dict((name, typ) for name, typ in a.iteritems() if b.get(name) == typ)
+
+
+def is_small(typ):
+    '''
+    Whether values of the type are ints or bools, which add and compare as ints
+    '''
+    return typ in (INT, BOOL)
+
+
+class TypeInferenceVisitor(compiler.visitor.ASTVisitor):
+    '''
+    Walk the statements in order, keeping the type of every variable
+    assigned so far (env). Expressions return their type, None when it
+    is not known.
+    '''
+
+    def __init__(self):
+        self.env = {}
+        # expression node -> INT, BOOL, BIG or None
+        self.types = {}
+        # for every loop being visited: node -> what self.types held for
+        # it before the current visit of the loop body
+        self.loops = []
+
+    def type_of(self, node):
+        '''
+        Type of an expression, recorded in self.types. A node met at two
+        points of the program (closure conversion shares the name of a
+        function between get_fun_ptr and get_free_vars) gets the join of
+        its types.
+        '''
+        typ = self.visit(node)
+        if self.loops and node not in self.loops[-1]:
+            self.loops[-1][node] = self.types.get(node, False)
+        if node in self.types:
+            self.types[node] = join(self.types[node], typ)
+        else:
+            self.types[node] = typ
+        return typ
+
+    # Statements
+
+    def visitModule(self, node):
+        self.visit(node.node)
+
+    def visitStmt(self, node):
+        for child in node.nodes:
+            self.visit(child)
+
+    def visitFunction(self, node):
+        env = self.env
+        self.env = {}
+        self.visit(node.code)
+        self.env = env
+
+    def visitAssign(self, node):
+        typ = self.type_of(node.expr)
+        for target in node.nodes:
+            if isinstance(target, AssName):
+                if typ is None:
+                    self.env.pop(target.name, None)
+                else:
+                    self.env[target.name] = typ
+            else:
+                self.type_of(target)
+
+    def visitDiscard(self, node):
+        self.type_of(node.expr)
+
+    def visitPrintnl(self, node):
+        for child in node.nodes:
+            self.type_of(child)
+
+    def visitReturn(self, node):
+        self.type_of(node.value)
+
+    def visitIf(self, node):
+        self.type_of(node.tests[0][0])
+        env = dict(self.env)
+        self.visit(node.tests[0][1])
+        then_env = self.env
+        self.env = env
+        if node.else_ is not None:
+            self.visit(node.else_)
+        self.env = join_env(then_env, self.env)
+
+    def visitWhile(self, node):
+        # the types at the head of the loop only get less precise, so
+        # this stops after at most one visit per variable of the loop
+        while True:
+            entry = dict(self.env)
+            self.loops.append({})
+            self.type_of(node.test)
+            self.visit(node.body)
+            before = self.loops.pop()
+            head = join_env(entry, self.env)
+            self.env = head
+            if head == entry:
+                break
+            # visit the body again with the types of the head
+            for expr, typ in before.iteritems():
+                if typ is False:
+                    del self.types[expr]
+                else:
+                    self.types[expr] = typ
+        if self.loops:
+            for expr, typ in before.iteritems():
+                self.loops[-1].setdefault(expr, typ)
+
+    # Expressions
+
+    def visitConst(self, node):
+        return INT
+
+    def visitName(self, node):
+        if node.name in ['True', 'False']:
+            return BOOL
+        return self.env.get(node.name)
+
+    def visitAdd(self, node):
+        left = self.type_of(node.left)
+        right = self.type_of(node.right)
+        if is_small(left) and is_small(right):
+            return INT
+        if left == BIG and right == BIG:
+            return BIG
+        return None
+
+    def visitUnarySub(self, node):
+        self.type_of(node.expr)
+        return INT
+
+    def visitCompare(self, node):
+        self.type_of(node.expr)
+        for op, child in node.ops:
+            self.type_of(child)
+        return BOOL
+
+    def visitNot(self, node):
+        self.type_of(node.expr)
+        return BOOL
+
+    def visitAnd(self, node):
+        # the value is one of the operands
+        types = [self.type_of(child) for child in node.nodes]
+        return reduce(join, types)
+
+    visitOr = visitAnd
+
+    def visitIfExp(self, node):
+        self.type_of(node.test)
+        return join(self.type_of(node.then), self.type_of(node.else_))
+
+    def visitList(self, node):
+        for child in node.nodes:
+            self.type_of(child)
+        return BIG
+
+    def visitDict(self, node):
+        for key, value in node.items:
+            self.type_of(key)
+            self.type_of(value)
+        return BIG
+
+    def visitSubscript(self, node):
+        self.type_of(node.expr)
+        for sub in node.subs:
+            self.type_of(sub)
+        return None
+
+    def visitCallFunc(self, node):
+        args = [self.type_of(arg) for arg in node.args]
+        if getattr(node.node, "name", None) == "input" and not args:
+            # flatten injects the int read by input()
+            return INT
+        self.type_of(node.node)
+        return None
+
+    def visitCreateClosure(self, node):
+        return BIG
+
+    def visitGetFunPtr(self, node):
+        self.type_of(node.func)
+        return None
+
+    visitGetFreeVars = visitGetFunPtr
+
+
+def int_variables(function, types):
+    '''
+    The variables of a function that are only ever assigned ints, so they
+    can hold the untagged value. The parameters arrive tagged and are left out.
+    param function: a Function of the closure converted AST
+    param types: the types found by get_types
+    return: set of variable names
+    '''
+    assigned = {}
+    work = [function.code]
+    while work:
+        node = work.pop()
+        if isinstance(node, Stmt):
+            work.extend(node.nodes)
+        elif isinstance(node, If):
+            work.append(node.tests[0][1])
+            if node.else_ is not None:
+                work.append(node.else_)
+        elif isinstance(node, While):
+            work.append(node.body)
+        elif isinstance(node, Assign):
+            for target in node.nodes:
+                if isinstance(target, AssName):
+                    assigned.setdefault(target.name, set()).add(types.get(node.expr))
+    return set(name for name, kinds in assigned.iteritems()
+               if kinds == set([INT])) - set(function.argnames)
+
+
+def get_types(node):
+    '''
+    Types of the expressions of a closure converted AST
+    return: dict expression node -> INT, BOOL or BIG, expressions of
+            unknown type are not in it
+    '''
+    types = compiler.visitor.walk(node, TypeInferenceVisitor()).types
+    return dict((expr, typ) for expr, typ in types.iteritems() if typ is not None)
@@ -4,10 +4,10 @@
 ###########################################################
 
 from cProfile import label
-import re
+from array import array
+from bisect import bisect_left, insort
 from datetime import datetime
 from os import path
-import sys
 
 #############################################################
 # Utility Classes for Semantic Analysis and Code Generation #
@@ -15,123 +15,177 @@ import sys
 
 
 class Graph(object):
-    class Vertex():
-        def __init__(self, name):
-            self.name = name
-            self.possible_colors = set()
-            self.neighbors = set()
-            self.color = None
-            self.type = REGISTER if name in [
-                EAX, EBX, ECX, EDX, ESP, EBP, ESI, EDI] else STACK if FRAMEBASE in name else CONST if re.match(r'^\d+$', name) else VARIABLE
-            self.unspillable = False
-
-        def __str__(self):
-            return "\nVertex(Name(%s), \n\t Neighbors(%s), \n\t PossibleColors(%s), \n\t Color(%s), \n\t Type(%s), \n\t Unspillable(%s))\n" % (
-                str(self.name), str(self.neighbors), str(self.possible_colors), str(self.color), str(self.type), str(self.unspillable))
-
-        def __repr__(self):
-            return self.__str__()
-
-        def __eq__(self, other):
-            return self.name == other.name
-
-        def __ne__(self, other):
-            return not self.__eq__(other)
-
-        def __hash__(self):
-            return hash(self.name)
+    '''
+    Vertices are numbered densely in the order they are added and their
+    attributes are kept in lists indexed by that number, the public methods
+    still take and return vertex names.
+    Up to DENSE_LIMIT vertices the edges are also kept in a bit matrix (one
+    python int per row) so interferes is a single bit test; a larger graph
+    drops the matrix and looks edges up in the sorted neighbor arrays.
+    Coalescing merges a vertex into another one (merge): the merged name
+    stays in the graph as another name of the vertex it was merged into.
+    '''
+    DENSE_LIMIT = 2048
 
     def __init__(self, directed=False):
-        self.__vertices = {}
+        self.__index = {}
+        self.__names = []
+        self.__colors = []
+        self.__types = []
+        self.__unspillable = []
+        # sorted array of neighbor ids per vertex
+        self.__neighbors = []
+        # bit matrix rows while the graph is small, None afterwards
+        self.__matrix = []
+        self.__num_edges = 0
+        # ids of the vertices merged into another one, and the names
+        # of the vertices that others were merged into
+        self.__merged = set()
+        self.__aliases = {}
         self.__directed = directed
 
     def add_vertex(self, name):
-        if self.__vertices.get(name) is None:
-            self.__vertices[name] = self.Vertex(name)
+        if name in self.__index:
+            return
+        self.__index[name] = len(self.__names)
+        self.__names.append(name)
+        self.__colors.append(None)
+        self.__types.append(vertex_type(name))
+        self.__unspillable.append(False)
+        self.__neighbors.append(array("i"))
+        if self.__matrix is not None:
+            if len(self.__names) > self.DENSE_LIMIT:
+                self.__matrix = None
+            else:
+                self.__matrix.append(0)
 
     def add_edge(self, v1, v2):
-        self.__vertices[v1].neighbors.add(v2)
+        '''
+        Add the edge v1 - v2 (v1 -> v2 if directed).
+        Self edges and edges that already exist are ignored.
+        '''
+        i = self.__index[v1]
+        j = self.__index[v2]
+        if i == j or self.__has_edge(i, j):
+            return
+        self.__num_edges += 1
+        self.__link(i, j)
         if not self.__directed:
-            self.__vertices[v2].neighbors.add(v1)
+            self.__link(j, i)
 
-    # Gives a vertex given a name.
-    def get_vertex(self, name):
-        return self.__vertices.get(name)
+    def __has_edge(self, i, j):
+        if self.__matrix is not None:
+            return (self.__matrix[i] >> j) & 1 == 1
+        neighbors = self.__neighbors[i]
+        k = bisect_left(neighbors, j)
+        return k < len(neighbors) and neighbors[k] == j
+
+    def __link(self, i, j):
+        insort(self.__neighbors[i], j)
+        if self.__matrix is not None:
+            self.__matrix[i] |= 1 << j
 
-    def get_most_constrained_vertex(self):
+    def merge(self, v1, v2):
         '''
-        Most constrained vertex is the one that is not yet colored and has the fewest possible colors.
-        If there are more than one, the one with the most neighbors is chosen.
+        Merge v2 into v1 (undirected graphs only): v1 gets the edges of v2
+        and the name v2 refers to v1 from now on.
         '''
-        least_possible_colors = sys.maxint
-        most_constrained_vertex = []
-        for v in filter(lambda v: v.color == None, self.__vertices.values()):
-            if len(v.possible_colors) < least_possible_colors:
-                least_possible_colors = len(v.possible_colors)
-                most_constrained_vertex = [v.name]
-            elif len(v.possible_colors) == least_possible_colors or v.unspillable:
-                most_constrained_vertex.append(v.name)
-        if len(most_constrained_vertex) == 0:
-            return None
-
-        # If there are more than one, the one with the most neighbors is chosen.
-        most_constrained_vertex = sorted(most_constrained_vertex, key=lambda v: len(
-            self.__vertices[v].neighbors), reverse=True)
-        # If there are unspillable vertices, bring them to the front of the list.
-        most_constrained_vertex = sorted(
-            most_constrained_vertex, key=lambda v: self.__vertices[v].unspillable, reverse=True)
-        return most_constrained_vertex[0]
+        i = self.__index[v1]
+        j = self.__index[v2]
+        if i == j:
+            return
+        for k in self.__neighbors[j]:
+            neighbors = self.__neighbors[k]
+            del neighbors[bisect_left(neighbors, j)]
+            if self.__matrix is not None:
+                self.__matrix[k] &= ~(1 << j)
+            if k == i or self.__has_edge(i, k):
+                self.__num_edges -= 1
+            else:
+                self.__link(i, k)
+                self.__link(k, i)
+        self.__neighbors[j] = array("i")
+        if self.__matrix is not None:
+            self.__matrix[j] = 0
+        self.__merged.add(j)
+        names = self.__aliases.pop(j, [self.__names[j]])
+        for name in names:
+            self.__index[name] = i
+        self.__aliases.setdefault(i, [self.__names[i]]).extend(names)
+
+    def interferes(self, v1, v2):
+        '''
+        Whether there is an edge from v1 to v2
+        '''
+        i = self.__index.get(v1)
+        j = self.__index.get(v2)
+        return i is not None and j is not None and self.__has_edge(i, j)
+
+    # Gives the number of a vertex given a name, None if it is not in the graph.
+    def get_vertex(self, name):
+        return self.__index.get(name)
 
     def get_vertices(self):
-        return self.__vertices.keys()
+        if not self.__merged:
+            return list(self.__names)
+        return [v for i, v in enumerate(self.__names) if i not in self.__merged]
+
+    def get_name(self, v):
+        '''
+        The name of the vertex v was merged into (v itself if it was not merged)
+        '''
+        return self.__names[self.__index[v]]
 
     def get_edges(self):
         edges = []
-        for v in self.__vertices:
-            for neighbor in self.__vertices[v].neighbors:
-                edges.append((v, neighbor))
+        for i, v in enumerate(self.__names):
+            for j in self.__neighbors[i]:
+                edges.append((v, self.__names[j]))
         return edges
 
+    def get_num_edges(self):
+        return self.__num_edges
+
     def get_neighbors(self, v):
-        return self.__vertices[v].neighbors
+        names = self.__names
+        return [names[j] for j in self.__neighbors[self.__index[v]]]
 
-    def get_possible_colors(self, v):
-        return self.__vertices[v].possible_colors
+    def get_degree(self, v):
+        return len(self.__neighbors[self.__index[v]])
 
     def get_color(self, v):
-        return self.__vertices[v].color
+        return self.__colors[self.__index[v]]
 
     def get_type(self, v):
-        return self.__vertices[v].type
+        return self.__types[self.__index[v]]
 
     def is_unspillable(self, v):
-        return self.__vertices[v].unspillable
-
-    def set_possible_colors(self, v, possible_colors):
-        self.__vertices[v].possible_colors = set(possible_colors)
+        return self.__unspillable[self.__index[v]]
 
     def set_color(self, v, color):
-        self.__vertices[v].color = color
+        self.__colors[self.__index[v]] = color
 
     def set_type(self, v, type):
-        self.__vertices[v].type = type
+        self.__types[self.__index[v]] = type
 
     def set_unspillable(self, v, unspillable):
-        self.__vertices[v].unspillable = unspillable
+        self.__unspillable[self.__index[v]] = unspillable
 
     def __str__(self):
         out = "Undirected Graph(" if not self.__directed else "Directed Graph("
-        out += str(self.__vertices) + ")"
+        out += ", ".join(["%s: Vertex(Neighbors(%s), Color(%s), Type(%s), Unspillable(%s))" % (
+            v, self.get_neighbors(v), self.get_color(v), self.get_type(v), self.is_unspillable(v))
+            for v in self.get_vertices()]) + ")"
         return out
 
     def __len__(self):
-        return len(self.__vertices)
+        return len(self.__names) - len(self.__merged)
 
     def __repr__(self):
         return self.__str__()
 
     def __contains__(self, v):
-        return v in self.__vertices
+        return v in self.__index
 
 
 class Stack:
@@ -214,6 +268,10 @@ class InstGen():
         self.instructions.append("jne %s" % str(label))
         return self
 
+    def je(self, label):
+        self.instructions.append("je %s" % str(label))
+        return self
+
     def ifeq(self, lhs, rhs, label=None):
         if is_int(lhs):
             lhs = "$%s" % lhs
@@ -222,6 +280,14 @@ class InstGen():
         self.then_(label)
         return self
 
+    def ifne(self, lhs, rhs, label=None):
+        if is_int(lhs):
+            lhs = "$%s" % lhs
+        self.cmpl(lhs, rhs)
+        self.je("else_" + str(label))
+        self.then_(label)
+        return self
+
     def whileeq(self, lhs, rhs, label=None):
         if is_int(lhs):
             lhs = "$%s" % lhs
@@ -288,6 +354,12 @@ class InstGen():
         self.instructions.append("shr %s, %s" % (str(src), str(dst)))
         return self
 
+    def sar(self, src, dst):
+        if is_int(src):
+            src = "$%s" % src
+        self.instructions.append("sar %s, %s" % (str(src), str(dst)))
+        return self
+
     def label(self, label):
         self.instructions.append("%s:" % str(label))
         return self
@@ -325,6 +397,13 @@ def tmpvar(prefix="tmp"):
     return prefix + "_" + datetime.now().strftime("%d") + "_" + str(tmpvar.counter)
 
 
+def reset_tmpvar():
+    '''
+    Restart the temporary variable numbering (once per compiled file).
+    '''
+    tmpvar.counter = 0
+
+
 def is_int(s):
     if (isinstance(s, int)):
         return True
@@ -334,6 +413,19 @@ def is_int(s):
     return s.isdigit()
 
 
+def vertex_type(name):
+    '''
+    Classify a location name: register, stack slot, constant or variable.
+    '''
+    if name in all_registers:
+        return REGISTER
+    if FRAMEBASE in name:
+        return STACK
+    if name.isdigit():
+        return CONST
+    return VARIABLE
+
+
 def flatten_list(seq):
     '''
     Flatten 2D list into 2D list
@@ -372,6 +464,16 @@ def read_file(filename):
         return f.read().splitlines()
 
 
+def write_debug_file(debug_prefix, name, data):
+    '''
+    Write an intermediate dump for debugging (--emit-debug).
+    Usage: write_debug_file("out/test1", "_gvn_main.ir", ir) writes out/test1_gvn_main.ir
+    Nothing is written when debug_prefix is None.
+    '''
+    if debug_prefix is not None:
+        write_to_file(debug_prefix + name, data)
+
+
 # CONSTANTS
 
 #######################################
@@ -391,19 +493,28 @@ ESP = "%esp"
 EBP = "%ebp"
 SHIFT = 2 # Projection/Injection SHIFT for tag management
 MASK = 3
+# tags of the values, see runtime.h
+INT_TAG = 0
+BOOL_TAG = 1
+BIG_TAG = 3
 FRAMEBASE = "(%ebp)"
 REGISTER = "register"
 STACK = "stack"
 CONST = "const"
 VARIABLE = "variable"
-SPILLFILE = "spill.ir"
 LAMBDA = "lambda"
 CONDITIONAL = "conditional"
 UNCONDITIONAL = "unconditional"
 
 registers = [EAX, EBX, ECX, EDX, ESI, EDI]
+all_registers = frozenset([EAX, EBX, ECX, EDX, ESP, EBP, ESI, EDI])
 num_registers = len(registers)
 caller_saved_registers = [EAX, ECX, EDX]
+callee_saved_registers = [EBX, ESI, EDI]
+# Colors in the order the allocators try them: a value that is not live
+# across a call takes a caller saved register, so the callee saved ones
+# stay free for the values that are
+register_preference = [registers.index(r) for r in caller_saved_registers + callee_saved_registers]
 
 
 def from_ebp(offset):
@@ -2,21 +2,28 @@ import utils
 from utils import registers, num_registers, CONST
 from utils import EAX, EBX, ECX, EDX, ESP, EBP, ESI, EDI, from_ebp, REGISTER
 from utils import InstGen
+from ir import Opcode
+
+
+def frame_size(graph):
+    '''
+    Bytes of stack the function needs for its variables: one 4 byte slot
+    per stack color up to the highest one used
+    '''
+    colors = [graph.get_color(vertex) for vertex in graph.get_vertices()]
+    highest = max([col for col in colors if col is not None] + [0])
+    return max(4 * (highest - num_registers + 1), 0)
 
 
 class x86CodeGen():
     def __init__(self, ):
         self.x86asm = InstGen()
+        # movl whose operands ended up in the same location
+        self.moves_removed = 0
 
     def x86gen(self, graph, ir, func_name="main"):
         stack = utils.Stack()
-        colored_vertices = set(
-            filter(lambda x: graph.get_color(x) != None, graph.get_vertices()))
-        colored_vertices_color = set(
-            map(lambda x: graph.get_color(x), colored_vertices))
-        offset = max(colored_vertices_color.union(([0])))
-        offset = max(4*(offset - num_registers + 1), 0)
-        global_offset = offset
+        global_offset = frame_size(graph)
         # Setup Assembly Prologue
         self.x86asm.globl(func_name) \
                 .label(func_name) \
@@ -28,37 +35,38 @@ class x86CodeGen():
                 .pushl(EBX) \
                 .raw_append("")
 
-        for line in ir:
-                stmt = line.split()
-                if not stmt:
-                    self.x86asm.raw_append(line)
+        for inst in ir:
+                if inst.is_label():
+                    self.x86asm.raw_append(inst)
                     continue
-                opcode = stmt[0]
-                for i, x in enumerate(stmt[1:]):
-                    name = x.strip(',')
-                    loc = name
-                    if name in graph.get_vertices():
-                        color = graph.get_color(name)
+                opcode = inst.opcode
+                locs = []
+                for op in inst.operands:
+                    loc = op.name
+                    if loc in graph:
+                        color = graph.get_color(loc)
                         if color >= num_registers:
                             offset = -4*(color-num_registers + 1)
                             loc = from_ebp(offset=offset)
                         else:
                             loc = registers[color]
-                    stmt[i+1] = x.replace(name, loc)
+                    locs.append(loc)
 
-                if opcode == "movl" and stmt[1] == stmt[2] + ',':
+                if opcode is Opcode.MOVL and locs[0] == locs[1]:
+                    self.moves_removed += 1
                     continue
 
 
-                if opcode == "call":
-                    op1 = stmt[1]
-                    if op1 in registers:
+                if opcode is Opcode.CALL:
+                    op1 = locs[0]
+                    # a function pointer in a register or a stack slot
+                    if op1 in registers or EBP in op1:
                         self.x86asm.call("*" + op1)
                     else:
                         self.x86asm.call(op1)
 
                 else:
-                    self.x86asm.raw_append(' '.join(stmt))
+                    self.x86asm.raw_append(opcode + " " + ", ".join(locs))
 
         # Setup Assembly Epilogue/Teardown
         self.x86asm.raw_append("") \
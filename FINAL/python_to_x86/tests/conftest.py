@@ -2,24 +2,10 @@ import pytest
 
 import os
 
-from test_compiler import Pyyctest, Result, default_pyyctests
+from test_compiler import Pyyctest, Result, default_pyyctests, find_pyyctests
 
 ### Code
 
-def find_pyyctests(root):
-    # type: (str) -> List[str]
-    acc = []
-    def loop(root):
-        # type: (str) -> List[str]
-        if os.path.isfile(root):
-            if Pyyctest.base_of_testname(root) != None:
-                acc.append(root)
-        elif os.path.isdir(root):
-            for sub in os.listdir(root):
-                loop(os.path.join(root,sub))
-    loop(root)
-    return acc
-
 @pytest.fixture
 def filename_py(request):
     runtime_result = Pyyctest.build_runtime()
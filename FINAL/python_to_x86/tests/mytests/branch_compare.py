@@ -0,0 +1,30 @@
+n = input()
+i = 0
+seen = 0
+while i != n:
+    if i == 2:
+        seen = seen + 10
+    else:
+        seen = seen + 1
+    i = i + 1
+print seen
+flag = n == 5
+count = 0
+while flag:
+    count = count + 1
+    flag = count != 3
+print count
+if i is n:
+    print 1
+else:
+    print 0
+if n + -5:
+    print 2
+else:
+    print 3
+if not flag:
+    print 4
+else:
+    print 5
+print 6 if i != 0 else 7
+print 8 if flag else 9
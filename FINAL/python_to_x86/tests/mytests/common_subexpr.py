@@ -0,0 +1,14 @@
+x = input()
+y = x + 1
+a = x + y
+b = x + y
+if a != b:
+    print 0
+else:
+    print a + b
+c = x + y
+while x != 0:
+    d = x + y
+    print d + c
+    x = x + -1
+print c + x + y
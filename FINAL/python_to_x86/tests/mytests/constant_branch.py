@@ -0,0 +1,23 @@
+n = input()
+debug = 0
+limit = 3 + -1
+if debug:
+    print -1
+else:
+    print limit
+total = 0
+i = 0
+while i != n:
+    if i == limit:
+        total = total + 10
+    else:
+        total = total + i
+    i = i + 1
+print total
+print 1 == 1
+print not 0
+print True and 0
+print 0 or False
+l = [1, 2] + [n]
+print l if n else l + l
+print n if n != 0 else -n
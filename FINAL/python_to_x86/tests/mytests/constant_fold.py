@@ -0,0 +1,46 @@
+x = input()
+one = 1
+yes = True
+print one is yes
+print one == yes
+print 1 is 1
+print yes is not True
+print 0 and x
+print 1 and x
+print x and 0 and 1
+print 0 or False or x
+print 2 or x
+print one and yes and 0
+print not one
+print -yes + one
+while one == 0:
+    print 99
+if not yes:
+    print 98
+else:
+    if one + one == 2:
+        print 97
+    else:
+        print 96
+k = 5
+if x == 0:
+    k = 6
+else:
+    k = k + 1
+print k
+def scale(v):
+    factor = 3
+    return [v, factor]
+print scale(one)
+print (yes if x else one) + one
+if x:
+    print 5
+else:
+    unused = 3
+if x:
+    print 6
+else:
+    if 0:
+        print 95
+    else:
+        also_unused = 4
@@ -0,0 +1,28 @@
+n = input()
+a = 1
+b = 2
+c = 3
+d = 4
+e = 5
+f = 6
+g = 7
+h = 8
+i = 0
+total = 0
+while i != n:
+    t1 = a + b
+    t2 = c + d
+    t3 = e + f
+    t4 = g + h
+    total = total + t1 + t2 + t3 + t4 + i
+    a = b
+    b = c + -1
+    c = d
+    d = e + 1
+    e = f
+    f = g
+    g = h + -2
+    h = t1
+    i = i + 1
+print total
+print [a, b, c, d, e, f, g, h]
@@ -0,0 +1,21 @@
+def add(a, b):
+    return a + b
+def neg(a):
+    return -a
+def truth(v):
+    return 1 if v else 0
+n = input()
+print add(n, -9)
+print add(-3, True)
+print neg(add(n, -9))
+print add([n], [-1])
+print truth([])
+print truth([0])
+print truth({})
+print truth({1: 2})
+print truth(-4)
+print truth(0)
+print truth(False)
+print truth(n + -n)
+print not add(n, -n)
+print add(False, False) == 0
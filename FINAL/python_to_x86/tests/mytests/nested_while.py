@@ -0,0 +1,14 @@
+n = input()
+total = 0
+i = 0
+while i != n:
+    j = 0
+    while j != i:
+        k = 0
+        while k != j:
+            total = total + 1
+            k = k + 1
+        j = j + 1
+    print total
+    i = i + 1
+print total
@@ -0,0 +1,18 @@
+# More values are live across the loop and the print calls than there
+# are callee saved registers, so some stay on the stack and are split
+# around the calls
+n = input()
+a = input()
+b = n + 7
+c = n + 7
+d = input()
+e = input()
+i = 0
+while i != 2:
+    i = i + 1
+    c = b + e
+f = -d
+d = c + a
+print d
+print f
+print e
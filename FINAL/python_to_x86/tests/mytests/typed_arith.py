@@ -0,0 +1,30 @@
+n = input()
+i = 0
+s = 0
+while i != n:
+    s = s + i + True
+    i = i + 1
+print s
+x = 1
+while n != 0:
+    print x + x
+    x = [n]
+    n = n + -1
+print x
+y = 2
+if s == 3:
+    y = [y]
+else:
+    s = s + 1
+print y + y
+b = s == 3
+print b + 1
+print b is True
+print 1 is True
+print [1] + [b]
+def add(a):
+    return a + s
+print add(1)
+f = lambda z: z + z
+print f([2]) + f([3])
+print (i if i != 0 else False) + 1
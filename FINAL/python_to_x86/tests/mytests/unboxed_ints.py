@@ -0,0 +1,25 @@
+n = input()
+i = 0
+s = 0
+while i != n:
+    s = s + i
+    i = i + 1
+print s
+m = -s + 3
+print m
+l = [s, m, 0]
+print l[i + -n]
+d = {s: m}
+print d[s]
+def twice(x):
+    return x + x
+print twice(m)
+def count():
+    return i
+print count()
+k = 1 if n == 3 else 2
+print k + -k
+print k == True
+print i is n
+e = input() + 1
+print e
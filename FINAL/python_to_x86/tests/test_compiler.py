@@ -3,8 +3,12 @@
 import pytest
 
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
+import time
+import multiprocessing
 
 #import enum
 
@@ -83,12 +87,15 @@ class Pyyctest:
         popen = subprocess.Popen(['make', '-C', root_dir], stdout=subprocess.PIPE)
         return popen_result(popen)
 
-    def compile(self):
-        # type: () -> Result
+    def compile(self, cwd=None, allocator=None):
+        # type: (Optional[str], Optional[str]) -> Result
+        env = dict(os.environ)
+        if not (allocator is None):
+            env['PYYC_FLAGS'] = '--regalloc={}'.format(allocator)
         with open(self.compileout, 'w') as outfile:
             with open(self.compileerr, 'w') as errfile:
                 popen = subprocess.Popen(['bash', pyyc, self.pysource],
-                                         stdout=outfile, stderr=errfile)
+                                         stdout=outfile, stderr=errfile, cwd=cwd, env=env)
         return popen_result(popen)
 
     def link(self):
@@ -134,6 +141,80 @@ def test_compiler(filename_py):
     assert pyyctest.run_exe() != Result.failure
     assert pyyctest.diff_with_python() != Result.failure
 
+### Parallel Runner
+
+def run_pyyctest(filename_py):
+    # type: (str) -> (str, str, Optional[str])
+    """Runs every stage of one test.
+
+    Returns (filename, outcome, failed stage) where outcome is one of
+    'passed', 'failed' or 'skipped'. The compiler runs in a scratch
+    directory so that concurrent compiles cannot clobber each other's
+    intermediate files.
+    """
+    try:
+        pyyctest = Pyyctest(filename_py)
+    except ValueError:
+        return (filename_py, 'skipped', 'python')
+    if pyyctest.run_python() == Result.failure:
+        return (filename_py, 'skipped', 'python')
+    scratch = tempfile.mkdtemp(prefix='pyyctest')
+    try:
+        if pyyctest.compile(cwd=scratch) == Result.failure:
+            return (filename_py, 'failed', 'compile')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if pyyctest.link() == Result.failure:
+        return (filename_py, 'failed', 'link')
+    if pyyctest.run_exe() == Result.failure:
+        return (filename_py, 'failed', 'run')
+    if pyyctest.diff_with_python() == Result.failure:
+        return (filename_py, 'failed', 'diff')
+    return (filename_py, 'passed', None)
+
+def run_parallel(filenames, jobs, out=sys.stdout):
+    # type: (List[str], int, file) -> (int, int)
+    """Runs the tests over a pool of jobs worker processes.
+
+    Every worker takes the next test as soon as it is done with its
+    previous one, so the python, compile, link and run stages of
+    different tests overlap. One line is printed per test as it finishes,
+    followed by a pytest-like summary line that extract_failpass reads.
+    """
+    start = time.time()
+    counts = {'passed': 0, 'failed': 0, 'skipped': 0}
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for (filename, outcome, stage) in pool.imap_unordered(run_pyyctest, sorted(filenames)):
+            counts[outcome] += 1
+            if outcome == 'passed':
+                print >> out, '{} PASSED'.format(filename)
+            else:
+                print >> out, '{} {} ({})'.format(filename, outcome.upper(), stage)
+            out.flush()
+    finally:
+        pool.close()
+        pool.join()
+    summary = ', '.join('{} {}'.format(counts[k], k)
+                        for k in ['failed', 'passed', 'skipped'] if counts[k])
+    print >> out, '=== {} in {:.2f} seconds ==='.format(summary or 'no tests ran',
+                                                      time.time() - start)
+    return (counts['failed'], counts['passed'])
+
+def find_pyyctests(root):
+    # type: (str) -> List[str]
+    acc = []
+    def loop(root):
+        # type: (str) -> List[str]
+        if os.path.isfile(root):
+            if Pyyctest.base_of_testname(root) != None:
+                acc.append(root)
+        elif os.path.isdir(root):
+            for sub in os.listdir(root):
+                loop(os.path.join(root,sub))
+    loop(root)
+    return acc
+
 ### Cog Autograding Interface
 
 def extract_failpass(log):
@@ -147,7 +228,28 @@ def extract_failpass(log):
         return int(match.group(1)) if not (match is None) else 0
     return (extract(r'(\d+) failed'), extract(r'(\d+) passed'))
 
+def build_all():
+    # type: () -> bool
+    """Builds the run-time system and the compiler, as the pytest fixture does."""
+    if Pyyctest.build_runtime() == Result.failure:
+        print >> sys.stderr, 'Failed to build the run-time system.'
+        return False
+    if Pyyctest.build_compiler() == Result.failure:
+        print >> sys.stderr, 'Failed to build your compiler.'
+        return False
+    return True
+
 def autograde_cog(args):
+    if args.jobs is not None:
+        if not build_all():
+            return 1
+        (nfail, npass) = run_parallel(find_pyyctests(os.path.realpath(os.path.abspath(args.pyyctests))), args.jobs, sys.stderr)
+        if nfail == 0 and npass == 0:
+            print >> sys.stderr, 'Error extracting score!'
+            return 1
+        ntotal = nfail + npass
+        print('{:.4f}'.format((npass / (ntotal * 1.0)) * args.outof))
+        return 1 if nfail else 0
     popen = subprocess.Popen([python_exe, '-m', 'pytest', this_file, '--pyyctests', args.pyyctests],
                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     (out, err) = popen.communicate()
@@ -173,6 +275,22 @@ def main(argv):
         return pytest.main(sys.argv[0] + xargs)
     test_parser.set_defaults(cmd=test_cmd)
 
+    run_parser = subparsers.add_parser('run', help='run the tests in parallel without pytest')
+    run_parser.add_argument('--jobs', '-j',
+                            help='number of tests to run at once (default: number of CPUs)',
+                            metavar='N',
+                            type=int,
+                            default=multiprocessing.cpu_count())
+    run_parser.add_argument('--pyyctests',
+                            help='pyyc test file name or root directory (default: {})'.format(default_pyyctests),
+                            default=default_pyyctests)
+    def run_cmd(args, _):
+        if not build_all():
+            return 1
+        (nfail, _) = run_parallel(find_pyyctests(os.path.realpath(os.path.abspath(args.pyyctests))), args.jobs)
+        return 1 if nfail else 0
+    run_parser.set_defaults(cmd=run_cmd)
+
     grade_parser = subparsers.add_parser('grade', help='run with autograder interface')
     grade_parser.add_argument('--outof',
                               help='compute score out of N (default: {})'.format(default_outof),
@@ -186,6 +304,11 @@ def main(argv):
     grade_parser.add_argument('--pyyctests',
                               help='pyyc test file name or root directory (default: {})'.format(default_pyyctests),
                               default=default_pyyctests)
+    grade_parser.add_argument('--jobs', '-j',
+                              help='run the tests on N processes instead of through pytest',
+                              metavar='N',
+                              type=int,
+                              default=None)
     def grade_cmd(args, _):
         if args.grader == 'cog':
             return autograde_cog(args)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python2
+
+# Tests of the register allocators (compile.py --regalloc). Apart from
+# test_linear_scan, they look at the statistics the allocator records
+# (compile.py --stats=json) rather than at the output of the programs.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from test_compiler import Pyyctest, Result, find_pyyctests, python_exe, root_dir, this_dir
+
+compile_py = os.path.join(root_dir, 'src', 'pyyc', 'compile.py')
+mytests = os.path.join(this_dir, 'mytests')
+
+sys.path.insert(0, os.path.dirname(compile_py))
+import utils
+import cfg
+import interferencegraph
+import color_and_spill
+import ir as IR
+from stats import PassRecord
+from x86gen import frame_size
+
+def allocation_stats(tmpdir, name):
+    # type: (py.path.local, str) -> List[dict]
+    """Compiles mytests/name with --stats=json.
+
+    Returns the color_and_spill record of every function.
+    """
+    source = os.path.join(str(tmpdir), name)
+    shutil.copy(os.path.join(mytests, name), source)
+    subprocess.check_call([python_exe, compile_py, '--stats=json', source])
+    with open(os.path.splitext(source)[0] + '.stats.json') as statsfile:
+        stats = json.load(statsfile)
+    return [record for function in stats['functions'] for record in function['passes']
+            if record['name'] == 'color_and_spill']
+
+@pytest.mark.parametrize('name', sorted(os.path.basename(test_py)
+                                         for test_py in find_pyyctests(mytests)))
+def test_linear_scan(tmpdir, name):
+    # type: (py.path.local, str) -> None
+    # Runs mytests/name compiled with --regalloc=linear. The test is copied
+    # to tmpdir so that its outputs do not clobber those of test_compiler.
+    source = os.path.join(str(tmpdir), name)
+    shutil.copy(os.path.join(mytests, name), source)
+    test_in = os.path.splitext(os.path.join(mytests, name))[0] + '.in'
+    if os.path.exists(test_in):
+        shutil.copy(test_in, str(tmpdir))
+    pyyctest = Pyyctest(source)
+    if pyyctest.run_python() == Result.failure:
+        pytest.skip('Test file {} not valid'.format(name))
+    assert Pyyctest.build_runtime() != Result.failure
+    assert pyyctest.compile(cwd=str(tmpdir), allocator='linear') != Result.failure
+    assert pyyctest.link() != Result.failure
+    assert pyyctest.run_exe() != Result.failure
+    assert pyyctest.diff_with_python() != Result.failure
+
+def test_split_around_calls(tmpdir):
+    # type: (py.path.local) -> None
+    records = allocation_stats(tmpdir, 'split_calls.py')
+    assert sum(record['split'] for record in records) > 0
+
+def test_pack_stack_slots_closes_gaps():
+    # type: () -> None
+    # stack colors pinned by earlier spill rounds, nobody uses the second
+    # slot any more and c can share a slot with a or b
+    graph = utils.Graph()
+    for name in ['a', 'b', 'c']:
+        graph.add_vertex(name)
+    graph.add_edge('a', 'b')
+    graph.set_color('a', utils.num_registers)
+    graph.set_color('b', utils.num_registers + 2)
+    graph.set_color('c', utils.num_registers + 3)
+    assert frame_size(graph) == 16
+    assert color_and_spill.pack_stack_slots(graph) == (4, 2)
+    assert graph.get_color('a') != graph.get_color('b')
+    assert frame_size(graph) == 8
+
+def test_rematerialize_constant():
+    # type: () -> None
+    # k always holds $7 and is read by an addl while six values are live
+    # across calls, more than there are callee saved registers
+    values = ['v{}'.format(i) for i in range(6)]
+    lines = ['main:', 'movl $7, k']
+    for value in values:
+        lines += ['call input', 'movl %eax, ' + value]
+    for value in values:
+        lines += ['addl k, ' + value, 'pushl ' + value, 'call print_any', 'addl $4, %esp']
+    for value in values:
+        lines += ['pushl ' + value, 'call print_any', 'addl $4, %esp']
+    lines += ['movl $0, %eax']
+    flow_graph = cfg.CFG(IR.parse_ir(lines))
+    flow_graph.build_cfg()
+    record = PassRecord('color_and_spill', True)
+    (graph, ir) = color_and_spill.color_and_spill(
+        interferencegraph.create_interference_graph(flow_graph), flow_graph, record)
+    assert record['rematerialized'] > 0
+    assert not [inst for inst in ir if 'k' in [op.name for op in inst.operands]]
+    assert len([inst for inst in ir if str(inst).startswith('addl $7, ')]) == len(values)
+
+def test_spill_binary_op_on_stack():
+    # type: () -> None
+    # both operands of the orl are in stack slots
+    graph = utils.Graph()
+    for name in ['a', 'b']:
+        graph.add_vertex(name)
+    graph.add_edge('a', 'b')
+    graph.set_color('a', utils.num_registers)
+    graph.set_color('b', utils.num_registers + 1)
+    (ir, spilled) = color_and_spill.generate_spillcode(IR.parse_ir(['orl a, b']), graph)
+    assert spilled
+    assert [inst.opcode for inst in ir] == [IR.Opcode.MOVL, IR.Opcode.ORL, IR.Opcode.MOVL]
+    assert ir[1].operands[1].name not in ['a', 'b']
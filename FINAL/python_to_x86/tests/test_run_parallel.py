@@ -0,0 +1,26 @@
+#!/usr/bin/env python2
+
+# Tests of the parallel runner itself, kept out of test_compiler.py so
+# that the pytest autograding run only counts the compiler tests.
+
+import os
+import StringIO
+
+import pytest
+
+from test_compiler import run_parallel, extract_failpass, build_all
+
+def test_run_parallel_summary(tmpdir):
+    # type: (py.path.local) -> None
+    if not build_all():
+        pytest.skip('cannot build the run-time system or the compiler')
+    for (name, source) in [('one.py', 'print 1\n'), ('two.py', 'x = 2\nprint x + 3\n')]:
+        tmpdir.join(name).write(source)
+    filenames = [os.path.join(str(tmpdir), name) for name in ['one.py', 'two.py']]
+    out = StringIO.StringIO()
+    (nfail, npass) = run_parallel(filenames, 2, out)
+    log = out.getvalue()
+    assert (nfail, npass) == (0, 2)
+    for filename in filenames:
+        assert '{} PASSED'.format(filename) in log.splitlines()
+    assert extract_failpass(log) == (0, 2)